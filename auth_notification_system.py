@@ -13,6 +13,19 @@ from bs4 import BeautifulSoup
 import schedule
 import threading
 from apscheduler.schedulers.background import BackgroundScheduler
+from utils.page_ready import ReadyWaiter, LOGIN_READY, SCHEDULE_READY, SCHEDULE_RESERVATIONS_READY, RESERVE_CHANGE_READY
+from utils.browser_context import new_blocking_context, NO_CSS_BLOCK_TYPES
+from utils.shared_browser import shared_browser
+from utils.page_extract import evaluate_schedule
+from utils.slot_engine import build_available_slots
+from utils.slot_index import SlotIndexCache, WatermarkTracker
+from utils.swr_cache import StaleWhileRevalidateCache, SharedInvalidations, SharedResults
+from utils.supabase_batch import SupabaseBatchWriter
+from utils.job_runner import JobRunner
+from utils.job_queue import JobQueue, PRIORITY_INTERACTIVE, PRIORITY_BULK
+from utils.leader_lock import LeaderLock
+from utils.line_sender import get_line_sender
+from utils.crawl_tiers import CrawlFreshnessStore
 # from supabase import create_client の行は削除
 
 load_dotenv()
@@ -57,6 +70,11 @@ MAPPING_FILE = 'customer_mapping.json'
 ABSENCE_FILE = 'absence_log.json'
 MESSAGES_FILE = 'messages.json'
 
+# バックグラウンド処理（クロール・予約変更・ログインテスト）のジョブキュー。種別はそれぞれの処理の近くで登録
+job_queue = JobQueue()
+# 予約変更APIがジョブの完了を待つ秒数（過ぎたら202とジョブIDを返す。gunicornの--timeout 300より短く）
+BOOKING_CHANGE_WAIT_SECONDS = int(os.getenv('BOOKING_CHANGE_WAIT_SECONDS', '240'))
+
 ADMIN_USERS = {
     'admin': 'admin123'
 }
@@ -245,62 +263,69 @@ def get_full_name(username):
         return STAFF_USERS[username]['full_name']
     return username
 
-def send_line_message(user_id, message, token=None, max_retries=3):
+def send_line_message_async(user_id, message, token=None):
+    """LINE送信を予約してFuture（結果は送信成否）を返す。リトライ・レート制限は送信側のワーカーで行う"""
     if token is None:
         token = LINE_BOT_TOKEN
-    """LINE送信（リトライ＋エラーログ機能付き）"""
-    # テストモード：実際に送信しない
-    if os.getenv("TEST_MODE", "false").lower() == "true":
-        print(f"[テストモード] {user_id[:8]}... → {message[:30]}...")
-        return True
-    
-    if not token:
-        print("[エラー] LINE_BOT_TOKENが設定されていません")
-        return False
-    
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json'
-    }
-    data = {
-        'to': user_id,
-        'messages': [{'type': 'text', 'text': message}]
+    return get_line_sender(token).submit(user_id, message)
+
+def send_line_message(user_id, message, token=None):
+    """LINE送信（リトライ＋エラーログ機能付き）。送信完了まで待って成否を返す"""
+    return send_line_message_async(user_id, message, token).result()
+
+# 一斉送信で届かなかった宛先の記録（管理画面に表示。どのワーカーが送っても同じファイルに追記）
+LINE_FAILURE_LOG = os.path.join('logs', 'line_failures.jsonl')
+
+def record_line_failures(purpose, future):
+    """broadcastのFutureの完了時に呼ばれ、届かなかった宛先をLINE_FAILURE_LOGに追記する"""
+    try:
+        failed = future.result()['failed']
+        error = None
+    except Exception as e:
+        failed, error = [], str(e)
+    if not failed and error is None:
+        return
+    names = {info['line_id']: info['full_name'] for info in STAFF_USERS.values()}
+    entry = {
+        'detected_at': datetime.now().isoformat(),
+        'purpose': purpose,
+        'failed': [{'user_id': str(uid), 'name': names.get(uid, '')} for uid in failed],
+        'error': error
     }
-    
-    for attempt in range(max_retries):
+    print(f"[LINE] {purpose}: 送信失敗 {len(failed)}人{f'（{error}）' if error else ''}", flush=True)
+    try:
+        os.makedirs(os.path.dirname(LINE_FAILURE_LOG), exist_ok=True)
+        with open(LINE_FAILURE_LOG, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    except OSError as e:
+        print(f"[LINE] 送信失敗ログの書き込みエラー: {e}", flush=True)
+
+def load_line_failures(limit=20):
+    """直近の送信失敗（新しい順）"""
+    try:
+        with open(LINE_FAILURE_LOG, 'r', encoding='utf-8') as f:
+            lines = f.readlines()[-limit:]
+    except FileNotFoundError:
+        return []
+    entries = []
+    for line in reversed(lines):
         try:
-            response = requests.post(
-                'https://api.line.me/v2/bot/message/push',
-                headers=headers,
-                json=data,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                if attempt > 0:
-                    print(f"[成功] {attempt + 1}回目の試行で送信成功")
-                return True
-            else:
-                print(f"[警告] LINE API エラー: {response.status_code} - {response.text}")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)  # 指数バックオフ: 1秒、2秒、4秒
-                    
-        except requests.exceptions.Timeout:
-            print(f"[エラー] タイムアウト (試行 {attempt + 1}/{max_retries})")
-            if attempt < max_retries - 1:
-                time.sleep(2 ** attempt)
-                
-        except requests.exceptions.RequestException as e:
-            print(f"[エラー] リクエスト失敗 (試行 {attempt + 1}/{max_retries}): {str(e)}")
-            if attempt < max_retries - 1:
-                time.sleep(2 ** attempt)
-                
-        except Exception as e:
-            print(f"[エラー] 予期しないエラー: {str(e)}")
-            return False
-    
-    print(f"[失敗] {max_retries}回の試行後も送信失敗")
-    return False
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries
+
+def broadcast_line_messages(items, token=None, purpose='一斉送信'):
+    """[(user_id, message), ...] を送信。同じ文面はmulticast（500人ずつ）にまとめる
+
+    Future（結果は {'sent': [user_id, ...], 'failed': [user_id, ...]}）を返す。
+    届かなかった宛先は完了時にLINE_FAILURE_LOGに記録する（呼び出し側が結果を待たなくても残る）
+    """
+    if token is None:
+        token = LINE_BOT_TOKEN
+    future = get_line_sender(token).broadcast(items)
+    future.add_done_callback(lambda f: record_line_failures(purpose, f))
+    return future
 
 
 def notify_shop_booking_change(customer_name, old_datetime, new_datetime, staff_name=""):
@@ -316,7 +341,7 @@ def notify_shop_booking_change(customer_name, old_datetime, new_datetime, staff_
     # 管理者に通知
     admin_line_id = os.getenv('ADMIN_LINE_USER_ID')
     if admin_line_id:
-        send_line_message(admin_line_id, message, LINE_BOT_TOKEN_STAFF)
+        send_line_message_async(admin_line_id, message, LINE_BOT_TOKEN_STAFF)
 
 @app.route('/')
 def index():
@@ -725,16 +750,15 @@ def submit_absence():
     
     # 他のスタッフへの通知
     absence_message = MESSAGES["absence_request"].format(staff_name=full_name)
-    for username, info in STAFF_USERS.items():
-        if username != staff_name:
-            send_line_message(info['line_id'], absence_message, LINE_BOT_TOKEN_STAFF)
+    notifications = [(info['line_id'], absence_message) for username, info in STAFF_USERS.items() if username != staff_name]
     
     # 欠勤スタッフ本人への確認通知
     confirmation_message = MESSAGES["absence_confirmed"].format(
         reason=reason,
         details=details
     )
-    send_line_message(STAFF_USERS[staff_name]['line_id'], confirmation_message, LINE_BOT_TOKEN_STAFF)
+    notifications.append((STAFF_USERS[staff_name]['line_id'], confirmation_message))
+    broadcast_line_messages(notifications, LINE_BOT_TOKEN_STAFF, purpose=f'欠勤申請（{full_name}）')
     
     return redirect(url_for('absence_success'))
 
@@ -923,6 +947,16 @@ def admin():
     current_month = datetime.now().strftime("%Y年%m月")
     monthly_absences = sum(1 for a in absences if a.get("submitted_at", "").startswith(datetime.now().strftime("%Y-%m")))
     
+    # 8週間スクレイピングのティアごとの鮮度
+    try:
+        crawl_freshness = CrawlFreshnessStore().report(datetime.now(timezone(timedelta(hours=9))))
+    except Exception as e:
+        print(f"[TIER] 鮮度の取得エラー: {e}", flush=True)
+        crawl_freshness = []
+    
+    # 一斉送信で届かなかった宛先
+    line_failures = load_line_failures()
+    
     template = '''
     <!DOCTYPE html>
     <html>
@@ -1028,6 +1062,55 @@ def admin():
             </div>
         </div>
         
+        {% if crawl_freshness %}
+        <div class="content" style="margin-bottom: 20px;">
+            <h2 style="margin-top: 0; margin-bottom: 15px; font-size: 18px;">🔄 予約データの鮮度</h2>
+            <table style="width: 100%; border-collapse: collapse; font-size: 14px;">
+                <tr style="background: #f5f5f5; text-align: left;">
+                    <th style="padding: 8px;">ティア</th>
+                    <th style="padding: 8px;">対象日</th>
+                    <th style="padding: 8px;">取得間隔</th>
+                    <th style="padding: 8px;">最新</th>
+                    <th style="padding: 8px;">遅延・未取得</th>
+                    <th style="padding: 8px;">最も古い取得</th>
+                </tr>
+                {% for tier in crawl_freshness %}
+                <tr style="border-top: 1px solid #eee;">
+                    <td style="padding: 8px; font-weight: bold;">{{ tier.name }}</td>
+                    <td style="padding: 8px;">+{{ tier.first_day }}〜+{{ tier.last_day }}日</td>
+                    <td style="padding: 8px;">{{ tier.interval_minutes }}分</td>
+                    <td style="padding: 8px;">{{ tier.fresh_days }} / {{ tier.days }}日</td>
+                    <td style="padding: 8px; color: {{ '#d32f2f' if tier.stale_days else '#2e7d32' }};">{{ tier.stale_days }}日</td>
+                    <td style="padding: 8px;">{% if tier.oldest_age_seconds is none %}-{% else %}{{ tier.oldest_age_seconds // 60 }}分前{% endif %}</td>
+                </tr>
+                {% endfor %}
+            </table>
+        </div>
+        {% endif %}
+        
+        {% if line_failures %}
+        <div class="content" style="margin-bottom: 20px;">
+            <h2 style="margin-top: 0; margin-bottom: 15px; font-size: 18px;">⚠️ LINE送信失敗（直近）</h2>
+            <table style="width: 100%; border-collapse: collapse; font-size: 14px;">
+                <tr style="background: #f5f5f5; text-align: left;">
+                    <th style="padding: 8px;">日時</th>
+                    <th style="padding: 8px;">内容</th>
+                    <th style="padding: 8px;">届かなかった宛先</th>
+                </tr>
+                {% for entry in line_failures %}
+                <tr style="border-top: 1px solid #eee;">
+                    <td style="padding: 8px; white-space: nowrap;">{{ entry.detected_at[:16].replace('T', ' ') }}</td>
+                    <td style="padding: 8px;">{{ entry.purpose }}</td>
+                    <td style="padding: 8px; color: #d32f2f;">
+                        {% for target in entry.failed %}{{ target.name or target.user_id[:8] ~ '…' }}{% if not loop.last %}、{% endif %}{% endfor %}
+                        {% if entry.error %}{{ entry.error }}{% endif %}
+                    </td>
+                </tr>
+                {% endfor %}
+            </table>
+        </div>
+        {% endif %}
+        
         <div class="nav-wrapper">
             <div class="nav">
                 <a href="{{ url_for('admin') }}" class="nav-btn active">メッセージ管理画面</a>
@@ -1064,7 +1147,8 @@ def admin():
     success = request.args.get('success')
     return render_template_string(template, messages=MESSAGES, success=success, 
                                  customer_count=customer_count, monthly_absences=monthly_absences, 
-                                 total_absences=total_absences)
+                                 total_absences=total_absences, crawl_freshness=crawl_freshness,
+                                 line_failures=line_failures)
 
 @app.route('/customers')
 @admin_required
@@ -1368,16 +1452,14 @@ def webhook():
                     staff_name = staff_info['name']
                     
                     if "欠勤" in text or "休み" in text:
-                        for uid, info in staff_mapping.items():
-                            if uid != user_id:
-                                msg = MESSAGES["absence_request"].format(staff_name=staff_name)
-                                send_line_message(uid, msg)
+                        msg = MESSAGES["absence_request"].format(staff_name=staff_name)
+                        broadcast_line_messages([(uid, msg) for uid in staff_mapping if uid != user_id],
+                                                purpose=f'欠勤連絡（{staff_name}）')
                     
                     elif "出勤" in text or "できます" in text:
-                        for uid, info in staff_mapping.items():
-                            if uid != user_id:
-                                notification = MESSAGES["substitute_confirmed"].format(substitute_name=staff_name)
-                                send_line_message(uid, notification)
+                        notification = MESSAGES["substitute_confirmed"].format(substitute_name=staff_name)
+                        broadcast_line_messages([(uid, notification) for uid in staff_mapping if uid != user_id],
+                                                purpose=f'代理出勤（{staff_name}）')
                 
                 else:
                     mapping = load_mapping()
@@ -1905,9 +1987,39 @@ def test_salonboard_login():
         }), 500
 
 
-# グローバル変数
-login_results = {}
-login_lock = threading.Lock()
+def run_test_login(payload):
+    """salonboard_login.pyを別プロセスで実行して結果ファイルを返す（180秒タイムアウト）"""
+    import subprocess
+    task_id = payload['task_id']
+    print(f"[SUBPROCESS] タスク開始: {task_id}", flush=True)
+    
+    # 完全に独立したプロセスとして実行
+    result = subprocess.run(
+        ['python3', 'salonboard_login.py', task_id],
+        capture_output=True,
+        text=True,
+        timeout=180,
+        env=os.environ.copy()
+    )
+    
+    print(f"[SUBPROCESS] stdout: {result.stdout}", flush=True)
+    print(f"[SUBPROCESS] stderr: {result.stderr}", flush=True)
+    
+    # 結果ファイルから読み込み
+    result_file = f"/tmp/login_result_{task_id}.json"
+    if not os.path.exists(result_file):
+        return {
+            'success': False,
+            'error': 'Result file not found',
+            'stdout': result.stdout,
+            'stderr': result.stderr
+        }
+    with open(result_file, 'r') as f:
+        result_data = json.load(f)
+    os.remove(result_file)
+    return result_data
+
+job_queue.register('test_login', run_test_login, max_attempts=1)
 
 @app.route('/health_check', methods=['GET'])
 def health_check():
@@ -1923,73 +2035,25 @@ def health_check():
 
 @app.route('/test_async', methods=['GET'])
 def test_async():
-    """subprocess版非同期ログインテスト"""
-    import subprocess
-    task_id = datetime.now().strftime('%Y%m%d%H%M%S%f')
-    
-    def bg_login():
-        try:
-            print(f"[SUBPROCESS] タスク開始: {task_id}", flush=True)
-            
-            # 完全に独立したプロセスとして実行（180秒タイムアウト）
-            result = subprocess.run(
-                ['python3', 'salonboard_login.py', task_id],
-                capture_output=True,
-                text=True,
-                timeout=180,
-                env=os.environ.copy()
-            )
-            
-            print(f"[SUBPROCESS] stdout: {result.stdout}", flush=True)
-            print(f"[SUBPROCESS] stderr: {result.stderr}", flush=True)
-            
-            # 結果ファイルから読み込み
-            result_file = f"/tmp/login_result_{task_id}.json"
-            if os.path.exists(result_file):
-                with open(result_file, 'r') as f:
-                    result_data = json.load(f)
-                with login_lock:
-                    login_results[task_id] = result_data
-                os.remove(result_file)
-            else:
-                with login_lock:
-                    login_results[task_id] = {
-                        'success': False,
-                        'error': 'Result file not found',
-                        'stdout': result.stdout,
-                        'stderr': result.stderr
-                    }
-                    
-        except subprocess.TimeoutExpired:
-            print(f"[SUBPROCESS] タイムアウト（180秒）: {task_id}", flush=True)
-            with login_lock:
-                login_results[task_id] = {
-                    'success': False,
-                    'error': 'Subprocess timeout after 180 seconds',
-                    'error_type': 'TimeoutExpired'
-                }
-        except Exception as e:
-            print(f"[SUBPROCESS] エラー: {str(e)}", flush=True)
-            with login_lock:
-                login_results[task_id] = {
-                    'success': False,
-                    'error': str(e),
-                    'error_type': type(e).__name__
-                }
-    
-    threading.Thread(target=bg_login, daemon=True).start()
+    """subprocess版非同期ログインテスト（ジョブキューで実行）"""
+    job_id = job_queue.enqueue('test_login', {'task_id': datetime.now().strftime('%Y%m%d%H%M%S%f')})
+    token = job_queue.get(job_id)['token']
     return jsonify({
         'status': 'processing',
-        'task_id': task_id,
-        'check_url': f'/result/{task_id}',
+        'task_id': token,
+        'check_url': f'/jobs/{token}',
         'message': 'subprocess版ログイン処理を開始しました（タイムアウト180秒）'
     }), 202
 
 @app.route('/result/<task_id>', methods=['GET'])
 def get_result(task_id):
-    """結果確認"""
-    with login_lock:
-        return jsonify(login_results.get(task_id, {'status': 'processing'}))
+    """結果確認（/jobs/<token> の旧形式）"""
+    job = job_queue.get_by_token(task_id)
+    if job is None or job['status'] not in ('succeeded', 'failed'):
+        return jsonify({'status': 'processing'})
+    if job['status'] == 'failed':
+        return jsonify({'success': False, 'error': job['error']})
+    return jsonify(job['result'])
 
 if __name__ == '__main__':
     # 初期ファイル作成
@@ -2326,89 +2390,105 @@ def send_reminder_notifications(test_mode=False):
             normalized = c['name'].replace(" ", "").replace("　", "").replace("★", "").strip()
             name_to_customer[normalized] = c
     
-    for days, label in [(3, "3days"), (7, "7days")]:
-        target_date = (today + timedelta(days=days))
-        target_date_str = target_date.strftime("%Y-%m-%d")
-        scrape_date_str = today.strftime("%Y-%m-%d")
-        
-        # salon_bookingsから該当日の予約を取得
-        book_response = requests.get(
-            f'{SUPABASE_URL}/rest/v1/salon_bookings?scrape_date=eq.{scrape_date_str}&days_ahead=eq.{days}&select=booking_data&order=id.desc&limit=1',
-            headers=headers
-        )
-        if book_response.status_code != 200:
-            continue
+    # 今日の送信ログを1回で取得し、重複送信はメモリ上の (電話番号, 何日前) で判定
+    today_str = today.strftime("%Y-%m-%d")
+    log_response = requests.get(
+        f'{SUPABASE_URL}/rest/v1/reminder_logs?select=phone,days_ahead&sent_at=gte.{today_str}T00:00:00',
+        headers=headers
+    )
+    if log_response.status_code != 200:
+        # 判定できないまま送ると二重送信になるので中止
+        return {"error": "送信ログ取得失敗"}
+    sent_today = {(row.get('phone') or '', row.get('days_ahead')) for row in log_response.json()}
+    # 送信ログは最後にまとめてinsert（失敗したバッチは分割して再送）
+    log_writer = SupabaseBatchWriter(SUPABASE_URL, SUPABASE_KEY, 'reminder_logs', batch_size=500)
+    # 送信中のリマインド（Future, ラベル, 電話番号, お客様名, 何日前）
+    pending = []
+    
+    try:
+        for days, label in [(3, "3days"), (7, "7days")]:
+            target_date = (today + timedelta(days=days))
+            target_date_str = target_date.strftime("%Y-%m-%d")
+            scrape_date_str = today.strftime("%Y-%m-%d")
+        
+            # salon_bookingsから該当日の予約を取得
+            book_response = requests.get(
+                f'{SUPABASE_URL}/rest/v1/salon_bookings?scrape_date=eq.{scrape_date_str}&days_ahead=eq.{days}&select=booking_data&order=id.desc&limit=1',
+                headers=headers
+            )
+            if book_response.status_code != 200:
+                continue
         
-        result = book_response.json()
-        booking_data = result[0].get('booking_data', {}) if result else {}
-        bookings = booking_data.get('bookings', []) if isinstance(booking_data, dict) else []
-        
-        for booking in bookings:
-            customer_name = booking.get('お客様名', '').split('\n')[0].replace('★', '').strip()
-            phone = booking.get('電話番号', '')
-            visit_dt = booking.get('来店日時', '')
-            time = re.sub(r'^\d{1,2}/\d{1,2}', '', visit_dt) if visit_dt else ''
-            menu = booking.get('メニュー', '')
-            
-            # 顧客を検索
-            customer = None
-            if phone and phone in phone_to_customer:
-                customer = phone_to_customer[phone]
-            else:
-                normalized = customer_name.replace(" ", "").replace("　", "").replace("★", "").strip()
-                if normalized in name_to_customer:
-                    customer = name_to_customer[normalized]
+            result = book_response.json()
+            booking_data = result[0].get('booking_data', {}) if result else {}
+            bookings = booking_data.get('bookings', []) if isinstance(booking_data, dict) else []
+        
+            for booking in bookings:
+                customer_name = booking.get('お客様名', '').split('\n')[0].replace('★', '').strip()
+                phone = booking.get('電話番号', '')
+                visit_dt = booking.get('来店日時', '')
+                time = re.sub(r'^\d{1,2}/\d{1,2}', '', visit_dt) if visit_dt else ''
+                menu = booking.get('メニュー', '')
+            
+                # 顧客を検索
+                customer = None
+                if phone and phone in phone_to_customer:
+                    customer = phone_to_customer[phone]
+                else:
+                    normalized = customer_name.replace(" ", "").replace("　", "").replace("★", "").strip()
+                    if normalized in name_to_customer:
+                        customer = name_to_customer[normalized]
             
-            if not customer or not customer.get('line_user_id'):
-                results[label]["no_match"] += 1
-                continue
+                if not customer or not customer.get('line_user_id'):
+                    results[label]["no_match"] += 1
+                    continue
             
-            # メッセージ作成
-            # 日時フォーマット
-            def format_dt(dt_str):
-                m = re.match(r'(\d+)/(\d+)(\d{2}:\d{2})', dt_str)
-                if m:
-                    month, day, tm = m.groups()
-                    from datetime import date
-                    weekdays = ['月', '火', '水', '木', '金', '土', '日']
-                    d = date(2025, int(month), int(day))
-                    return f"{month}月{day}日({weekdays[d.weekday()]}){tm}〜"
-                return dt_str
-            
-            # メニュークリーンアップ
-            def clean_menu(m):
-                has_off_shampoo = 'オフあり+アイシャンプー' in m or 'オフあり＋アイシャンプー' in m
-                exclude = ['【全員】', '【次回】', '【リピーター様】', '【4週間以内】', '【ご新規】',
-                    'オフあり+アイシャンプー', 'オフあり＋アイシャンプー', '次世代まつ毛パーマ', 'ダメージレス',
-                    '(4週間以内 )', '(4週間以内)', '(アイシャンプー・トリートメント付き)', '(SP・TR付)',
-                    '(コーティング・シャンプー・オフ込)', '(まゆげパーマ)', '(眉毛Wax)', '＋メイク付', '+メイク付',
-                    '指名料', 'カラー変更', '束感★']
-                for w in exclude:
-                    m = m.replace(w, '')
-                m = re.sub(r'\(ｸｰﾎﾟﾝ\)', '', m)
-                m = re.sub(r'《[^》]*》', '', m)
-                m = re.sub(r'【[^】]*】', '', m)
-                m = re.sub(r'◇エクステ.*', '', m)
-                m = re.sub(r'◇毛量調整.*', '', m)
-                m = re.sub(r'[¥￥][0-9,]+', '', m)
-                m = re.sub(r'^◇', '', m)
-                m = re.sub(r'◇$', '', m)
-                m = re.sub(r'◇\s*$', '', m)
-                parts = m.split('◇')
-                cleaned = [p.strip().strip('　') for p in parts if p.strip()]
-                m = '＋'.join(cleaned) if cleaned else ''
-                m = re.sub(r'\s+', ' ', m).strip()
-                if has_off_shampoo and m:
-                    m = f'{m}（オフあり+アイシャンプー）'
-                return m
-            
-            formatted_dt = format_dt(visit_dt)
-            cleaned_menu = clean_menu(menu)
-            
-            if days == 3:
-                # テストモード: 神原のみに送信
-                KANBARA_PHONE = "09015992055"
-                message = f"""{customer_name} 様
+                # メッセージ作成
+                # 日時フォーマット
+                def format_dt(dt_str):
+                    m = re.match(r'(\d+)/(\d+)(\d{2}:\d{2})', dt_str)
+                    if m:
+                        month, day, tm = m.groups()
+                        from datetime import date
+                        weekdays = ['月', '火', '水', '木', '金', '土', '日']
+                        d = date(2025, int(month), int(day))
+                        return f"{month}月{day}日({weekdays[d.weekday()]}){tm}〜"
+                    return dt_str
+            
+                # メニュークリーンアップ
+                def clean_menu(m):
+                    has_off_shampoo = 'オフあり+アイシャンプー' in m or 'オフあり＋アイシャンプー' in m
+                    exclude = ['【全員】', '【次回】', '【リピーター様】', '【4週間以内】', '【ご新規】',
+                        'オフあり+アイシャンプー', 'オフあり＋アイシャンプー', '次世代まつ毛パーマ', 'ダメージレス',
+                        '(4週間以内 )', '(4週間以内)', '(アイシャンプー・トリートメント付き)', '(SP・TR付)',
+                        '(コーティング・シャンプー・オフ込)', '(まゆげパーマ)', '(眉毛Wax)', '＋メイク付', '+メイク付',
+                        '指名料', 'カラー変更', '束感★']
+                    for w in exclude:
+                        m = m.replace(w, '')
+                    m = re.sub(r'\(ｸｰﾎﾟﾝ\)', '', m)
+                    m = re.sub(r'《[^》]*》', '', m)
+                    m = re.sub(r'【[^】]*】', '', m)
+                    m = re.sub(r'◇エクステ.*', '', m)
+                    m = re.sub(r'◇毛量調整.*', '', m)
+                    m = re.sub(r'[¥￥][0-9,]+', '', m)
+                    m = re.sub(r'^◇', '', m)
+                    m = re.sub(r'◇$', '', m)
+                    m = re.sub(r'◇\s*$', '', m)
+                    parts = m.split('◇')
+                    cleaned = [p.strip().strip('　') for p in parts if p.strip()]
+                    m = '＋'.join(cleaned) if cleaned else ''
+                    m = re.sub(r'\s+', ' ', m).strip()
+                    if has_off_shampoo and m:
+                        m = f'{m}（オフあり+アイシャンプー）'
+                    return m
+            
+                formatted_dt = format_dt(visit_dt)
+                cleaned_menu = clean_menu(menu)
+            
+                if days == 3:
+                    # テストモード: 神原のみに送信
+                    KANBARA_PHONE = "09015992055"
+                    message = f"""{customer_name} 様
 
 ご予約【3日前】のお知らせ🕊️
 【本店】
@@ -2434,8 +2514,8 @@ def send_reminder_notifications(test_mode=False):
 ◾️通常予約
 前日変更：施術代金の50％
 当日変更：施術代金の100％"""
-            else:
-                message = f"""{customer_name} 様
+                else:
+                    message = f"""{customer_name} 様
 ご予約日の【7日前】となりました🕊️
 {formatted_dt}
 {cleaned_menu}
@@ -2458,39 +2538,39 @@ def send_reminder_notifications(test_mode=False):
 前日変更：施術代金の50％
 当日変更：施術代金の100％"""
       
-            # 重複送信チェック
-            today_str = today.strftime("%Y-%m-%d")
-            dup_check = requests.get(
-                f'{SUPABASE_URL}/rest/v1/reminder_logs?phone=eq.{phone}&days_ahead=eq.{days}&sent_at=gte.{today_str}T00:00:00',
-                headers=headers
-            )
-            if dup_check.json():
-                continue  # 既に今日送信済み
+                # 重複送信チェック
+                if (phone, days) in sent_today:
+                    continue  # 既に今日送信済み
             
-            # テストモード: 神原以外はスキップ
-            if test_mode and phone != KAMBARA_PHONE:
-                continue
+                # テストモード: 神原以外はスキップ
+                if test_mode and phone != KAMBARA_PHONE:
+                    continue
             
-            # LINE送信
-            if send_line_message(customer['line_user_id'], message):
-                results[label]["sent"] += 1
-                status = "sent"
-            else:
-                results[label]["failed"] += 1
-                status = "failed"
+                # LINE送信（並列に送り、結果は全件の予約が終わってから集計）
+                sent_today.add((phone, days))
+                pending.append((send_line_message_async(customer['line_user_id'], message), label, phone, customer_name, days))
+    finally:
+        # 途中で例外になっても、送信を予約した分は結果を待ってログを保存する（保存しないと次回また送る）
+        for future, label, phone, customer_name, days in pending:
+            try:
+                status = "sent" if future.result() else "failed"
+            except Exception as e:
+                print(f"[REMINDER] 送信エラー: {customer_name}様（{days}日前）: {e}", flush=True)
+                status = "error"
+            results[label]["sent" if status == "sent" else "failed"] += 1
             
             # ログ保存
-            requests.post(
-                f'{SUPABASE_URL}/rest/v1/reminder_logs',
-                headers=headers,
-                json={'phone': phone, 'customer_name': customer_name, 'days_ahead': days, 'status': status}
-            )
+            log_writer.add({'phone': phone, 'customer_name': customer_name, 'days_ahead': days, 'status': status})
             
             # 神原に送信通知
             if status == "sent":
                 notify_message = f"✅ リマインド送信完了\n{customer_name}様（{days}日前）"
-                send_line_message("U9022782f05526cf7632902acaed0cb08", notify_message)
-    
+                send_line_message_async("U9022782f05526cf7632902acaed0cb08", notify_message)
+        
+        log_writer.flush()
+    if log_writer.failed_rows:
+        print(f"[REMINDER] 送信ログ保存失敗: {len(log_writer.failed_rows)}件", flush=True)
+    results["log"] = log_writer.summary()
     return results
 # ========== 8週間予約スクレイピング ==========
 @app.route('/api/scrape_8weeks', methods=['GET', 'POST'])
@@ -2729,49 +2809,99 @@ def scrape_test_1day_v2():
     
     return jsonify(results)
 
+def run_scrape_8weeks_v2(payload):
+    """scrape_8weeks_v2.pyを別プロセスで実行（ジョブキューから呼ばれる）"""
+    import subprocess
+    result = subprocess.run(['python3', 'scrape_8weeks_v2.py'], capture_output=True, text=True)
+    return {'returncode': result.returncode}
+
+job_queue.register('scrape_8weeks_v2', run_scrape_8weeks_v2, priority=PRIORITY_BULK, max_attempts=1)
+
 @app.route('/api/scrape_8weeks_v2', methods=['GET', 'POST'])
 def api_scrape_8weeks_v2():
     """8週間分の予約をスクレイピング（バックグラウンド実行）"""
-    import threading
-    import subprocess
-    
-    def run_scrape():
-        subprocess.run(['python3', 'scrape_8weeks_v2.py'], capture_output=True, text=True)
-    
-    thread = threading.Thread(target=run_scrape)
-    thread.start()
+    job_id = job_queue.enqueue('scrape_8weeks_v2', unique=True)
+    if job_id is None:
+        return jsonify({'success': False, 'message': '既に実行中です。しばらくお待ちください。'}), 429
     
-    return jsonify({'success': True, 'message': 'スクレイピング開始（バックグラウンド実行中）'})
+    return jsonify({'success': True, 'message': 'スクレイピング開始（バックグラウンド実行中）',
+                    'job_id': job_id, 'status_url': job_status_url(job_id)})
+
+def run_scrape_8weeks(concurrency=None):
+    """scrape_8weeks_v3をこのプロセス内で実行（サブプロセス・HTTP経由にしない）"""
+    import scrape_8weeks_v3
+    if concurrency is None:
+        return scrape_8weeks_v3.main()
+    return scrape_8weeks_v3.main(concurrency=concurrency)
+
+# 8週間スクレイピング（プロセス内の二重実行防止。履歴・所要時間はジョブキューのDBから見る）
+scrape_8weeks_job = JobRunner('scrape_8weeks', run_scrape_8weeks)
+
+def run_scrape_8weeks_job(payload):
+    """ジョブキューから呼ばれる8週間スクレイピング（結果に今回の実行記録が入る）"""
+    return scrape_8weeks_job.run(trigger=payload.get('trigger', 'queue'), concurrency=payload.get('concurrency'))
 
-# 8週間スクレイピング実行中フラグ
-scrape_8weeks_running = False
+# 毎分のクロールが失敗しても次の回で取り直すのでリトライしない
+job_queue.register('scrape_8weeks', run_scrape_8weeks_job, priority=PRIORITY_BULK, max_attempts=1)
+
+def enqueue_scrape_8weeks(trigger, concurrency=None):
+    """8週間スクレイピングをキューに追加（待機中・実行中ならスキップとして記録してNone）"""
+    job_id = job_queue.enqueue('scrape_8weeks', {'trigger': trigger, 'concurrency': concurrency}, unique=True)
+    if job_id is None:
+        job_queue.record_skip('scrape_8weeks', trigger)
+    return job_id
 
 @app.route('/api/scrape_8weeks_v3', methods=['GET', 'POST'])
 def api_scrape_8weeks_v3():
     """8週間分の予約をスクレイピング（二重実行防止付き）"""
-    global scrape_8weeks_running
+    # 並列ページ数（?concurrency=N、未指定ならスクレイパー側の既定値）
+    concurrency = request.args.get('concurrency', type=int)
+    if concurrency is None and request.is_json:
+        concurrency = (request.get_json(silent=True) or {}).get('concurrency')
+    if concurrency is not None:
+        try:
+            concurrency = int(concurrency)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'concurrencyは整数で指定してください'}), 400
     
     # 二重実行防止
-    if scrape_8weeks_running:
+    job_id = enqueue_scrape_8weeks('api', concurrency)
+    if job_id is None:
         return jsonify({'success': False, 'message': '既に実行中です。しばらくお待ちください。'}), 429
     
-    import threading
-    import subprocess
-    
-    def run_scrape():
-        global scrape_8weeks_running
-        scrape_8weeks_running = True
-        try:
-            subprocess.run(['python3', 'scrape_8weeks_v3.py'], timeout=1800)
-        except Exception as e:
-            print(f"スクレイピングエラー: {e}")
-        finally:
-            scrape_8weeks_running = False
-    
-    thread = threading.Thread(target=run_scrape)
-    thread.start()
-    
-    return jsonify({'success': True, 'message': 'スクレイピング開始（バックグラウンド実行中）'})
+    return jsonify({'success': True, 'message': 'スクレイピング開始（バックグラウンド実行中）',
+                    'job_id': job_id, 'status_url': job_status_url(job_id)})
+
+@app.route('/api/scrape_8weeks_v3/status', methods=['GET'])
+def api_scrape_8weeks_v3_status():
+    """8週間スクレイピングの実行状況・履歴・所要時間・重複スキップ回数
+
+    実行はリーダーのプロセスだけだが、履歴とスキップ回数は共有のジョブDBから読むのでどのワーカーが応答しても同じ
+    """
+    return jsonify({**job_queue.summary('scrape_8weeks'), 'leader': scheduler_leader.is_leader,
+                    'leader_pid': scheduler_leader.holder_pid()})
+
+def job_status_url(job_id):
+    """ジョブの状態を確認するURL（連番のIDではなく推測できないtokenで引く）"""
+    return f"/jobs/{job_queue.get(job_id)['token']}"
+
+@app.route('/jobs/<token>', methods=['GET'])
+def job_status(token):
+    """ジョブの状態（queued / running / succeeded / failed）と結果"""
+    job = job_queue.get_by_token(token)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    job.pop('payload', None)
+    job.pop('worker_pid', None)
+    return jsonify(job)
+
+@app.route('/jobs', methods=['GET'])
+@admin_required
+def job_list():
+    """直近のジョブと種別・状態ごとの件数"""
+    kind = request.args.get('kind')
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify({'counts': job_queue.counts(), 'jobs': job_queue.recent(limit, kind)})
 
 # ========== CSVインポート機能 ==========
 @app.route('/api/import-customers', methods=['POST'])
@@ -3278,19 +3408,35 @@ def api_liff_cancel_request():
 
 @app.route('/api/liff/execute-change', methods=['POST'])
 def api_liff_execute_change():
-    """予約日時を自動変更"""
-    from playwright.sync_api import sync_playwright
-    import re
-    
+    """予約日時を自動変更（クロールより優先してジョブキューで実行し、完了まで待つ）"""
     data = request.get_json()
     booking_id = data.get('booking_id')
     new_date = data.get('new_date')  # YYYYMMDD
     new_time = data.get('new_time')  # HH:MM
-    line_user_id = data.get('line_user_id')
     
     if not all([booking_id, new_date, new_time]):
         return jsonify({'error': 'booking_id, new_date, new_time required'}), 400
     
+    job_id = job_queue.enqueue('booking_change', {'booking_id': booking_id, 'new_date': new_date, 'new_time': new_time})
+    job = job_queue.wait(job_id, BOOKING_CHANGE_WAIT_SECONDS)
+    if job['status'] == 'succeeded':
+        return jsonify(job['result']['body']), job['result']['status']
+    if job['status'] == 'failed':
+        return jsonify({'error': job['error']}), 500
+    return jsonify({'status': job['status'], 'job_id': job_id, 'status_url': f"/jobs/{job['token']}"}), 202
+
+def run_booking_change(payload):
+    """予約日時を変更して {'body', 'status'} を返す（ジョブキューから呼ばれる）"""
+    body, status = execute_booking_change(payload['booking_id'], payload['new_date'], payload['new_time'])
+    return {'body': body, 'status': status}
+
+# 確定ボタンを押した後の失敗で二重に変更しないよう、リトライしない
+job_queue.register('booking_change', run_booking_change, priority=PRIORITY_INTERACTIVE, max_attempts=1)
+
+def execute_booking_change(booking_id, new_date, new_time):
+    """SalonBoardの予約変更ページで日時を変更し、(レスポンス, ステータスコード) を返す"""
+    from playwright.sync_api import sync_playwright
+    
     try:
         # 予約IDからSalonBoard用IDを取得
         supabase_url = os.getenv('SUPABASE_URL')
@@ -3304,15 +3450,16 @@ def api_liff_execute_change():
         )
         bookings = res.json()
         if not bookings:
-            return jsonify({'error': 'Booking not found'}), 404
+            return {'error': 'Booking not found'}, 404
         
         booking = bookings[0]
         old_datetime = booking.get('date_time', '')
         customer_name = booking.get('customer_name', '')
         
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context()
+        ready = ReadyWaiter('execute_change')
+        with sync_playwright() as p, shared_browser(p, 'execute_change', args=[]) as browser:
+            # カレンダーの表示判定（is_visible）にCSSが必要なのでCSSはブロックしない
+            context, block_stats = new_blocking_context(browser, 'execute_change', block_types=NO_CSS_BLOCK_TYPES)
             
             with open('session_cookies.json', 'r') as f:
                 cookies = json.load(f)
@@ -3321,7 +3468,7 @@ def api_liff_execute_change():
             page = context.new_page()
             url = f'https://salonboard.com/KLP/reserve/ext/extReserveChange/?reserveId={booking_id}'
             page.goto(url, timeout=60000)
-            page.wait_for_timeout(5000)
+            ready.wait(page, RESERVE_CHANGE_READY, 5000, label='extReserveChange')
             
             # 1. 日付変更
             current_date = page.query_selector('input[name="rsvDate"]').get_attribute('value')
@@ -3355,8 +3502,20 @@ def api_liff_execute_change():
             if confirm_btn:
                 confirm_btn.click()
                 page.wait_for_timeout(3000)
+                
+                # 4. 変更前後の日の空き枠をすぐに更新（次の全体クロールを待たない）
+                old_date = (booking.get('visit_datetime') or '')[:10].replace('-', '')
+                try:
+                    failed = refresh_slots_after_change(page, ready, [old_date, new_date], booking.get('staff', ''))
+                except Exception as e:
+                    print(f'[空き枠] 変更後の更新エラー: {e}')
+                    failed = [old_date, new_date]
+                # 取れなかった日は別ジョブで取り直す
+                enqueue_slot_refresh(failed, booking.get('staff', ''))
             
-            browser.close()
+            context.close()
+        ready.report()
+        block_stats.report()
         
         # 新しい日時文字列
         new_datetime = f'{new_date[:4]}/{new_date[4:6]}/{new_date[6:]} {new_time}'
@@ -3364,20 +3523,30 @@ def api_liff_execute_change():
         # 店舗に通知
         notify_shop_booking_change(customer_name, old_datetime, new_datetime)
         
-        return jsonify({'success': True, 'message': f'予約を{new_datetime}に変更しました'})
+        return {'success': True, 'message': f'予約を{new_datetime}に変更しました'}, 200
         
     except Exception as e:
         print(f'[予約変更エラー] {e}')
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        raise
 
 
 # === 空き枠取得API ===
+# available_slotsのウォーターマーク（updated_atの最大値）。範囲APIと空き枠検索で共有
+slots_watermark = WatermarkTracker()
+# 組み立て済みの範囲APIレスポンス（先頭日とウォーターマークが同じ間は使い回す）
+# ワーカーごとに持つが、作り直しはSupabaseへの1クエリだけで、ETagは内容のハッシュなのでワーカー間で一致する
+slots_range_cache = {'key': None, 'etag': None, 'body': None, 'gzip': None}
+slots_range_lock = threading.Lock()
+
 @app.route('/api/liff/available-slots-range', methods=['GET'])
 def api_liff_available_slots_range():
-    """14日分の空き枠をSupabaseから取得（高速）"""
+    """14日分の空き枠をSupabaseから取得（高速）
+    
+    available_slotsが更新されるまでは組み立て済みのレスポンスを返し、ETag一致なら304
+    """
     from datetime import datetime, timedelta
+    import gzip
+    import hashlib
     
     try:
         supabase_url = os.getenv('SUPABASE_URL')
@@ -3387,51 +3556,122 @@ def api_liff_available_slots_range():
         today = datetime.now()
         dates = [(today + timedelta(days=i)).strftime('%Y%m%d') for i in range(14)]
         
-        date_filter = ','.join(dates)
-        res = requests.get(
-            f'{supabase_url}/rest/v1/available_slots?date=in.({date_filter})',
-            headers=headers
-        )
-        
-        if res.status_code != 200:
-            return jsonify({'error': 'Database error'}), 500
-        
-        rows = res.json()
-        
-        all_data = {}
-        for date_str in dates:
-            day_rows = [r for r in rows if r['date'] == date_str]
-            staff_schedules = []
-            for r in day_rows:
-                staff_schedules.append({
+        # ウォーターマークが取れないときはキャッシュもETagも使わずに組み立てる
+        try:
+            key = (dates[0], slots_watermark.current(supabase_url, headers))
+        except Exception as e:
+            print(f'[空き枠取得] ウォーターマーク取得エラー、キャッシュなしで応答: {e}')
+            key = None
+        cached = None
+        if key is not None:
+            with slots_range_lock:
+                cached = dict(slots_range_cache) if slots_range_cache['key'] == key else None
+        
+        if cached is None:
+            date_filter = ','.join(dates)
+            res = requests.get(
+                f'{supabase_url}/rest/v1/available_slots?date=in.({date_filter})'
+                f'&select=date,staff_id,staff_name,is_day_off,slots',
+                headers=headers
+            )
+            
+            if res.status_code != 200:
+                return jsonify({'error': 'Database error'}), 500
+            
+            # 1回の走査で日付ごとにまとめる
+            all_data = {date_str: {'staff_schedules': []} for date_str in dates}
+            for r in res.json():
+                day = all_data.get(r['date'])
+                if day is None:
+                    continue
+                day['staff_schedules'].append({
                     'staff_id': r['staff_id'],
                     'staff_name': r['staff_name'],
                     'is_day_off': r['is_day_off'],
                     'available_slots': r['slots'] or []
                 })
-            all_data[date_str] = {'staff_schedules': staff_schedules}
-        
-        return jsonify({'dates': all_data})
+            
+            body = json.dumps({'dates': all_data}, ensure_ascii=False).encode('utf-8')
+            cached = {
+                'key': key,
+                'etag': hashlib.sha1(body).hexdigest(),
+                'body': body,
+                'gzip': gzip.compress(body)
+            }
+            if key is not None:
+                with slots_range_lock:
+                    slots_range_cache.update(cached)
+        
+        use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+        etag = cached['etag'] + ('-gz' if use_gzip else '') if key is not None else None
+        if etag and request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(cached['gzip'] if use_gzip else cached['body'])
+            response.headers['Content-Type'] = 'application/json'
+            if use_gzip:
+                response.headers['Content-Encoding'] = 'gzip'
+        if etag:
+            response.set_etag(etag)
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
         
     except Exception as e:
         print(f'[空き枠取得エラー] {e}')
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/liff/available-slots', methods=['GET'])
-def api_liff_available_slots():
-    """指定日のスタッフ空き枠を取得"""
-    from playwright.sync_api import sync_playwright
-    import re
+# 空き枠検索インデックス（available_slotsの更新時だけ作り直す）
+slot_index_cache = SlotIndexCache(slots_watermark)
+SLOT_SEARCH_STEPS = (5, 10, 15, 30, 60)
+
+@app.route('/api/liff/slot-search', methods=['GET'])
+def api_liff_slot_search():
+    """所要時間が収まる開始時刻を検索（duration必須、staff_id・from・to・stepは任意）"""
+    from datetime import datetime, timedelta, timezone
+    JST = timezone(timedelta(hours=9))
     
-    date_str = request.args.get('date')  # YYYYMMDD形式
+    try:
+        duration = int(request.args.get('duration', ''))
+        step = int(request.args.get('step', '10'))
+    except ValueError:
+        return jsonify({'error': 'duration (minutes) required'}), 400
+    if not 0 < duration <= 600 or step not in SLOT_SEARCH_STEPS:
+        return jsonify({'error': 'invalid duration or step'}), 400
+    
+    # 検索インデックスはJSTの今日以降を読み込むので、既定の範囲もJSTで決める
+    today = datetime.now(JST)
+    date_from = request.args.get('from') or today.strftime('%Y%m%d')
+    date_to = request.args.get('to') or (today + timedelta(days=13)).strftime('%Y%m%d')
+    staff_id = request.args.get('staff_id')
     
-    if not date_str:
-        return jsonify({'error': 'date parameter required'}), 400
+    try:
+        supabase_url = os.getenv('SUPABASE_URL')
+        supabase_key = os.getenv('SUPABASE_KEY')
+        headers = {'apikey': supabase_key, 'Authorization': f'Bearer {supabase_key}'}
+        index = slot_index_cache.get(supabase_url, headers)
+        
+        return jsonify({
+            'duration': duration,
+            'step': step,
+            'dates': index.search(duration, date_from, date_to, staff_id, step),
+            'updated_at': index.watermark
+        })
+    except Exception as e:
+        print(f'[空き枠検索エラー] {e}')
+        return jsonify({'error': str(e)}), 500
+
+def scrape_available_slots(date_str):
+    """スケジュールページから指定日のスタッフ空き枠を取得
     
+    戻り値: ((レスポンス, ステータスコード), キャッシュしてよいか)
+    """
+    from playwright.sync_api import sync_playwright
+    
+    ready = ReadyWaiter('available_slots')
     try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context()
+        with sync_playwright() as p, shared_browser(p, 'available_slots', args=[]) as browser:
+            context, block_stats = new_blocking_context(browser, 'available_slots')
             
             # Supabaseからクッキー取得を試みる
             page = context.new_page()
@@ -3462,7 +3702,7 @@ def api_liff_available_slots():
             
             url = f'https://salonboard.com/KLP/schedule/salonSchedule/?date={date_str}'
             page.goto(url, timeout=60000)
-            page.wait_for_timeout(3000)
+            ready.wait(page, SCHEDULE_READY, 3000, label='salonSchedule')
             
             # ログインが必要な場合
             if 'login' in page.url.lower():
@@ -3471,119 +3711,192 @@ def api_liff_available_slots():
                 login_password = os.environ.get('SALONBOARD_LOGIN_PASSWORD', 'Ne8T2Hhi!')
                 
                 page.goto('https://salonboard.com/login/', timeout=60000)
-                page.wait_for_timeout(2000)
+                ready.wait(page, LOGIN_READY, 2000, label='login')
                 page.fill('input[name="userId"]', login_id)
                 page.fill('input[name="password"]', login_password)
                 page.evaluate("dologin(new Event('click'))")
                 page.wait_for_timeout(5000)
                 
                 if 'login' in page.url.lower():
-                    browser.close()
-                    return jsonify({'error': 'Login failed'}), 401
+                    context.close()
+                    return ({'error': 'Login failed'}, 401), False
                 
                 # 再度スケジュールページへ
                 page.goto(url, timeout=60000)
             
             page.wait_for_selector(".scheduleMainTableLine", timeout=30000)
-            page.wait_for_timeout(2000)
+            ready.wait(page, SCHEDULE_RESERVATIONS_READY, 2000, label='scheduleReservations')
             
             if 'login' in page.url.lower() or 'エラー' in page.content():
-                browser.close()
-                return jsonify({'error': 'Login required'}), 401
-            
-            staff_list = []
-            staff_options = page.query_selector_all('#stockNameList option')
-            for opt in staff_options:
-                value = opt.get_attribute('value') or ''
-                name = opt.inner_text()
-                if value.startswith('STAFF_'):
-                    staff_list.append({'id': value.split('_')[1], 'name': name})
-            
-            PX_PER_HOUR = 132
-            START_HOUR = 9
+                context.close()
+                return ({'error': 'Login required'}, 401), False
+            
+            # スタッフ一覧とタイムラインを1回のevaluateで取得し、空き枠はslot_engineで計算
+            schedule = evaluate_schedule(page, '.scheduleMainTableLine.jscScheduleMainTableLine')
             staff_schedules = []
-            staff_rows = page.query_selector_all('.scheduleMainTableLine.jscScheduleMainTableLine')
-            
-            for i, row in enumerate(staff_rows):
-                if i >= len(staff_list):
-                    break
-                staff_info = staff_list[i]
-                booked_slots = []
-                # 受付開始時間を取得
-                time_list = row.query_selector_all('.scheduleTime')
-                start_time = 9  # デフォルト
-                if time_list:
-                    first_time = time_list[0].inner_text()
-                    start_time = int(first_time.split(':')[0])
-                
-                # 予約の時間帯を取得（scheduleTimeZoneSettingから）
-                reservations = row.query_selector_all('.scheduleReservation, .scheduleToDo')
-                for res in reservations:
-                    time_zone = res.query_selector('.scheduleTimeZoneSetting')
-                    if time_zone:
-                        time_text = time_zone.inner_text()
-                        times = json.loads(time_text)
-                        if len(times) >= 2:
-                            start_parts = times[0].split(':')
-                            end_parts = times[1].split(':')
-                            start_h = int(start_parts[0]) + int(start_parts[1]) / 60
-                            end_h = int(end_parts[0]) + int(end_parts[1]) / 60
-                            booked_slots.append({'start': start_h, 'end': end_h})
-                
-                day_off = row.query_selector('.isDayOff')
-                is_day_off = day_off is not None
-                available_slots = []
-                if not is_day_off:
-                    booked_slots.sort(key=lambda x: x['start'])
-                    current = start_time
-                    for slot in booked_slots:
-                        if slot['start'] > current:
-                            import math
-                            start_min = current * 60
-                            end_min = slot['start'] * 60
-                            start_min_rounded = math.ceil(start_min / 10) * 10
-                            end_min_rounded = math.floor(end_min / 10) * 10
-                            if end_min_rounded > start_min_rounded:
-                                start_str = f"{int(start_min_rounded // 60)}:{int(start_min_rounded % 60):02d}"
-                                end_str = f"{int(end_min_rounded // 60)}:{int(end_min_rounded % 60):02d}"
-                                available_slots.append({'start': start_str, 'end': end_str})
-                        current = max(current, slot['end'])
-                    if current < 19:
-                        import math
-                        current_min = current * 60
-                        current_min_rounded = math.ceil(current_min / 10) * 10
-                        start_str = f"{int(current_min_rounded // 60)}:{int(current_min_rounded % 60):02d}"
-                        available_slots.append({'start': start_str, 'end': '19:00'})
-                
+            for staff_slots in build_available_slots(schedule or {'staff_list': [], 'rows': []}):
                 staff_schedules.append({
-                    'staff_id': staff_info['id'],
-                    'staff_name': staff_info['name'],
-                    'is_day_off': is_day_off,
-                    'available_slots': available_slots
+                    'staff_id': staff_slots['staff_info']['id'],
+                    'staff_name': staff_slots['staff_info']['name'],
+                    'is_day_off': staff_slots['is_day_off'],
+                    'available_slots': staff_slots['slots']
                 })
             
-            browser.close()
-            return jsonify({'date': date_str, 'staff_schedules': staff_schedules})
+            context.close()
+            ready.report()
+            block_stats.report()
+            return ({'date': date_str, 'staff_schedules': staff_schedules}, 200), True
     except Exception as e:
         print(f'[空き枠取得エラー] {e}')
         import traceback
         traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        return ({'error': str(e)}, 500), False
+
+
+
+# 日付ごとの空き枠キャッシュ（新しい間はそのまま、古くなったら返しつつ裏で1回だけ再取得）
+AVAILABLE_SLOTS_FRESH_SECONDS = int(os.getenv('AVAILABLE_SLOTS_FRESH_SECONDS', '300'))
+AVAILABLE_SLOTS_MAX_STALE_SECONDS = int(os.getenv('AVAILABLE_SLOTS_MAX_STALE_SECONDS', '3600'))
+# 空き枠を返す日付の範囲（今日〜N日後、8週間クロールと同じ）。範囲外の日付でスクレイプさせない
+AVAILABLE_SLOTS_MAX_DAYS = int(os.getenv('AVAILABLE_SLOTS_MAX_DAYS', '56'))
+available_slots_cache = StaleWhileRevalidateCache(
+    'available_slots', scrape_available_slots,
+    AVAILABLE_SLOTS_FRESH_SECONDS, AVAILABLE_SLOTS_MAX_STALE_SECONDS,
+    max_entries=AVAILABLE_SLOTS_MAX_DAYS + 1,
+    # 予約変更後のinvalidateを全ワーカーに伝える
+    shared=SharedInvalidations(os.path.join('data', 'available_slots_invalidated.json')),
+    # 同じ日付を複数のワーカーが同時にスクレイプしないよう、取得結果とロックをワーカー間で共有する
+    results=SharedResults(os.path.join('data', 'available_slots_cache'))
+)
+# 予約変更後の空き枠更新でスケジュールの表示を待つミリ秒（8週間クロールと同じ）
+SLOT_REFRESH_READY_MS = 15000
+
+def refresh_slots_after_change(page, ready, dates, staff_name=''):
+    """予約変更後、指定日のスケジュールを取り直して担当スタッフの空き枠だけをupsertする
+    
+    担当スタッフが分からない（指名なし等）場合はその日の全スタッフ分を更新する
+    戻り値: 取得できず更新しなかった日のリスト
+    """
+    supabase_url = os.getenv('SUPABASE_URL')
+    supabase_key = os.getenv('SUPABASE_KEY')
+    staff_name = (staff_name or '').strip()
+    writer = SupabaseBatchWriter(supabase_url, supabase_key, 'available_slots', on_conflict='date,staff_id')
+    
+    failed = []
+    for date_str in dict.fromkeys(d for d in dates if d):
+        page.goto(f'https://salonboard.com/KLP/schedule/salonSchedule/?date={date_str}', timeout=60000)
+        if not ready.wait(page, SCHEDULE_READY, SLOT_REFRESH_READY_MS, label='salonSchedule'):
+            print(f'[空き枠] {date_str} スケジュール表示待ちタイムアウト、更新スキップ')
+            failed.append(date_str)
+            continue
+        ready.wait(page, SCHEDULE_RESERVATIONS_READY, 2000, label='scheduleReservations')
+        schedule = evaluate_schedule(page)
+        if not schedule:
+            print(f'[空き枠] {date_str} スケジュール取得失敗、更新スキップ')
+            failed.append(date_str)
+            continue
+        
+        day_slots = build_available_slots(schedule)
+        targets = [s for s in day_slots if staff_name and s['staff_info']['name'].strip() == staff_name] or day_slots
+        for staff_slots in targets:
+            writer.add({
+                'date': date_str,
+                'staff_id': staff_slots['staff_info']['id'],
+                'staff_name': staff_slots['staff_info']['name'],
+                'is_day_off': staff_slots['is_day_off'],
+                'slots': staff_slots['slots'],
+                'updated_at': datetime.now().isoformat()
+            })
+        available_slots_cache.invalidate(date_str)
+    
+    writer.flush()
+    # 範囲APIと空き枠検索が次のリクエストで新しいウォーターマークを読むように
+    slots_watermark.invalidate()
+    print(f'[空き枠] 変更後の更新: {writer.saved}件（{", ".join(d for d in dates if d)}）')
+    return failed + [row['date'] for row in writer.failed_rows if row['date'] not in failed]
 
+def run_slot_refresh(payload):
+    """予約変更直後に更新できなかった日の空き枠を取り直す（ジョブキューから呼ばれる。失敗はリトライ）"""
+    from playwright.sync_api import sync_playwright
+    
+    ready = ReadyWaiter('slot_refresh')
+    with sync_playwright() as p, shared_browser(p, 'slot_refresh', args=[]) as browser:
+        context, block_stats = new_blocking_context(browser, 'slot_refresh')
+        try:
+            with open('session_cookies.json', 'r') as f:
+                context.add_cookies(json.load(f))
+            failed = refresh_slots_after_change(context.new_page(), ready, payload['dates'], payload.get('staff_name', ''))
+        finally:
+            context.close()
+    ready.report()
+    block_stats.report()
+    if failed:
+        raise RuntimeError(f'空き枠を更新できなかった日: {", ".join(failed)}')
+    return {'dates': payload['dates']}
 
-# APScheduler: 毎分スクレイピング実行
-def run_scrape_job():
-    """毎分実行されるスクレイピングジョブ"""
+job_queue.register('slot_refresh', run_slot_refresh, max_attempts=4, backoff_seconds=60)
+
+def enqueue_slot_refresh(dates, staff_name=''):
+    dates = [d for d in dict.fromkeys(dates) if d]
+    if dates:
+        job_id = job_queue.enqueue('slot_refresh', {'dates': dates, 'staff_name': staff_name})
+        print(f'[空き枠] 再取得ジョブ#{job_id}を追加（{", ".join(dates)}）')
+
+@app.route('/api/liff/available-slots', methods=['GET'])
+def api_liff_available_slots():
+    """指定日のスタッフ空き枠を取得"""
+    import re
+    
+    date_str = request.args.get('date')  # YYYYMMDD形式
+    
+    if not date_str:
+        return jsonify({'error': 'date parameter required'}), 400
+    if not re.fullmatch(r'\d{8}', date_str):
+        return jsonify({'error': 'date must be YYYYMMDD'}), 400
+    try:
+        target = datetime.strptime(date_str, '%Y%m%d').date()
+    except ValueError:
+        return jsonify({'error': 'date must be YYYYMMDD'}), 400
+    today = datetime.now(timezone(timedelta(hours=9))).date()
+    if not today <= target <= today + timedelta(days=AVAILABLE_SLOTS_MAX_DAYS):
+        return jsonify({'error': f'date must be within {AVAILABLE_SLOTS_MAX_DAYS} days from today'}), 400
+    
     try:
-        import requests as req
-        print(f"[SCHEDULER] スクレイピング開始: {datetime.now()}", flush=True)
-        res = req.post('http://localhost:10000/api/scrape_8weeks_v3', timeout=30)
-        print(f"[SCHEDULER] スクレイピング結果: {res.status_code}", flush=True)
+        (payload, status), cache_state = available_slots_cache.get(date_str)
     except Exception as e:
-        print(f"[SCHEDULER] エラー: {e}", flush=True)
+        return jsonify({'error': str(e)}), 500
+    
+    response = jsonify(payload)
+    response.status_code = status
+    response.headers['X-Cache'] = cache_state
+    age = available_slots_cache.age(date_str)
+    if age is not None:
+        response.headers['Age'] = str(int(age))
+    return response
+
+# APScheduler: 毎分スクレイピング実行
+def run_scrape_job():
+    """毎分実行されるスクレイピングジョブ（待機中・実行中なら重複スキップとして記録）"""
+    print(f"[SCHEDULER] スクレイピング開始: {datetime.now()}", flush=True)
+    job_id = enqueue_scrape_8weeks('scheduler')
+    if job_id is not None:
+        print(f"[SCHEDULER] ジョブ#{job_id}を追加", flush=True)
+
+# クロールはリーダーのプロセスだけが実行する（他のワーカーは予約変更などの対話的なジョブだけ）
+LEADER_JOB_KINDS = ('scrape_8weeks', 'scrape_8weeks_v2')
+
+# ジョブキューのワーカー起動（種別の登録がすべて終わってから）
+job_queue.start(exclude=LEADER_JOB_KINDS)
 
-# APScheduler一時停止（ログイン失敗調査中）
 scheduler = BackgroundScheduler(timezone='UTC')
 scheduler.add_job(run_scrape_job, 'interval', minutes=1, id='scrape_8weeks', next_run_time=datetime.now() + timedelta(seconds=60))
-scheduler.start()
-print("[SCHEDULER] APScheduler開始（毎分実行）", flush=True)
+
+def start_scheduler():
+    """リーダーに選ばれたプロセスでスケジューラーとクロールのワーカーを開始"""
+    job_queue.enable(LEADER_JOB_KINDS)
+    scheduler.start()
+    print("[SCHEDULER] APScheduler開始（毎分実行）", flush=True)
+
+# gunicornのワーカーが複数でも、ロックを取れた1プロセスだけがスケジューラーを持つ
+scheduler_leader = LeaderLock()
+scheduler_leader.run(start_scheduler)
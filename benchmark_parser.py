@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+SalonBoard HTMLパーサーのベンチマーク（utils/salonboard_parser.py）
+保存済みのページ（フィクスチャ）を繰り返し解析して、件数・処理時間・スループットを表示する。
+SalonBoardにアクセスせずにパーサーの変更を計測できる。
+lxmlと標準パーサー（html.parser）の両方で同じ結果になるかも確認する。
+
+使い方: python3 benchmark_parser.py [--iterations 500] [--backend lxml|html.parser|all]
+"""
+import argparse
+import os
+import time
+
+from utils import salonboard_parser as parser
+
+# フィクスチャ → (解析関数, 結果の件数の数え方)
+FIXTURES = [
+    ('salonboard_page.html', 'reserveList', parser.extract_reserve_rows, lambda r: len(r or [])),
+    ('schedule_sample.html', 'salonSchedule', parser.extract_schedule, lambda r: len(r['rows']) if r else 0),
+    ('salonboard_schedule.html', 'salonSchedule(JS描画前)', parser.extract_schedule, lambda r: 0 if r is None else len(r['rows'])),
+    ('salonboard_schedule.html', 'staffOptions', parser.extract_staff_options, len),
+    ('nakabayashi_row.html', 'scheduleLine', parser.extract_schedule_line, lambda r: len(r['reservations'])),
+    ('reserve_change_page.html', 'extReserveChange', parser.extract_reserve_change, lambda r: 1 if r else 0),
+]
+
+
+def available_backends():
+    backends = ['html.parser']
+    try:
+        import lxml  # noqa: F401
+        backends.insert(0, 'lxml')
+    except ImportError:
+        pass
+    return backends
+
+
+def run(backend, iterations):
+    parser.PARSER_BACKEND = backend
+    results = {}
+    total_bytes = 0
+    total_time = 0
+    print(f"\n[BENCH] パーサー: {backend}（{iterations}回）")
+    for filename, label, func, count in FIXTURES:
+        if not os.path.exists(filename):
+            print(f"[BENCH] {filename} なし、スキップ")
+            continue
+        with open(filename, 'r', encoding='utf-8') as f:
+            html = f.read()
+        size = len(html.encode('utf-8'))
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            result = func(html)
+        elapsed = time.perf_counter() - started
+
+        results[(filename, label)] = result
+        total_bytes += size * iterations
+        total_time += elapsed
+        print(f"[BENCH] {label:<24} {filename:<26} {size // 1024:>4}KB  件数{count(result):>3}  "
+              f"{elapsed / iterations * 1000:7.2f}ms/回  {iterations / elapsed:8.1f}ページ/秒")
+    if total_time:
+        print(f"[BENCH] 合計 {total_bytes / total_time / 1024 / 1024:.2f}MB/秒")
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='SalonBoard HTMLパーサーのベンチマーク')
+    arg_parser.add_argument('--iterations', type=int, default=500)
+    arg_parser.add_argument('--backend', default='all', help='lxml / html.parser / all')
+    args = arg_parser.parse_args()
+
+    backends = available_backends() if args.backend == 'all' else [args.backend]
+    outputs = {backend: run(backend, args.iterations) for backend in backends}
+
+    if len(outputs) > 1:
+        baseline_name, baseline = next(iter(outputs.items()))
+        for backend, results in list(outputs.items())[1:]:
+            differ = [key[1] for key in baseline if results.get(key) != baseline[key]]
+            print(f"[BENCH] {backend} と {baseline_name} の結果: {'一致' if not differ else '不一致 ' + ', '.join(differ)}")
+
+
+if __name__ == '__main__':
+    main()
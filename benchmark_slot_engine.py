@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+空き枠計算のベンチマーク（従来のfloat時間ループ vs utils/slot_engine のビットマップ）
+ランダムなスケジュールを生成して両方で計算し、処理時間と結果の一致件数を表示する。
+不一致は原因ごとに数える（従来ループの長さ0の末尾枠・浮動小数点誤差・それ以外）。
+「それ以外」が出たらビットマップ側の不具合を疑う。
+schedule_sample.html があれば実データでの結果も比較する。
+
+使い方: python3 benchmark_slot_engine.py [--days 56] [--staff 6] [--repeat 5]
+"""
+import argparse
+import json
+import math
+import os
+import random
+import time
+from fractions import Fraction
+
+from utils.slot_engine import build_available_slots, build_all_slots
+
+
+def legacy_build_available_slots(schedule, exact=False):
+    """従来の計算（scrape_8weeks_v3 / LIFF空き枠APIにあったループ）
+
+    exact=Trueなら時刻をfloatでなく分数で持つ（浮動小数点誤差だけを除いた従来の結果）
+    """
+    number = Fraction if exact else float
+    results = []
+    staff_list = schedule['staff_list']
+    for idx, row in enumerate(schedule['rows']):
+        if idx >= len(staff_list):
+            break
+        start_time = 9
+        if row['first_time']:
+            try:
+                start_time = int(row['first_time'].split(':')[0])
+            except:
+                pass
+        booked_slots = []
+        for time_text in row['time_zones']:
+            try:
+                times = json.loads(time_text)
+                if len(times) >= 2:
+                    start_parts = times[0].split(':')
+                    end_parts = times[1].split(':')
+                    booked_slots.append({'start': int(start_parts[0]) + number(int(start_parts[1])) / 60,
+                                         'end': int(end_parts[0]) + number(int(end_parts[1])) / 60})
+            except:
+                pass
+        available_slots = []
+        if not row['is_day_off']:
+            booked_slots.sort(key=lambda x: x['start'])
+            current = start_time
+            for slot in booked_slots:
+                if slot['start'] > current:
+                    start_min_rounded = math.ceil(current * 60 / 10) * 10
+                    end_min_rounded = math.floor(slot['start'] * 60 / 10) * 10
+                    if end_min_rounded > start_min_rounded:
+                        available_slots.append({
+                            'start': f"{int(start_min_rounded // 60)}:{int(start_min_rounded % 60):02d}",
+                            'end': f"{int(end_min_rounded // 60)}:{int(end_min_rounded % 60):02d}"
+                        })
+                current = max(current, slot['end'])
+            if current < 19:
+                current_min_rounded = math.ceil(current * 60 / 10) * 10
+                available_slots.append({
+                    'start': f"{int(current_min_rounded // 60)}:{int(current_min_rounded % 60):02d}",
+                    'end': '19:00'
+                })
+        results.append({'staff_info': staff_list[idx], 'is_day_off': row['is_day_off'], 'slots': available_slots})
+    return results
+
+
+def random_schedule(rng, staff_count):
+    """1日分のランダムなスケジュール（予約は9:00〜19:00の5分刻み）"""
+    staff_list = [{'id': f'W{i:08d}', 'name': f'スタッフ{i}'} for i in range(staff_count)]
+    rows = []
+    for _ in range(staff_count):
+        time_zones = []
+        minute = 9 * 60 + rng.choice([0, 0, 30])
+        while True:
+            minute += rng.choice([0, 5, 10, 15, 30, 60])
+            length = rng.choice([30, 45, 60, 75, 90, 120])
+            if minute + length > 19 * 60:
+                break
+            time_zones.append(json.dumps([f"{minute // 60}:{minute % 60:02d}",
+                                          f"{(minute + length) // 60}:{(minute + length) % 60:02d}"]))
+            minute += length
+        rows.append({'first_time': '9:00', 'time_zones': time_zones, 'is_day_off': rng.random() < 0.1})
+    return {'staff_list': staff_list, 'rows': rows}
+
+
+def timed(func, schedules, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results = [func(schedule) for schedule in schedules]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+def _without_empty(slots):
+    """従来ループが出す長さ0の枠（例: 19:00-19:00）を除く"""
+    return [slot for slot in slots if slot['start'] != slot['end']]
+
+
+def compare(schedules, legacy_results, engine_results):
+    """行ごとの一致・不一致を原因別に数える
+
+    zero_length: 従来ループの長さ0の末尾枠だけが違う
+    float_error: 時刻を分数で計算し直した従来ループとは一致する（浮動小数点誤差）
+    other: どちらでも説明できない差（ビットマップ側の回帰の可能性）
+    """
+    counts = {'same': 0, 'zero_length': 0, 'float_error': 0, 'other': 0}
+    for schedule, legacy_day, engine_day in zip(schedules, legacy_results, engine_results):
+        exact_day = legacy_build_available_slots(schedule, exact=True)
+        for legacy, exact, engine in zip(legacy_day, exact_day, engine_day):
+            if legacy['slots'] == engine['slots']:
+                counts['same'] += 1
+            elif _without_empty(legacy['slots']) == engine['slots']:
+                counts['zero_length'] += 1
+            elif _without_empty(exact['slots']) == engine['slots']:
+                counts['float_error'] += 1
+            else:
+                counts['other'] += 1
+    return counts
+
+
+def format_counts(counts):
+    return (f"一致 {counts['same']}行 / 不一致: 長さ0の枠 {counts['zero_length']}行・"
+            f"浮動小数点誤差 {counts['float_error']}行・その他 {counts['other']}行")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='空き枠計算のベンチマーク')
+    parser.add_argument('--days', type=int, default=56)
+    parser.add_argument('--staff', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    schedules = [random_schedule(rng, args.staff) for _ in range(args.days)]
+    rows = args.days * args.staff
+
+    legacy_time, legacy_results = timed(legacy_build_available_slots, schedules, args.repeat)
+    engine_time, engine_results = timed(build_available_slots, schedules, args.repeat)
+    # 全日分をまとめて1回で計算
+    bulk_time, bulk_results = timed(lambda _: build_all_slots(dict(enumerate(schedules))), [None], args.repeat)
+    counts = compare(schedules, legacy_results, engine_results)
+    assert list(bulk_results[0].values()) == engine_results
+
+    print(f"[BENCH] {args.days}日 × {args.staff}人 = {rows}行（{args.repeat}回中の最速）")
+    print(f"[BENCH] 従来ループ : {legacy_time * 1000:.2f}ms（{legacy_time / rows * 1e6:.1f}µs/行）")
+    print(f"[BENCH] ビットマップ（1日ずつ）: {engine_time * 1000:.2f}ms（{engine_time / rows * 1e6:.1f}µs/行）")
+    print(f"[BENCH] ビットマップ（全日一括）: {bulk_time * 1000:.2f}ms（{bulk_time / rows * 1e6:.1f}µs/行）")
+    # 浮動小数点誤差の例: 16:20 → 16.333…×60 = 979.99… が16:10に切り捨て
+    print(f"[BENCH] 結果 {format_counts(counts)}")
+    if counts['other']:
+        print("[BENCH] 警告: 従来ループとの差を説明できない行があります（slot_engineを確認）")
+
+    if os.path.exists('schedule_sample.html'):
+        try:
+            from utils.salonboard_parser import extract_schedule
+        except ImportError as e:
+            print(f"[BENCH] 実データ比較スキップ: {e}")
+            return
+        with open('schedule_sample.html', 'r', encoding='utf-8') as f:
+            schedule = extract_schedule(f.read())
+        if schedule:
+            counts = compare([schedule], [legacy_build_available_slots(schedule)], [build_available_slots(schedule)])
+            print(f"[BENCH] schedule_sample.html: {format_counts(counts)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+常駐ブラウザサービス
+Chromiumを1つ起動したままにして、スクレイパーやLIFFエンドポイントにCDP接続先を貸し出す。
+呼び出し側はconnect_over_cdpで接続し、自分専用のコンテキスト/ページを作る（utils/shared_browser.py）。
+
+- ログイン状態を定期的に確認し、切れていれば再ログインしてsession_cookies.jsonを更新
+- 貸し出しページ数がMAX_PAGES、またはメモリがMAX_RSS_MBを超えたら、利用中がなくなり次第再起動
+- ブラウザが落ちたら自動で再起動
+- 貸し出しにはLEASE_TTL秒の期限があり、利用側が定期的に延長する。
+  利用側のプロセスが落ちて返却されなかった貸し出しは期限切れで数えなくなる
+
+制御API（localhostのみ）:
+  POST /lease   → {"lease_id": ..., "ttl": ..., "cdp_endpoint": ..., "generation": ...}（再起動待ちの間は503）
+  POST /renew   {"lease_id": ...} → 期限を延長（期限切れ・不明なら404）
+  POST /release {"lease_id": ...} → 貸し出し終了
+  GET  /status  → 状態
+"""
+import json
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SERVICE_PORT = int(os.environ.get('BROWSER_SERVICE_PORT', '9300'))
+CDP_PORT = int(os.environ.get('BROWSER_SERVICE_CDP_PORT', '9222'))
+MAX_PAGES = int(os.environ.get('BROWSER_SERVICE_MAX_PAGES', '200'))
+MAX_RSS_MB = int(os.environ.get('BROWSER_SERVICE_MAX_RSS_MB', '700'))
+# 再起動待ちでも貸し出し中が返ってこない場合に強制再起動するまでの秒数
+DRAIN_TIMEOUT = int(os.environ.get('BROWSER_SERVICE_DRAIN_TIMEOUT', '180'))
+LOGIN_CHECK_INTERVAL = int(os.environ.get('BROWSER_SERVICE_LOGIN_CHECK', '600'))
+# 貸し出しの期限（秒）。利用側はこの1/3ごとに延長する
+LEASE_TTL = int(os.environ.get('BROWSER_SERVICE_LEASE_TTL', '60'))
+HEALTH_CHECK_INTERVAL = 5
+
+LOGIN_CHECK_URL = 'https://salonboard.com/KLP/reserve/reserveList/'
+
+
+class ServiceState:
+    """制御APIスレッドとブラウザ管理スレッドで共有する状態"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.ready = False
+        self.draining = False
+        self.drain_started = None
+        self.pages_served = 0
+        # lease_id → 期限（time.monotonic）
+        self.leases = {}
+        self.expired_leases = 0
+        self.restarts = 0
+        self.started_at = None
+        self.rss_mb = 0
+        self.last_login_check = None
+
+    def lease(self):
+        with self.lock:
+            if not self.ready or self.draining:
+                return None
+            self.pages_served += 1
+            lease_id = secrets.token_hex(8)
+            self.leases[lease_id] = time.monotonic() + LEASE_TTL
+            if self.pages_served >= MAX_PAGES:
+                self._start_drain('ページ数上限')
+            return {'lease_id': lease_id, 'ttl': LEASE_TTL,
+                    'cdp_endpoint': f'http://127.0.0.1:{CDP_PORT}', 'generation': self.generation}
+
+    def renew(self, lease_id):
+        with self.lock:
+            self._expire()
+            if lease_id not in self.leases:
+                return False
+            self.leases[lease_id] = time.monotonic() + LEASE_TTL
+            return True
+
+    def release(self, lease_id):
+        with self.lock:
+            self.leases.pop(lease_id, None)
+
+    def _expire(self):
+        """期限切れの貸し出し（返却前に利用側が落ちた）を捨てる（ロック内で呼ぶ）"""
+        now = time.monotonic()
+        for lease_id in [l for l, expires in self.leases.items() if expires <= now]:
+            del self.leases[lease_id]
+            self.expired_leases += 1
+            print(f"[BROWSER_SERVICE] 貸し出し{lease_id}が期限切れ（返却されず）", flush=True)
+
+    @property
+    def active_leases(self):
+        return len(self.leases)
+
+    def _start_drain(self, reason):
+        if not self.draining:
+            print(f"[BROWSER_SERVICE] 再起動予約: {reason}", flush=True)
+            self.draining = True
+            self.drain_started = time.monotonic()
+
+    def request_drain(self, reason):
+        with self.lock:
+            self._start_drain(reason)
+
+    def should_recycle(self):
+        with self.lock:
+            self._expire()
+            if not self.draining:
+                return False
+            return self.active_leases == 0 or time.monotonic() - self.drain_started > DRAIN_TIMEOUT
+
+    def snapshot(self):
+        with self.lock:
+            self._expire()
+            return {
+                'pid': os.getpid(),
+                'generation': self.generation,
+                'ready': self.ready,
+                'draining': self.draining,
+                'pages_served': self.pages_served,
+                'active_leases': self.active_leases,
+                'expired_leases': self.expired_leases,
+                'lease_ttl': LEASE_TTL,
+                'restarts': self.restarts,
+                'rss_mb': self.rss_mb,
+                'started_at': self.started_at,
+                'last_login_check': self.last_login_check,
+                'max_pages': MAX_PAGES,
+                'max_rss_mb': MAX_RSS_MB
+            }
+
+
+state = ServiceState()
+
+
+def process_tree_rss_mb(root_pid):
+    """root_pid配下（Chromiumの子プロセス含む）のRSS合計（MB）"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                stat = f.read()
+            ppid = int(stat.rsplit(')', 1)[1].split()[1])
+            children.setdefault(ppid, []).append(int(entry))
+        except (OSError, ValueError, IndexError):
+            continue
+
+    total_kb = 0
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, []))
+        try:
+            with open(f'/proc/{pid}/status', 'r') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total_kb // 1024
+
+
+def login_to_salonboard(page):
+    """サロンボードにログイン（dologin実行）"""
+    login_id = os.environ.get('SALONBOARD_LOGIN_ID', 'CD18317')
+    login_password = os.environ.get('SALONBOARD_LOGIN_PASSWORD', 'Ne8T2Hhi!')
+
+    page.goto('https://salonboard.com/login/', timeout=60000)
+    page.wait_for_selector('input[name="userId"]', timeout=30000)
+    page.fill('input[name="userId"]', login_id)
+    page.fill('input[name="password"]', login_password)
+    page.evaluate("dologin(new Event('click'))")
+    try:
+        page.wait_for_url("**/KLP/**", timeout=30000)
+    except Exception as e:
+        print(f"[BROWSER_SERVICE] ログイン遷移タイムアウト: {e}", flush=True)
+        return False
+    return 'login' not in page.url.lower()
+
+
+def ensure_logged_in(browser):
+    """ログイン確認用コンテキストでセッションを確認し、切れていれば再ログインしてクッキー保存"""
+    context = browser.new_context(locale='ja-JP', timezone_id='Asia/Tokyo')
+    try:
+        try:
+            with open('session_cookies.json', 'r') as f:
+                context.add_cookies(json.load(f))
+        except Exception as e:
+            print(f"[BROWSER_SERVICE] クッキー読み込み失敗: {e}", flush=True)
+
+        page = context.new_page()
+        page.goto(LOGIN_CHECK_URL, timeout=60000)
+        if 'login' in page.url.lower() or page.query_selector('input[name="userId"]'):
+            print("[BROWSER_SERVICE] セッション切れ、再ログイン", flush=True)
+            if not login_to_salonboard(page):
+                print("[BROWSER_SERVICE] ログイン失敗", flush=True)
+                return False
+            with open('session_cookies.json', 'w') as f:
+                json.dump(context.cookies(), f, indent=2, ensure_ascii=False)
+            print("[BROWSER_SERVICE] ログイン成功、クッキー保存", flush=True)
+        return True
+    except Exception as e:
+        print(f"[BROWSER_SERVICE] ログイン確認エラー: {e}", flush=True)
+        return False
+    finally:
+        context.close()
+        with state.lock:
+            state.last_login_check = datetime.now().isoformat()
+
+
+def launch_browser(p):
+    return p.chromium.launch(
+        headless=True,
+        args=[
+            '--disable-blink-features=AutomationControlled',
+            '--disable-dev-shm-usage',
+            f'--remote-debugging-port={CDP_PORT}',
+            '--remote-debugging-address=127.0.0.1'
+        ]
+    )
+
+
+def run_browser_loop():
+    """ブラウザの起動・監視・再起動（Playwrightはこのスレッドだけで扱う）"""
+    from playwright.sync_api import sync_playwright
+
+    backoff = 1
+    while True:
+        try:
+            with sync_playwright() as p:
+                browser = launch_browser(p)
+                with state.lock:
+                    state.generation += 1
+                    state.ready = True
+                    state.draining = False
+                    state.pages_served = 0
+                    state.leases.clear()
+                    state.started_at = datetime.now().isoformat()
+                print(f"[BROWSER_SERVICE] Chromium起動（世代{state.generation}、CDP:{CDP_PORT}）", flush=True)
+                backoff = 1
+
+                ensure_logged_in(browser)
+                last_login_check = time.monotonic()
+                driver_pid = os.getpid()
+
+                while browser.is_connected():
+                    rss = process_tree_rss_mb(driver_pid)
+                    with state.lock:
+                        state.rss_mb = rss
+                    if rss > MAX_RSS_MB:
+                        state.request_drain(f'メモリ{rss}MB')
+                    if state.should_recycle():
+                        print("[BROWSER_SERVICE] Chromium再起動", flush=True)
+                        break
+                    if time.monotonic() - last_login_check > LOGIN_CHECK_INTERVAL:
+                        ensure_logged_in(browser)
+                        last_login_check = time.monotonic()
+                    time.sleep(HEALTH_CHECK_INTERVAL)
+                else:
+                    print("[BROWSER_SERVICE] Chromiumが停止、再起動します", flush=True)
+
+                with state.lock:
+                    state.ready = False
+                    state.restarts += 1
+                try:
+                    browser.close()
+                except Exception:
+                    pass
+        except Exception as e:
+            with state.lock:
+                state.ready = False
+                state.restarts += 1
+            print(f"[BROWSER_SERVICE] エラー、{backoff}秒後に再起動: {e}", flush=True)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+
+class ControlHandler(BaseHTTPRequestHandler):
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _lease_id(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length) or b'{}').get('lease_id')
+        except (ValueError, AttributeError):
+            return None
+
+    def do_GET(self):
+        if self.path == '/status':
+            self._send(200, state.snapshot())
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path == '/lease':
+            lease = state.lease()
+            if lease:
+                self._send(200, lease)
+            else:
+                self._send(503, {'error': 'browser not ready'})
+        elif self.path == '/renew':
+            if state.renew(self._lease_id()):
+                self._send(200, {'ok': True})
+            else:
+                self._send(404, {'error': 'lease not found'})
+        elif self.path == '/release':
+            state.release(self._lease_id())
+            self._send(200, {'ok': True})
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', SERVICE_PORT), ControlHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[BROWSER_SERVICE] 制御API開始: http://127.0.0.1:{SERVICE_PORT}", flush=True)
+    run_browser_loop()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,11 @@ import re
 import os
 from playwright.sync_api import sync_playwright
 from datetime import datetime, timedelta, timezone
+from utils.page_ready import ReadyWaiter, LOGIN_READY, RESERVE_LIST_READY, RESERVE_DETAIL_READY
+from utils.browser_context import new_blocking_context
+from utils.page_extract import evaluate_table_cells
+
+ready = ReadyWaiter('scrape_3days_mac')
 
 def login_to_salonboard(page):
     """サロンボードにID/パスワードでログイン"""
@@ -12,7 +17,7 @@ def login_to_salonboard(page):
     
     print("[LOGIN] ログインページにアクセス...")
     page.goto('https://salonboard.com/login/', timeout=60000)
-    page.wait_for_timeout(3000)
+    ready.wait(page, LOGIN_READY, 3000, label='login')
     
     print("[LOGIN] ID入力...")
     page.fill('input[name="userId"]', login_id)
@@ -39,7 +44,8 @@ with sync_playwright() as p:
         args=['--disable-blink-features=AutomationControlled']
     )
     
-    context = browser.new_context(
+    context, block_stats = new_blocking_context(
+        browser, 'scrape_3days_mac',
         user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
         viewport={'width': 1920, 'height': 1080},
         locale='ja-JP',
@@ -64,7 +70,7 @@ with sync_playwright() as p:
     
     print(f"[SCRAPE] 本日の予約にアクセス（{today}）...")
     page.goto(url, timeout=90000)
-    page.wait_for_timeout(3000)
+    ready.wait(page, RESERVE_LIST_READY, 3000, label='reserveList')
     
     # デバッグ: 現在のURL確認
     print(f"[DEBUG] 現在のURL: {page.url}")
@@ -87,23 +93,23 @@ with sync_playwright() as p:
         
         # 再度予約ページにアクセス
         page.goto(url, timeout=90000)
-        page.wait_for_timeout(3000)
+        ready.wait(page, RESERVE_LIST_READY, 3000, label='reserveList')
     
     # 第1段階：予約IDと基本情報を取得
     basic_bookings = []
     seen_ids = set()
-    rows = page.query_selector_all('table tbody tr')
+    # 全行のセルテキストを1回のevaluateで取得
+    rows = evaluate_table_cells(page)
     print(f"[SCRAPE] {len(rows)}行を検出")
     
-    for row in rows:
+    for cells in rows:
         try:
-            cells = row.query_selector_all('td')
             if len(cells) < 4:
                 continue
             
-            datetime_text = cells[0].text_content().strip()
-            status = cells[1].text_content().strip()
-            customer_name = cells[2].text_content().strip()
+            datetime_text = cells[0]
+            status = cells[1]
+            customer_name = cells[2]
             
             if datetime_text.isdigit() or 'キャンセル' in status:
                 continue
@@ -117,9 +123,9 @@ with sync_playwright() as p:
                 continue
             seen_ids.add(booking_id)
             
-            staff = cells[3].text_content().strip() if len(cells) > 3 else ""
-            source = cells[4].text_content().strip() if len(cells) > 4 else ""
-            menu = cells[5].text_content().strip() if len(cells) > 5 else ""
+            staff = cells[3] if len(cells) > 3 else ""
+            source = cells[4] if len(cells) > 4 else ""
+            menu = cells[5] if len(cells) > 5 else ""
             
             basic_bookings.append({
                 "来店日時": datetime_text,
@@ -149,7 +155,7 @@ with sync_playwright() as p:
                 detail_url = f'https://salonboard.com/KLP/reserve/ext/extReserveDetail/?reserveid={booking_id}'
             
             page.goto(detail_url)
-            page.wait_for_timeout(2000)
+            ready.wait(page, RESERVE_DETAIL_READY, 2000, label='reserveDetail')
             
             phone_cell = page.query_selector('tr:has-text("電話番号") td:nth-child(2)')
             phone = phone_cell.text_content().strip() if phone_cell else ""
@@ -172,6 +178,8 @@ with sync_playwright() as p:
             bookings.append(booking)
     
     browser.close()
+    ready.report()
+    block_stats.report()
     
     result = {
         "success": True,
@@ -2,12 +2,36 @@
 """
 8週間分の予約をスクレイピングして8weeks_bookingsテーブルに保存
 詳細ページをスキップ、一覧ページから直接保存
+--concurrency N で同一ログインコンテキスト内のN枚のページで並列クロール
+まずrequestsでHTML取得を試み、ログイン切れ・JS必須のページだけPlaywrightで取得
+前回から内容が変わっていない日（フィンガープリント一致）は保存処理をスキップ
+スケジュールの予約ブロックが既存予約と一致した日（翌日以降）は予約一覧ページ自体を読まない
+日付の近さに応じたティアごとの間隔（utils/crawl_tiers.py）を過ぎた日だけを取得する（--all-days で全日）
+前回との差分（新規・時刻/スタッフ/メニュー変更・キャンセル）を logs/booking_events.jsonl に追記する
 """
+import argparse
+import asyncio
 import json
 import re
 import os
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from utils.page_ready import (ReadyWaiter, LOGIN_READY, RESERVE_LIST_READY, RESERVE_DETAIL_READY,
+                              SCHEDULE_READY, SCHEDULE_RESERVATIONS_READY)
+from utils.salonboard_http import SalonBoardHttpClient, LoginRequired
+from utils.salonboard_parser import extract_reserve_rows, extract_menu
+from utils.page_extract import async_evaluate_reserve_rows, async_evaluate_schedule
+from utils.day_fingerprint import DayFingerprintStore, compute_fingerprint
+from utils.supabase_batch import SupabaseBatchWriter, supabase_session, DEFAULT_BATCH_SIZE
+from utils.customer_index import CustomerPhoneIndex
+from utils.booking_reconcile import reconcile_stale_bookings, PendingCancellations
+from utils.schedule_bookings import match_known_bookings
+from utils.browser_context import new_async_blocking_context
+from utils.slot_engine import build_all_slots
+from utils.shared_browser import async_shared_browser
+from utils.crawl_tiers import CrawlFreshnessStore
+from utils.booking_events import diff_bookings, removal_events, append_events, count_by_type
 
 print(f"[STARTUP] scrape_8weeks_v3.py 開始", flush=True)
 
@@ -16,36 +40,36 @@ JST = timezone(timedelta(hours=9))
 SUPABASE_URL = os.environ.get('SUPABASE_URL', 'https://lsrbeugmqqqklywmvjjs.supabase.co')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY', '')
 
-def get_phone_for_customer(customer_name, booking_id):
-    """顧客の電話番号を取得（customersテーブルから検索）"""
-    if not SUPABASE_KEY:
-        return ''
-    headers = {'apikey': SUPABASE_KEY, 'Authorization': f'Bearer {SUPABASE_KEY}'}
-    res = requests.get(
-        f'{SUPABASE_URL}/rest/v1/customers?name=ilike.*{customer_name}*&select=phone',
-        headers=headers
-    )
-    if res.status_code == 200 and res.json():
-        phone = res.json()[0].get('phone', '')
-        if phone:
-            print(f"[PHONE] {customer_name} → {phone}")
-            return phone
-    return ''
+# 同時に開くページ数（SalonBoardに不審なアクセスと判定されないよう上限を設ける）
+DEFAULT_CONCURRENCY = int(os.environ.get('SCRAPE_CONCURRENCY', '1'))
+MAX_CONCURRENCY = 4
+CRAWL_DAYS = 56
+SLOT_DAYS = 14
+# ブラウザなしのHTTP取得を先に試すか（0でPlaywrightのみ）
+HTTP_FETCH = os.environ.get('SCRAPE_HTTP_FETCH', '1') != '0'
 
-def login_to_salonboard(page):
+def clamp_concurrency(value):
+    """並列数を1〜MAX_CONCURRENCYに丸める"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        value = DEFAULT_CONCURRENCY
+    return max(1, min(value, MAX_CONCURRENCY))
+
+async def login_to_salonboard(page, ready):
     login_id = os.environ.get('SALONBOARD_LOGIN_ID', 'CD18317')
     login_password = os.environ.get('SALONBOARD_LOGIN_PASSWORD', 'Ne8T2Hhi!')
     
     print(f"[LOGIN] ログインページにアクセス中...", flush=True)
-    page.goto('https://salonboard.com/login/', timeout=60000)
-    page.wait_for_timeout(5000)
+    await page.goto('https://salonboard.com/login/', timeout=60000)
+    await ready.async_wait(page, LOGIN_READY, 5000, label='login')
     
     print(f"[LOGIN] 現在のURL: {page.url}", flush=True)
-    print(f"[LOGIN] ページタイトル: {page.title()}", flush=True)
+    print(f"[LOGIN] ページタイトル: {await page.title()}", flush=True)
     
     # ID入力
     try:
-        page.fill('input[name="userId"]', login_id)
+        await page.fill('input[name="userId"]', login_id)
         print(f"[LOGIN] ID入力成功", flush=True)
     except Exception as e:
         print(f"[LOGIN] ID入力失敗: {e}", flush=True)
@@ -53,7 +77,7 @@ def login_to_salonboard(page):
     
     # パスワード入力
     try:
-        page.fill('input[name="password"]', login_password)
+        await page.fill('input[name="password"]', login_password)
         print(f"[LOGIN] パスワード入力成功", flush=True)
     except Exception as e:
         print(f"[LOGIN] パスワード入力失敗: {e}", flush=True)
@@ -62,7 +86,7 @@ def login_to_salonboard(page):
     # ログインボタンクリック（JavaScript実行）
     try:
         print(f"[LOGIN] JavaScriptでdologin()を実行...", flush=True)
-        page.evaluate("dologin(new Event('click'))")
+        await page.evaluate("dologin(new Event('click'))")
         print(f"[LOGIN] dologin()実行成功", flush=True)
     except Exception as e:
         print(f"[LOGIN] dologin()失敗: {e}", flush=True)
@@ -70,32 +94,372 @@ def login_to_salonboard(page):
     
     # ページ遷移を待つ
     try:
-        page.wait_for_timeout(3000)  # 3秒待機
+        await page.wait_for_timeout(3000)  # 3秒待機
         print(f"[LOGIN] 3秒後のURL: {page.url}", flush=True)
-        print(f"[LOGIN] 3秒後のタイトル: {page.title()}", flush=True)
-        page.wait_for_url("**/KLP/**", timeout=27000)
+        print(f"[LOGIN] 3秒後のタイトル: {await page.title()}", flush=True)
+        await page.wait_for_url("**/KLP/**", timeout=27000)
         print(f"[LOGIN] ページ遷移成功", flush=True)
     except Exception as e:
         print(f"[LOGIN] ページ遷移タイムアウト: {e}", flush=True)
         # エラーメッセージを確認
-        error_msg = page.query_selector('.error, .errorMessage, .mod_error')
+        error_msg = await page.query_selector('.error, .errorMessage, .mod_error')
         if error_msg:
-            print(f"[LOGIN] エラーメッセージ: {error_msg.inner_text()}", flush=True)
+            print(f"[LOGIN] エラーメッセージ: {await error_msg.inner_text()}", flush=True)
         print(f"[LOGIN] 現在のURL: {page.url}", flush=True)
         return False
     
     print(f"[LOGIN] ログイン後URL: {page.url}", flush=True)
     return 'login' not in page.url.lower()
 
-def main():
-    print(f"[{datetime.now(JST)}] 8週間予約スクレイピング開始", flush=True)
+def parse_booking_row(time_text, status_text, href, name_text, staff_text, source, target_date):
+    """予約一覧の1行分のテキストから予約データを作る（対象外の行はNone）"""
+    id_match = re.search(r'reserveId=([A-Z]{2}\d+)', href or '')
+    booking_id = id_match.group(1) if id_match else None
+    if not booking_id:
+        return None
+    
+    if "受付待ち" not in status_text:
+        return None
+    
+    customer_name = re.sub(r'[★☆♪♡⭐️🦁]', '', name_text).strip()
+    if not customer_name:
+        return None
+    
+    time_match = re.search(r'(\d{1,2}:\d{2})', time_text)
+    time_only = time_match.group(1) if time_match else "00:00"
+    visit_datetime = f"{target_date.strftime('%Y-%m-%d')} {time_only}:00"
+    
+    staff = re.sub(r'^\(指\)', '', staff_text).strip() if staff_text.startswith('(指)') else ''
+    
+    return {
+        'booking_id': booking_id,
+        'customer_name': customer_name,
+        'visit_datetime': visit_datetime,
+        'staff': staff,
+        'source': source,
+        'href': href
+    }
+
+def apply_cached_menus(bookings_data, existing_cache):
+    """キャッシュ済みのメニューを埋め、詳細ページの取得が必要な予約を返す"""
+    missing = []
+    for item in bookings_data:
+        cached_menu = existing_cache.get(item['booking_id'], {}).get('menu') or ''
+        if cached_menu:
+            item['menu'] = cached_menu
+            print(f"[CACHE] {item['customer_name']} → {cached_menu[:30]}", flush=True)
+        elif item['href']:
+            missing.append(item)
+        else:
+            item['menu'] = ''
+    return missing
+
+def prepare_day(raw_rows, target_date, fingerprints, existing_cache):
+    """行データから予約を組み立てる（前回と同じ内容ならbookings=None）
+    
+    戻り値: ({'fingerprint', 'bookings'}, メニュー取得が必要な予約のリスト)
+    """
+    fingerprint = compute_fingerprint(raw_rows)
+    if fingerprints.is_unchanged(target_date.strftime('%Y%m%d'), fingerprint):
+        print(f"[SKIP] {target_date.strftime('%Y-%m-%d')} 変更なし", flush=True)
+        return {'fingerprint': fingerprint, 'bookings': None}, []
+    
+    bookings_data = [item for item in (parse_booking_row(**raw, target_date=target_date) for raw in raw_rows) if item]
+    return {'fingerprint': fingerprint, 'bookings': bookings_data}, apply_cached_menus(bookings_data, existing_cache)
+
+def confirm_day_from_schedule(target_date, schedule, existing_cache):
+    """スケジュールの予約ブロックが既存予約と一致すれば、予約一覧を読まずに「変更なし」とする
+    
+    当日はステータス（来店・会計済み）の変化をスケジュールで判別できないので常に予約一覧で確認
+    """
+    if schedule is None or target_date.date() <= datetime.now(JST).date():
+        return None
+    booking_ids = match_known_bookings(schedule, target_date.strftime('%Y%m%d'), existing_cache)
+    if booking_ids is None:
+        return None
+    print(f"[SCHEDULE] {target_date.strftime('%Y-%m-%d')} 予約{len(booking_ids)}件がスケジュールと一致、予約一覧を省略", flush=True)
+    return {'fingerprint': None, 'bookings': None, 'booking_ids': booking_ids}
+
+def confirm_days(dates, schedules, existing_cache):
+    """スケジュールで確認できた日の結果（確認できなかった日はNone）"""
+    return [confirm_day_from_schedule(d, schedules.get(d.strftime('%Y%m%d')), existing_cache) for d in dates]
+
+def save_available_slots(schedules, writer):
+    """取得済みスケジュールから空き枠をSupabaseに保存"""
+    print(f"\n[空き枠] {len(schedules)}日分の空き枠を保存中...", flush=True)
+    # 全日・全スタッフ分をまとめて計算
+    for date_str, day_slots in build_all_slots(schedules).items():
+        if day_slots is None:
+            print(f"[空き枠] {date_str} スケジュール取得失敗、スキップ", flush=True)
+            continue
+        
+        for staff_slots in day_slots:
+            staff_info = staff_slots['staff_info']
+            writer.add({
+                'date': date_str,
+                'staff_id': staff_info['id'],
+                'staff_name': staff_info['name'],
+                'is_day_off': staff_slots['is_day_off'],
+                'slots': staff_slots['slots'],
+                'updated_at': datetime.now().isoformat()
+            })
     
+    writer.flush()
+    print(f"[空き枠] 保存完了: {writer.saved}件（失敗{len(writer.failed_rows)}件）", flush=True)
+
+# === HTTP取得（ブラウザなし） ===
+
+def http_crawl_day(http, target_date, existing_cache, fingerprints):
+    """requestsで1日分の予約一覧とメニューを取得（ブラウザが必要ならNone）"""
+    label = target_date.strftime('%Y-%m-%d')
     try:
-        from playwright.sync_api import sync_playwright
-        print("[OK] playwright インポート成功", flush=True)
+        html = http.fetch_reserve_list(target_date.strftime('%Y%m%d'))
+        raw_rows = extract_reserve_rows(html)
+        if raw_rows is None:
+            print(f"[HTTP] {label} 予約一覧テーブルなし → ブラウザで再取得", flush=True)
+            return None
+        
+        print(f"[HTTP] {label} 予約行数: {len(raw_rows)}", flush=True)
+        day_result, missing_menus = prepare_day(raw_rows, target_date, fingerprints, existing_cache)
+        
+        for item in missing_menus:
+            item['menu'] = extract_menu(http.get_page(item['href']))
+            if item['menu']:
+                print(f"[MENU] {item['customer_name']} → {item['menu'][:30]}", flush=True)
+        return day_result
+    except LoginRequired:
+        return None
     except Exception as e:
-        print(f"[ERROR] playwright インポート失敗: {e}", flush=True)
-        return
+        print(f"[HTTP] {label} 取得エラー → ブラウザで再取得: {e}", flush=True)
+        return None
+
+def crawl_http(dates, concurrency, existing_cache, fingerprints):
+    """予約一覧をrequestsで並列取得（取得できなかった日はNone）
+
+    スケジュールはJSで描画されるのでHTTPでは取らない（crawl_schedulesでブラウザから取得）
+    """
+    http = SalonBoardHttpClient(pool_size=concurrency)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            day_results = list(executor.map(lambda d: http_crawl_day(http, d, existing_cache, fingerprints), dates))
+    finally:
+        http.close()
+    
+    fetched = sum(1 for r in day_results if r is not None)
+    print(f"[HTTP] 予約一覧{fetched}/{len(dates)}日取得 "
+          f"({http.stats['bytes'] // 1024}KB, ログイン切れ{http.stats['login_required']}回)", flush=True)
+    return day_results
+
+# === Playwright取得（HTTPで取れなかった分のフォールバック） ===
+
+async def extract_day_rows(page, target_date):
+    """予約一覧ページから各行のテキストを1回のevaluateで抽出（テーブルがなければNone）"""
+    raw_rows = await async_evaluate_reserve_rows(page)
+    if raw_rows is not None:
+        print(f"[DEBUG] {target_date.strftime('%Y-%m-%d')} 予約行数: {len(raw_rows)}", flush=True)
+    return raw_rows
+
+async def fetch_menu(page, item, ready):
+    """詳細ページからメニューを取得"""
+    menu = ''
+    try:
+        detail_url = f"https://salonboard.com{item['href']}"
+        await page.goto(detail_url, timeout=15000)
+        await ready.async_wait(page, RESERVE_DETAIL_READY, 500, label='reserveDetail')
+        menu_el = await page.query_selector('th:has-text("メニュー") + td')
+        if not menu_el:
+            menu_el = await page.query_selector('td:has-text("【")')
+        if menu_el:
+            menu = (await menu_el.inner_text()).strip()[:100]
+            print(f"[MENU] {item['customer_name']} → {menu[:30]}", flush=True)
+    except Exception as e:
+        print(f"[MENU] 取得スキップ: {item['customer_name']}", flush=True)
+    return menu
+
+async def crawl_day(page, target_date, existing_cache, fingerprints, ready):
+    """1日分の予約一覧を取得し、未取得のメニューを補完（失敗時はNone）"""
+    label = target_date.strftime('%Y-%m-%d')
+    url = f"https://salonboard.com/KLP/reserve/reserveList/searchDate?date={target_date.strftime('%Y%m%d')}"
+    print(f"[{label}] アクセス中...", flush=True)
+    
+    try:
+        await page.goto(url, timeout=60000)
+        await ready.async_wait(page, RESERVE_LIST_READY, 2000, label='reserveList')
+    except Exception as e:
+        print(f"[{label}] アクセスエラー、スキップ: {e}", flush=True)
+        return None
+    
+    raw_rows = await extract_day_rows(page, target_date)
+    if raw_rows is None:
+        print(f"[{label}] 予約一覧テーブルなし、スキップ", flush=True)
+        return None
+    
+    day_result, missing_menus = prepare_day(raw_rows, target_date, fingerprints, existing_cache)
+    
+    # キャッシュにメニューがなければ詳細ページから取得
+    for item in missing_menus:
+        item['menu'] = await fetch_menu(page, item, ready)
+    
+    return day_result
+
+async def crawl_reserve_days(context, first_page, dates, concurrency, existing_cache, fingerprints, ready):
+    """予約一覧を並列クロール（結果は日付順）"""
+    results = [None] * len(dates)
+    queue = asyncio.Queue()
+    for index, target_date in enumerate(dates):
+        queue.put_nowait((index, target_date))
+    
+    async def worker(page):
+        while True:
+            try:
+                index, target_date = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                results[index] = await crawl_day(page, target_date, existing_cache, fingerprints, ready)
+            except Exception as e:
+                print(f"[{target_date.strftime('%Y-%m-%d')}] クロール例外: {e}", flush=True)
+    
+    pages = [first_page]
+    for _ in range(min(concurrency, len(dates)) - 1):
+        pages.append(await context.new_page())
+    
+    print(f"[CRAWL] {len(dates)}日分を{len(pages)}ページで取得", flush=True)
+    await asyncio.gather(*(worker(page) for page in pages))
+    
+    for page in pages[1:]:
+        await page.close()
+    return results
+
+async def extract_schedule_page(page):
+    """表示中のスケジュールページからスタッフ一覧と各スタッフ行を1回のevaluateで抽出"""
+    return await async_evaluate_schedule(page) or {'staff_list': [], 'rows': []}
+
+async def crawl_schedules(page, schedule_dates, ready):
+    """スケジュールページを順に取得（取得できなかった日はNone）"""
+    schedules = {}
+    for date_str in schedule_dates:
+        schedules[date_str] = None
+        url = f'https://salonboard.com/KLP/schedule/salonSchedule/?date={date_str}'
+        try:
+            await page.goto(url, timeout=60000)
+        except Exception as e:
+            print(f"[空き枠] {date_str} アクセスエラー: {e}", flush=True)
+            continue
+        
+        if not await ready.async_wait(page, SCHEDULE_READY, 15000, label='salonSchedule'):
+            continue
+        if not await page.query_selector('.scheduleMainTableLine'):
+            continue
+        # 予約ブロックの描画を待つ（予約のない日は従来通り1秒で打ち切り）
+        await ready.async_wait(page, SCHEDULE_RESERVATIONS_READY, 1000, label='scheduleReservations')
+        
+        schedules[date_str] = await extract_schedule_page(page)
+    return schedules
+
+async def crawl(dates, schedule_dates, concurrency, existing_cache, fingerprints, use_http=False):
+    """ブラウザを起動してスケジュールと予約一覧を取得（ログイン失敗時はNone）
+
+    スケジュールを先に取得し、予約が既存と一致した日は予約一覧を読まない。
+    use_http=Trueなら残りの予約一覧はまずrequestsで取得し、取れなかった日だけブラウザで開く
+    """
+    from playwright.async_api import async_playwright
+    
+    ready = ReadyWaiter('scrape_8weeks_v3')
+    
+    async with async_playwright() as p, async_shared_browser(p, 'scrape_8weeks_v3') as browser:
+        print("[OK] ブラウザ準備完了", flush=True)
+        
+        # 常駐ブラウザでも他の利用者とクッキーを共有しない専用コンテキスト
+        context, block_stats = await new_async_blocking_context(
+            browser, 'scrape_8weeks_v3',
+            user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
+            viewport={'width': 1920, 'height': 1080},
+            locale='ja-JP',
+            timezone_id='Asia/Tokyo'
+        )
+        
+        try:
+            try:
+                with open('session_cookies.json', 'r') as f:
+                    cookies = json.load(f)
+                await context.add_cookies(cookies)
+                print(f"[OK] クッキー読み込み: {len(cookies)}個", flush=True)
+            except Exception as e:
+                print(f"[WARN] クッキー読み込み失敗: {e}", flush=True)
+            
+            page = await context.new_page()
+            
+            # ログイン確認（並列クロール前に1回だけ）
+            first_date = dates[0] if dates else datetime.now(JST)
+            first_url = f"https://salonboard.com/KLP/reserve/reserveList/searchDate?date={first_date.strftime('%Y%m%d')}"
+            try:
+                await page.goto(first_url, timeout=60000)
+                await ready.async_wait(page, RESERVE_LIST_READY, 2000, label='reserveList')
+            except Exception as e:
+                print(f"[WARN] 初回アクセスエラー: {e}", flush=True)
+            
+            if 'login' in page.url.lower() or 'エラー' in await page.title() or len(await page.query_selector_all('table')) == 0:
+                print("[WARN] ログインが必要", flush=True)
+                if not await login_to_salonboard(page, ready):
+                    print("[ERROR] ログイン失敗", flush=True)
+                    return None
+                
+                new_cookies = await context.cookies()
+                with open('session_cookies.json', 'w') as f:
+                    json.dump(new_cookies, f, indent=2, ensure_ascii=False)
+                print("[OK] ログイン成功、クッキー保存", flush=True)
+            
+            # スケジュールを先に取得し、予約が既存と一致した日は予約一覧を省略
+            schedules = await crawl_schedules(page, schedule_dates, ready)
+            day_results = confirm_days(dates, schedules, existing_cache)
+            pending = [i for i, r in enumerate(day_results) if r is None]
+            print(f"[CRAWL] スケジュールで確認: {len(dates) - len(pending)}日、予約一覧を取得: {len(pending)}日", flush=True)
+            if pending and use_http:
+                # ログイン直後のクッキーが保存済みなのでHTTPでも取得できる
+                http_results = await asyncio.to_thread(crawl_http, [dates[i] for i in pending], concurrency,
+                                                       existing_cache, fingerprints)
+                for i, result in zip(pending, http_results):
+                    day_results[i] = result
+                pending = [i for i in pending if day_results[i] is None]
+            if pending:
+                results = await crawl_reserve_days(context, page, [dates[i] for i in pending], concurrency,
+                                                   existing_cache, fingerprints, ready)
+                for i, result in zip(pending, results):
+                    day_results[i] = result
+            
+            block_stats.report()
+            return day_results, schedules
+        finally:
+            ready.report()
+            await context.close()
+
+def main(concurrency=DEFAULT_CONCURRENCY, use_http=HTTP_FETCH, batch_size=DEFAULT_BATCH_SIZE, all_days=False):
+    """8週間分をスクレイピングして保存。完了時は件数のサマリー、途中で中断した場合はNoneを返す
+
+    all_days=Falseならティアの間隔を過ぎた日だけを取得する
+    """
+    concurrency = clamp_concurrency(concurrency)
+    print(f"[{datetime.now(JST)}] 8週間予約スクレイピング開始（並列数: {concurrency}）", flush=True)
+    
+    # クロール対象の日（ティアごとの間隔を過ぎた日）
+    crawl_started_at = datetime.now()
+    today = datetime.now(JST)
+    window = [today + timedelta(days=day_offset) for day_offset in range(CRAWL_DAYS)]
+    freshness = CrawlFreshnessStore()
+    freshness.prune(today.strftime('%Y%m%d'))
+    offsets = list(range(CRAWL_DAYS)) if all_days else freshness.due_offsets(today, CRAWL_DAYS)
+    dates = [window[day_offset] for day_offset in offsets]
+    schedule_dates = [window[day_offset].strftime('%Y%m%d') for day_offset in offsets if day_offset < SLOT_DAYS]
+    # 今回取得しない日（間隔内で省略した日）
+    due_offsets = set(offsets)
+    not_due_dates = {d.strftime('%Y-%m-%d') for i, d in enumerate(window) if i not in due_offsets}
+    if not dates:
+        print("[TIER] 間隔を過ぎた日がないため終了", flush=True)
+        return {'saved': 0, 'failed': 0, 'days_crawled': 0, 'days_not_due': CRAWL_DAYS,
+                'days_processed': 0, 'days_skipped': 0, 'days_from_schedule': 0, 'days_failed': 0,
+                'events': count_by_type([])}
+    print(f"[TIER] 取得: {len(dates)}日（予約一覧） / {len(schedule_dates)}日（スケジュール）、間隔内で省略: {len(not_due_dates)}日", flush=True)
     
     SUPABASE_URL = os.environ.get('SUPABASE_URL')
     SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
@@ -113,324 +477,208 @@ def main():
         'Prefer': 'resolution=merge-duplicates'
     }
     
-   # 既存データをキャッシュ（メニュー再取得をスキップするため）
+   # 既存データをキャッシュ（メニュー再取得のスキップと削除判定・差分イベントに使用）
     existing_cache = {}
+    # 読み込めなかった回は全件が「新規」に見えるので差分イベントを出さない
+    cache_loaded = False
     try:
         cache_res = requests.get(
-            f"{SUPABASE_URL}/rest/v1/8weeks_bookings?select=booking_id,menu",
+            f"{SUPABASE_URL}/rest/v1/8weeks_bookings?select=booking_id,menu,customer_name,visit_datetime,staff",
             headers=headers
         )
         if cache_res.status_code == 200:
             for item in cache_res.json():
-                existing_cache[item['booking_id']] = item.get('menu', '')
+                existing_cache[item['booking_id']] = item
+            cache_loaded = True
             print(f"[CACHE] 既存データ: {len(existing_cache)}件", flush=True)
     except Exception as e:
         print(f"[CACHE] キャッシュ取得エラー: {e}", flush=True)
     
     # 今回取得した予約IDを記録（最後に削除判定で使用）
-    scraped_booking_ids = []
+    scraped_booking_ids = set()
+    # 取得に失敗した日（この日の既存予約は削除しない）
+    failed_dates = set()
     
-    today = datetime.now(JST)
-    total_saved = 0
+    session = supabase_session(SUPABASE_KEY)
+    booking_writer = SupabaseBatchWriter(SUPABASE_URL, SUPABASE_KEY, '8weeks_bookings',
+                                         on_conflict='booking_id', batch_size=batch_size, session=session)
+    slot_writer = SupabaseBatchWriter(SUPABASE_URL, SUPABASE_KEY, 'available_slots',
+                                      on_conflict='date,staff_id', batch_size=batch_size, session=session)
+    # 保存が終わるまで更新を保留するフィンガープリント（日付 → (hash, 予約ID)）
+    pending_fingerprints = {}
+    # 顧客の電話番号インデックス（保存する日があるときだけ1回読み込む）
+    phone_index = None
+    
+    fingerprints = DayFingerprintStore()
+    fingerprints.prune(today.strftime('%Y%m%d'))
+    days_processed = 0
+    days_skipped = 0
+    days_from_schedule = 0
+    days_failed = 0
+    # 今回保存した予約（差分イベント用）
+    saved_items = []
+    events = []
     
     try:
-        with sync_playwright() as p:
-            print("[OK] Playwright起動", flush=True)
-            browser = p.chromium.launch(headless=True, args=['--disable-blink-features=AutomationControlled'])
-            print("[OK] ブラウザ起動", flush=True)
-            
-            context = browser.new_context(
-                user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
-                viewport={'width': 1920, 'height': 1080},
-                locale='ja-JP',
-                timezone_id='Asia/Tokyo'
-            )
-            
+        day_results, schedules = [None] * len(dates), dict.fromkeys(schedule_dates)
+        # 1. スケジュールを取らない回（近い日が対象外）はまずブラウザなしで予約一覧を取得
+        if use_http and not schedule_dates:
+            day_results = crawl_http(dates, concurrency, existing_cache, fingerprints)
+        
+        # 2. スケジュール（JS描画が必要）と取得できなかった予約一覧をブラウザで取得
+        #    スケジュールで一致を確認した日は予約一覧を読まず、残りはHTTP→ブラウザの順に取得
+        pending_days = [i for i, r in enumerate(day_results) if r is None]
+        if pending_days or schedule_dates:
+            print(f"[CRAWL] ブラウザで取得: スケジュール{len(schedule_dates)}日 / 予約一覧 最大{len(pending_days)}日", flush=True)
             try:
-                with open('session_cookies.json', 'r') as f:
-                    cookies = json.load(f)
-                context.add_cookies(cookies)
-                print(f"[OK] クッキー読み込み: {len(cookies)}個", flush=True)
+                import playwright.async_api
+                print("[OK] playwright インポート成功", flush=True)
             except Exception as e:
-                print(f"[WARN] クッキー読み込み失敗: {e}", flush=True)
-            
-            page = context.new_page()
+                print(f"[ERROR] playwright インポート失敗: {e}", flush=True)
+                return
             
-            # 8週間分（56日）をループ
-            for day_offset in range(56):
-                target_date = today + timedelta(days=day_offset)
-                date_str = target_date.strftime('%Y%m%d')
-                url = f'https://salonboard.com/KLP/reserve/reserveList/searchDate?date={date_str}'
-                
-                print(f"[{target_date.strftime('%Y-%m-%d')}] アクセス中...", flush=True)
-                
-                try:
-                    page.goto(url, timeout=60000)
-                    page.wait_for_timeout(2000)
-                except Exception as e:
-                    print(f"[{target_date.strftime('%Y-%m-%d')}] アクセスエラー、スキップ: {e}", flush=True)
-                    continue
-                
-                # ログイン確認（初回のみ）
-                if day_offset == 0 and ('login' in page.url.lower() or 'エラー' in page.title() or len(page.query_selector_all('table')) == 0):
-                    print("[WARN] ログインが必要", flush=True)
-                    if not login_to_salonboard(page):
-                        print("[ERROR] ログイン失敗", flush=True)
-                        browser.close()
-                        return
-                    
-                    new_cookies = context.cookies()
-                    with open('session_cookies.json', 'w') as f:
-                        json.dump(new_cookies, f, indent=2, ensure_ascii=False)
-                    print("[OK] ログイン成功、クッキー保存", flush=True)
-                    
-                    page.goto(url, timeout=60000)
-                    page.wait_for_timeout(2000)
-                
-                # 予約一覧テーブルを特定
-                reservation_table = None
-                tables = page.query_selector_all("table")
-                for table in tables:
-                    header = table.query_selector("th#comingDate")
-                    if header:
-                        reservation_table = table
-                        break
-                
-                if not reservation_table:
-                    print(f"[{target_date.strftime('%Y-%m-%d')}] 予約一覧テーブルなし、スキップ", flush=True)
-                    continue
-                
-                rows = reservation_table.query_selector_all('tbody tr')
-                print(f"[DEBUG] 予約行数: {len(rows)}", flush=True)
-                day_saved = 0
-                
-                # フェーズ1: 一覧ページから全データを抽出
-                bookings_data = []
-                for row in rows:
-                    try:
-                        cells = row.query_selector_all('td')
-                        if len(cells) < 4:
-                            continue
-                        
-                        reserve_link = cells[2].query_selector("a[href*='reserveId=']")
-                        href = reserve_link.get_attribute("href") if reserve_link else ""
-                        id_match = re.search(r'reserveId=([A-Z]{2}\d+)', href)
-                        booking_id = id_match.group(1) if id_match else None
-                        
-                        if not booking_id:
-                            continue
-                        
-                        status_text = cells[1].text_content().strip() if len(cells) > 1 else ""
-                        if "受付待ち" not in status_text:
-                            continue
-                        
-                        name_elem = cells[2].query_selector("p.wordBreak")
-                        customer_name = name_elem.text_content().strip() if name_elem else ""
-                        customer_name = re.sub(r'[★☆♪♡⭐️🦁]', '', customer_name).strip()
-                        
-                        time_cell = cells[0].text_content().strip() if len(cells) > 0 else ""
-                        time_match = re.search(r'(\d{1,2}:\d{2})', time_cell)
-                        time_only = time_match.group(1) if time_match else "00:00"
-                        visit_datetime = f"{target_date.strftime('%Y-%m-%d')} {time_only}:00"
-                        
-                        staff_text = cells[3].text_content().strip() if len(cells) > 3 else ""
-                        staff = re.sub(r'^\(指\)', '', staff_text).strip() if staff_text.startswith('(指)') else ''
-                        
-                        source = cells[4].text_content().strip() if len(cells) > 4 else ""
-                        
-                        if customer_name:
-                            bookings_data.append({
-                                'booking_id': booking_id,
-                                'customer_name': customer_name,
-                                'visit_datetime': visit_datetime,
-                                'staff': staff,
-                                'source': source,
-                                'href': href
-                            })
-                    except Exception as e:
-                        print(f"[ERROR] 抽出例外: {e}", flush=True)
-                        continue
-                
-                # フェーズ2: 詳細ページからメニュー取得 → DB保存
-                for item in bookings_data:
-                    try:
-                        scraped_booking_ids.append(item['booking_id'])
-                        
-                        # キャッシュにメニューがあればスキップ
-                        cached_menu = existing_cache.get(item['booking_id'], '')
-                        if cached_menu:
-                            menu = cached_menu
-                            print(f"[CACHE] {item['customer_name']} → {menu[:30]}", flush=True)
-                        elif item['href']:
-                            menu = ''
-                            try:
-                                detail_url = f"https://salonboard.com{item['href']}"
-                                page.goto(detail_url, timeout=15000)
-                                page.wait_for_timeout(500)
-                                menu_el = page.query_selector('th:has-text("メニュー") + td')
-                                if not menu_el:
-                                    menu_el = page.query_selector('td:has-text("【")')
-                                if menu_el:
-                                    menu = menu_el.inner_text().strip()[:100]
-                                    print(f"[MENU] {item['customer_name']} → {menu[:30]}", flush=True)
-                            except Exception as e:
-                                print(f"[MENU] 取得スキップ: {item['customer_name']}", flush=True)
-                        else:
-                            menu = ''
-                        
-                        data = {
-                            'booking_id': item['booking_id'],
-                            'customer_name': item['customer_name'],
-                            'phone': get_phone_for_customer(item['customer_name'], item['booking_id']),
-                            'visit_datetime': item['visit_datetime'],
-                            'menu': menu,
-                            'staff': item['staff'],
-                            'status': 'confirmed',
-                            'booking_source': item['source']
-                        }
-                        
-                        res = requests.post(
-                            f'{SUPABASE_URL}/rest/v1/8weeks_bookings?on_conflict=booking_id',
-                            headers=headers,
-                            json=data
-                        )
-                        
-                        if res.status_code in [200, 201]:
-                            total_saved += 1
-                            day_saved += 1
-                        else:
-                            print(f"[ERROR] 保存失敗: {res.status_code}", flush=True)
-                    except Exception as e:
-                        print(f"[ERROR] 保存例外: {e}", flush=True)
-                        continue
-                
-                print(f"[{target_date.strftime('%Y-%m-%d')}] {day_saved}件保存", flush=True)
+            browser_results = asyncio.run(crawl([dates[i] for i in pending_days], schedule_dates, concurrency,
+                                                existing_cache, fingerprints, use_http=use_http and bool(schedule_dates)))
+            if browser_results is None:
+                return
+            for i, result in zip(pending_days, browser_results[0]):
+                day_results[i] = result
+            schedules.update(browser_results[1])
+        else:
+            print("[CRAWL] 全ページをHTTPで取得（ブラウザ起動なし）", flush=True)
+        
+        # 日付順にDB保存
+        for target_date, day_result in zip(dates, day_results):
+            date_str = target_date.strftime('%Y%m%d')
+            if day_result is None:
+                days_failed += 1
+                failed_dates.add(target_date.strftime('%Y-%m-%d'))
+                continue
             
-            # === 空き枠をSupabaseに保存 ===
-            print("\n[空き枠] 14日分の空き枠を取得・保存中...", flush=True)
-            import math
+            # 前回と同じ内容の日は保存をスキップし、削除判定用に前回の予約IDを引き継ぐ
+            if day_result['bookings'] is None:
+                if 'booking_ids' in day_result:
+                    # スケジュールで一致を確認した日
+                    scraped_booking_ids.update(day_result['booking_ids'])
+                    days_from_schedule += 1
+                else:
+                    scraped_booking_ids.update(fingerprints.booking_ids(date_str))
+                days_skipped += 1
+                continue
             
-            for day_offset in range(14):
-                target_date = today + timedelta(days=day_offset)
-                date_str = target_date.strftime('%Y%m%d')
-                
-                url = f'https://salonboard.com/KLP/schedule/salonSchedule/?date={date_str}'
-                page.goto(url, timeout=60000)
-                
-                try:
-                    page.wait_for_selector('.scheduleMainTableLine', timeout=15000)
-                    page.wait_for_timeout(1000)
-                except:
-                    continue
-                
-                # スタッフリスト取得
-                staff_list = []
-                staff_options = page.query_selector_all('#stockNameList option')
-                for opt in staff_options:
-                    value = opt.get_attribute('value') or ''
-                    name = opt.inner_text()
-                    if value.startswith('STAFF_'):
-                        staff_list.append({'id': value.split('_')[1], 'name': name})
-                
-                staff_rows = page.query_selector_all('.jscScheduleMainTableStaff .scheduleMainTableLine')
-                
-                for idx, row in enumerate(staff_rows):
-                    if idx >= len(staff_list):
-                        break
-                    staff_info = staff_list[idx]
-                    
-                    time_list = row.query_selector_all('.scheduleTime')
-                    start_time = 9
-                    if time_list:
-                        first_time = time_list[0].inner_text()
-                        try:
-                            start_time = int(first_time.split(':')[0])
-                        except:
-                            pass
-                    
-                    booked_slots = []
-                    reservations = row.query_selector_all('.scheduleReservation, .scheduleToDo')
-                    for res in reservations:
-                        time_zone = res.query_selector('.scheduleTimeZoneSetting')
-                        if time_zone:
-                            try:
-                                time_text = time_zone.inner_text()
-                                times = json.loads(time_text)
-                                if len(times) >= 2:
-                                    start_parts = times[0].split(':')
-                                    end_parts = times[1].split(':')
-                                    start_h = int(start_parts[0]) + int(start_parts[1]) / 60
-                                    end_h = int(end_parts[0]) + int(end_parts[1]) / 60
-                                    booked_slots.append({'start': start_h, 'end': end_h})
-                            except:
-                                pass
-                    
-                    day_off = row.query_selector('.isDayOff')
-                    is_day_off = day_off is not None
-                    
-                    available_slots = []
-                    if not is_day_off:
-                        booked_slots.sort(key=lambda x: x['start'])
-                        current = start_time
-                        for slot in booked_slots:
-                            if slot['start'] > current:
-                                start_min = current * 60
-                                end_min = slot['start'] * 60
-                                start_min_rounded = math.ceil(start_min / 10) * 10
-                                end_min_rounded = math.floor(end_min / 10) * 10
-                                if end_min_rounded > start_min_rounded:
-                                    start_str = f"{int(start_min_rounded // 60)}:{int(start_min_rounded % 60):02d}"
-                                    end_str = f"{int(end_min_rounded // 60)}:{int(end_min_rounded % 60):02d}"
-                                    available_slots.append({'start': start_str, 'end': end_str})
-                            current = max(current, slot['end'])
-                        if current < 19:
-                            current_min = current * 60
-                            current_min_rounded = math.ceil(current_min / 10) * 10
-                            start_str = f"{int(current_min_rounded // 60)}:{int(current_min_rounded % 60):02d}"
-                            available_slots.append({'start': start_str, 'end': '19:00'})
-                    
-                    # Supabaseに保存
-                    slot_data = {
-                        'date': date_str,
-                        'staff_id': staff_info['id'],
-                        'staff_name': staff_info['name'],
-                        'is_day_off': is_day_off,
-                        'slots': available_slots,
-                        'updated_at': datetime.now().isoformat()
-                    }
-                    
-                    requests.post(
-                        f'{SUPABASE_URL}/rest/v1/available_slots?on_conflict=date,staff_id',
-                        headers={**headers, 'Prefer': 'resolution=merge-duplicates'},
-                        json=slot_data
-                    )
-                
-                print(f"[空き枠] {date_str} 完了", flush=True)
+            bookings_data = day_result['bookings']
+            days_processed += 1
             
-            print("[空き枠] 保存完了", flush=True)
+            # 読み込めない場合は電話番号を空で上書きしないよう、この回の保存を中止する
+            if phone_index is None:
+                phone_index = CustomerPhoneIndex.load(session, SUPABASE_URL)
             
-            browser.close()
+            for item in bookings_data:
+                scraped_booking_ids.add(item['booking_id'])
+                saved_items.append(item)
+                booking_writer.add({
+                    'booking_id': item['booking_id'],
+                    'customer_name': item['customer_name'],
+                    'phone': phone_index.lookup(item['customer_name']),
+                    'visit_datetime': item['visit_datetime'],
+                    'menu': item['menu'],
+                    'staff': item['staff'],
+                    'status': 'confirmed',
+                    'booking_source': item['source']
+                })
             
-            # 今回取得していない予約を削除（キャンセル等）
-            if scraped_booking_ids:
-                try:
-                    for old_id in existing_cache.keys():
-                        if old_id not in scraped_booking_ids:
-                            del_res = requests.delete(
-                                f"{SUPABASE_URL}/rest/v1/8weeks_bookings?booking_id=eq.{old_id}",
-                                headers=headers
-                            )
-                            if del_res.status_code in [200, 204]:
-                                print(f"[DELETE] 削除: {old_id}", flush=True)
-                except Exception as e:
-                    print(f"[DELETE] 削除エラー: {e}", flush=True)
+            pending_fingerprints[date_str] = (day_result['fingerprint'], [item['booking_id'] for item in bookings_data])
+            print(f"[{target_date.strftime('%Y-%m-%d')}] {len(bookings_data)}件を保存キューに追加", flush=True)
+        
+        booking_writer.flush()
+        total_saved = booking_writer.saved
+        if phone_index is not None:
+            phone_index.report()
+        
+        # 全件保存できた日だけフィンガープリントを更新（失敗があれば次回再処理）
+        failed_ids = {row['booking_id'] for row in booking_writer.failed_rows}
+        if cache_loaded:
+            events = diff_bookings(existing_cache, [item for item in saved_items if item['booking_id'] not in failed_ids])
+        for date_str, (fingerprint, booking_ids) in pending_fingerprints.items():
+            if not failed_ids.intersection(booking_ids):
+                fingerprints.update(date_str, fingerprint, booking_ids)
+        
+        try:
+            fingerprints.save()
+        except Exception as e:
+            print(f"[FINGERPRINT] 保存失敗: {e}", flush=True)
+        
+        # 取得・保存できた日（スケジュール対象日はスケジュールも取得できた日）だけ最終取得時刻を更新
+        refreshed = []
+        for target_date, day_result in zip(dates, day_results):
+            date_str = target_date.strftime('%Y%m%d')
+            if day_result is None or schedules.get(date_str, True) is None:
+                continue
+            if failed_ids.intersection(pending_fingerprints.get(date_str, (None, []))[1]):
+                continue
+            refreshed.append(date_str)
+        freshness.mark(refreshed)
+        try:
+            freshness.save()
+        except Exception as e:
+            print(f"[TIER] 保存失敗: {e}", flush=True)
+        
+        # === 空き枠をSupabaseに保存 ===
+        save_available_slots(schedules, slot_writer)
+        
+        # 今回取得していない予約を削除（キャンセル等）
+        # 削除判定は今回取得できた日の予約だけ（取得失敗・間隔内で省略・範囲外の日は残す）
+        crawled_dates = {d.strftime('%Y-%m-%d') for d in dates} - failed_dates
+        if crawled_dates and cache_loaded:
+            try:
+                # キャンセルは、まだ取得していない日への移動でないと分かる（全日を取得し直す）まで保留
+                pending_cancellations = PendingCancellations()
+                deleted = reconcile_stale_bookings(
+                    session, SUPABASE_URL, existing_cache, scraped_booking_ids, crawled_dates, now=datetime.now(JST),
+                    pending=pending_cancellations, crawl_started_at=crawl_started_at,
+                    window_refreshed_since=lambda since: freshness.refreshed_since(today, CRAWL_DAYS, since)
+                )
+                pending_cancellations.save()
+                events.extend(removal_events(deleted))
+            except Exception as e:
+                print(f"[DELETE] 削除エラー: {e}", flush=True)
+        
+        # 予約の変化をイベントログに追記
+        try:
+            append_events(events, run_id=today.strftime('%Y%m%d%H%M%S'))
+        except Exception as e:
+            print(f"[EVENT] 追記エラー: {e}", flush=True)
+        if events:
+            print(f"[EVENT] {len(events)}件: " + ', '.join(f'{k}={v}' for k, v in count_by_type(events).items() if v), flush=True)
     except Exception as e:
         print(f"[ERROR] 致命的エラー: {e}", flush=True)
         import traceback
         traceback.print_exc()
         return
     
-    print(f"\n[完了] {total_saved}件の予約を保存", flush=True)
+    print(f"\n[完了] {total_saved}件の予約を保存、失敗{len(booking_writer.failed_rows)}件（処理{days_processed}日 / 変更なしスキップ{days_skipped}日（うちスケジュールで確認{days_from_schedule}日） / 取得失敗{days_failed}日）", flush=True)
+    return {
+        'saved': total_saved,
+        'failed': len(booking_writer.failed_rows),
+        'days_crawled': len(dates),
+        'days_not_due': len(not_due_dates),
+        'days_processed': days_processed,
+        'days_skipped': days_skipped,
+        'days_from_schedule': days_from_schedule,
+        'days_failed': days_failed,
+        'events': count_by_type(events)
+    }
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='8週間分の予約をスクレイピング')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'同時に開くページ数（1〜{MAX_CONCURRENCY}、既定: {DEFAULT_CONCURRENCY}）')
+    parser.add_argument('--no-http', action='store_true',
+                        help='HTTP取得を使わず、最初からPlaywrightで取得する')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'Supabaseへ一括保存する行数（既定: {DEFAULT_BATCH_SIZE}）')
+    parser.add_argument('--all-days', action='store_true',
+                        help='ティアの間隔に関係なく8週間分すべてを取得する')
+    args = parser.parse_args()
+    main(concurrency=args.concurrency, use_http=HTTP_FETCH and not args.no_http, batch_size=args.batch_size,
+         all_days=args.all_days)
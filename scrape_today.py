@@ -9,15 +9,19 @@ import os
 import requests
 from playwright.sync_api import sync_playwright
 from datetime import datetime, timedelta, timezone
+from utils.page_ready import ReadyWaiter, LOGIN_READY, RESERVE_LIST_READY, RESERVE_DETAIL_READY
+from utils.browser_context import new_blocking_context
+from utils.shared_browser import shared_browser
+from utils.page_extract import evaluate_table_cells
 
 JST = timezone(timedelta(hours=9))
 
-def login_to_salonboard(page):
+def login_to_salonboard(page, ready):
     login_id = os.environ.get('SALONBOARD_LOGIN_ID', 'CD18317')
     login_password = os.environ.get('SALONBOARD_LOGIN_PASSWORD', 'Ne8T2Hhi!')
     
     page.goto('https://salonboard.com/login/', timeout=60000)
-    page.wait_for_timeout(3000)
+    ready.wait(page, LOGIN_READY, 3000, label='login')
     page.fill('input[name="userId"]', login_id)
     page.fill('input[name="password"]', login_password)
     page.click('a:has-text("ログイン")')
@@ -43,10 +47,11 @@ def main():
     }
     
     today = datetime.now(JST).strftime('%Y%m%d')
+    ready = ReadyWaiter('scrape_today')
     
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True, args=['--disable-blink-features=AutomationControlled'])
-        context = browser.new_context(
+    with sync_playwright() as p, shared_browser(p, 'scrape_today') as browser:
+        context, block_stats = new_blocking_context(
+            browser, 'scrape_today',
             user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
             viewport={'width': 1920, 'height': 1080},
             locale='ja-JP',
@@ -64,11 +69,11 @@ def main():
         url = f'https://salonboard.com/KLP/reserve/reserveList/searchDate?date={today}'
         
         page.goto(url, timeout=90000)
-        page.wait_for_timeout(3000)
+        ready.wait(page, RESERVE_LIST_READY, 3000, label='reserveList')
         
         if 'login' in page.url.lower() or 'エラー' in page.title() or len(page.query_selector_all('table')) == 0:
-            if not login_to_salonboard(page):
-                browser.close()
+            if not login_to_salonboard(page, ready):
+                context.close()
                 return
             
             new_cookies = context.cookies()
@@ -76,19 +81,18 @@ def main():
                 json.dump(new_cookies, f, indent=2, ensure_ascii=False)
             
             page.goto(url, timeout=90000)
-            page.wait_for_timeout(3000)
+            ready.wait(page, RESERVE_LIST_READY, 3000, label='reserveList')
         
         bookings = []
         seen_ids = set()
-        rows = page.query_selector_all('table tbody tr')
+        rows = evaluate_table_cells(page)
         
-        for row in rows:
+        for cells in rows:
             try:
-                cells = row.query_selector_all('td')
                 if len(cells) < 4:
                     continue
                 
-                customer_name = cells[2].text_content().strip()
+                customer_name = cells[2]
                 id_match = re.search(r'\(([A-Z]{2}\d+)\)', customer_name)
                 booking_id = id_match.group(1) if id_match else None
                 
@@ -96,7 +100,7 @@ def main():
                     continue
                 seen_ids.add(booking_id)
                 
-                source = cells[4].text_content().strip() if len(cells) > 4 else ""
+                source = cells[4] if len(cells) > 4 else ""
                 bookings.append({'booking_id': booking_id, 'source': source})
             except:
                 continue
@@ -115,7 +119,7 @@ def main():
                     detail_url = f'https://salonboard.com/KLP/reserve/ext/extReserveDetail/?reserveid={bid}'
                 
                 page.goto(detail_url)
-                page.wait_for_timeout(2000)
+                ready.wait(page, RESERVE_DETAIL_READY, 2000, label='reserveDetail')
                 
                 phone_cell = page.query_selector('tr:has-text("電話番号") td:nth-child(2)')
                 phone = phone_cell.text_content().strip() if phone_cell else ""
@@ -149,8 +153,10 @@ def main():
             except Exception as e:
                 continue
         
-        browser.close()
+        context.close()
     
+    ready.report()
+    block_stats.report()
     print(f"[完了] {updated}件の電話番号を追加")
 
 if __name__ == "__main__":
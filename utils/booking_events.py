@@ -0,0 +1,104 @@
+"""
+クロールごとの予約の変化をイベントとしてJSON Linesに追記する
+前回の8weeks_bookings（クロール開始時に読み込んだ既存行）と今回取得した予約を比べて、
+新規・時刻変更・スタッフ変更・キャンセル・来店済みを型付きのイベントにする。
+メニューは一度取得した値をクロール間で使い回す（詳細ページを読み直さない）ので、変更は検出できずイベントにしない。
+店舗通知・空き枠更新・リマインドなどはテーブル全体を読み直さず、このログの差分だけを読めばよい。
+"""
+import json
+import os
+from datetime import datetime
+
+BOOKING_EVENT_LOG = os.path.join('logs', 'booking_events.jsonl')
+
+NEW = 'new'
+MOVED_TIME = 'moved_time'
+MOVED_STAFF = 'moved_staff'
+CANCELLED = 'cancelled'
+COMPLETED = 'completed'
+EVENT_TYPES = (NEW, MOVED_TIME, MOVED_STAFF, CANCELLED, COMPLETED)
+
+
+def _minute(visit_datetime):
+    """'YYYY-MM-DD HH:MM:SS' / 'YYYY-MM-DDTHH:MM:SS+09:00' → 'YYYY-MM-DD HH:MM'（DBと取得値の表記差をそろえる）"""
+    return (visit_datetime or '').replace('T', ' ')[:16]
+
+
+def _event(event_type, booking_id, row, **changes):
+    event = {
+        'type': event_type,
+        'booking_id': booking_id,
+        'customer_name': row.get('customer_name', ''),
+        'visit_datetime': row.get('visit_datetime', ''),
+        'staff': row.get('staff', '')
+    }
+    event.update(changes)
+    return event
+
+
+def diff_bookings(existing_rows, scraped_items):
+    """今回取得した予約と既存行の差分イベント（キャンセルは削除結果から removal_events で作る）
+
+    existing_rows: booking_id → 既存行（customer_name, visit_datetime, staff, menu）
+    scraped_items: 今回保存した予約（booking_id, customer_name, visit_datetime, staff, menu）
+    menuは新規イベントにだけ載せる
+    """
+    events = []
+    for item in scraped_items:
+        booking_id = item['booking_id']
+        before = existing_rows.get(booking_id)
+        if before is None:
+            events.append(_event(NEW, booking_id, item, menu=item.get('menu', '')))
+            continue
+        if _minute(before.get('visit_datetime')) != _minute(item.get('visit_datetime')):
+            events.append(_event(MOVED_TIME, booking_id, item, previous_visit_datetime=before.get('visit_datetime', '')))
+        if (before.get('staff') or '') != (item.get('staff') or ''):
+            events.append(_event(MOVED_STAFF, booking_id, item, previous_staff=before.get('staff', '')))
+    return events
+
+
+def removal_events(deleted_rows):
+    """reconcile_stale_bookingsで削除した行 → cancelled / completedイベント（過去日になった行は出さない）"""
+    return [
+        _event(row['reason'], row.get('booking_id'), row)
+        for row in deleted_rows if row.get('reason') in (CANCELLED, COMPLETED)
+    ]
+
+
+def append_events(events, run_id=None, detected_at=None, path=BOOKING_EVENT_LOG):
+    """イベントにrun_id・検出時刻を付けて追記"""
+    if not events:
+        return
+    detected_at = detected_at or datetime.now().isoformat()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        for event in events:
+            f.write(json.dumps({**event, 'run_id': run_id, 'detected_at': detected_at}, ensure_ascii=False) + '\n')
+
+
+def read_events(offset=0, types=None, path=BOOKING_EVENT_LOG):
+    """offset（バイト位置）以降のイベントと次回のoffsetを返す。利用側はoffsetを保存して差分だけ読む
+
+    書き込み途中の最終行は読まずに次回に回す
+    """
+    events = []
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                event = json.loads(line)
+                if types is None or event.get('type') in types:
+                    events.append(event)
+    except FileNotFoundError:
+        pass
+    return events, offset
+
+
+def count_by_type(events):
+    counts = dict.fromkeys(EVENT_TYPES, 0)
+    for event in events:
+        counts[event['type']] = counts.get(event['type'], 0) + 1
+    return counts
@@ -0,0 +1,156 @@
+"""
+クロール結果にない予約（キャンセル等）を8weeks_bookingsから削除する
+既存IDと今回取得したIDを集合で比較し、booking_id=in.(...)でまとめて削除。
+消えた理由を分類し、キャンセル（今回取得した今日以降の日から消えた予約）だけをタイムスタンプ付きでログに残す。
+予約一覧に出るのは受付待ちの予約だけなので、来店時刻を過ぎた今日の予約（来店済み等）や過去日の予約はキャンセルではない。
+取得していない日（取得失敗・間隔内で省略・クロール範囲外）の予約は削除しない。
+ティアごとに取得する日が違うので、消えた予約はまだ取得していない日に移動しただけかもしれない。
+キャンセルはPendingCancellationsに保留し、クロール範囲の全日をその後に取得し終えてから確定する。
+"""
+import json
+import os
+from datetime import datetime
+
+CANCELLATION_LOG = os.path.join('logs', 'cancellations.jsonl')
+PENDING_CANCELLATION_FILE = 'pending_cancellations.json'
+DELETE_BATCH_SIZE = 100
+
+# 削除理由
+CANCELLED = 'cancelled'  # 今回取得した今日以降の日から消えた
+COMPLETED = 'completed'  # 来店時刻を過ぎた今日の予約が一覧から消えた（来店済み等のステータス変更）
+EXPIRED = 'expired'  # 過去日になった
+
+
+def classify_stale(row, crawled_dates, now):
+    """今回取得されなかった既存行の削除理由（削除しないならNone）
+
+    crawled_dates: 今回取得できた日（'YYYY-MM-DD'）の集合
+    now: 現在時刻（JST）
+    """
+    visit = (row.get('visit_datetime') or '').replace('T', ' ')
+    day = visit[:10]
+    today = now.strftime('%Y-%m-%d')
+    if day < today:
+        return EXPIRED
+    if day not in crawled_dates:
+        return None
+    if day == today and visit[:16] <= now.strftime('%Y-%m-%d %H:%M'):
+        return COMPLETED
+    return CANCELLED
+
+
+def find_stale_ids(existing_rows, scraped_ids, crawled_dates, now):
+    """既存にあって今回取得していない予約ID → 削除理由（取得していない日の予約は含めない）
+
+    existing_rows: booking_id → 既存行（visit_datetimeを含む）
+    """
+    crawled_dates = set(crawled_dates)
+    stale = {}
+    for booking_id in sorted(set(existing_rows) - set(scraped_ids)):
+        reason = classify_stale(existing_rows[booking_id], crawled_dates, now)
+        if reason:
+            stale[booking_id] = reason
+    return stale
+
+
+class PendingCancellations:
+    """キャンセルの可能性がある予約ID → 最初に消えていたクロールの開始時刻 をJSONファイルで管理"""
+
+    def __init__(self, path=PENDING_CANCELLATION_FILE):
+        self.path = path
+        self.ids = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.ids = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[DELETE] 保留中キャンセルの読み込み失敗: {e}", flush=True)
+
+    def since(self, booking_id, crawl_started_at):
+        """保留を始めた時刻（初めてならcrawl_started_atで保留を始める）"""
+        return datetime.fromisoformat(self.ids.setdefault(booking_id, crawl_started_at.isoformat()))
+
+    def discard(self, booking_ids):
+        for booking_id in booking_ids:
+            self.ids.pop(booking_id, None)
+
+    def save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.ids, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def log_cancellations(rows, detected_at=None, path=CANCELLATION_LOG):
+    """キャンセルされた予約をJSON Linesで追記"""
+    if not rows:
+        return
+    detected_at = detected_at or datetime.now().isoformat()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps({
+                'booking_id': row.get('booking_id'),
+                'customer_name': row.get('customer_name', ''),
+                'visit_datetime': row.get('visit_datetime', ''),
+                'staff': row.get('staff', ''),
+                'detected_at': detected_at
+            }, ensure_ascii=False) + '\n')
+
+
+def delete_bookings(session, supabase_url, booking_ids, batch_size=DELETE_BATCH_SIZE):
+    """booking_idsをまとめて削除し、実際に削除された行を返す"""
+    deleted = []
+    for i in range(0, len(booking_ids), batch_size):
+        batch = booking_ids[i:i + batch_size]
+        id_list = ','.join(f'"{booking_id}"' for booking_id in batch)
+        try:
+            res = session.delete(
+                f'{supabase_url}/rest/v1/8weeks_bookings?booking_id=in.({id_list})'
+                f'&select=booking_id,customer_name,visit_datetime,staff',
+                headers={'Prefer': 'return=representation'},
+                timeout=30
+            )
+        except Exception as e:
+            print(f"[DELETE] 削除エラー: {e}", flush=True)
+            continue
+        if res.status_code in (200, 204):
+            rows = res.json() if res.status_code == 200 and res.content else [{'booking_id': b} for b in batch]
+            deleted.extend(rows)
+            print(f"[DELETE] {len(batch)}件中{len(rows)}件削除", flush=True)
+        else:
+            print(f"[DELETE] 削除失敗: {res.status_code} {res.text[:200]}", flush=True)
+    return deleted
+
+
+def reconcile_stale_bookings(session, supabase_url, existing_rows, scraped_ids, crawled_dates, now=None,
+                             pending=None, crawl_started_at=None, window_refreshed_since=None):
+    """古い予約を一括削除し、削除した行（reasonに削除理由）を返す。キャンセルだけをログに記録
+
+    pendingを渡すと、キャンセルはwindow_refreshed_since(保留開始時刻)がTrueになるまで削除せず保留する
+    """
+    now = now or datetime.now()
+    stale = find_stale_ids(existing_rows, scraped_ids, crawled_dates, now)
+    if pending is not None:
+        # 再び取得できた予約・既に消えた予約は保留を解除
+        pending.discard([b for b in list(pending.ids) if b in scraped_ids or b not in existing_rows])
+        deferred = [
+            booking_id for booking_id, reason in stale.items()
+            if reason == CANCELLED and not window_refreshed_since(pending.since(booking_id, crawl_started_at))
+        ]
+        for booking_id in deferred:
+            del stale[booking_id]
+        if deferred:
+            print(f"[DELETE] 未取得の日に移動した可能性があるため保留: {len(deferred)}件", flush=True)
+    if not stale:
+        return []
+    print(f"[DELETE] 今回取得されなかった予約: {len(stale)}件", flush=True)
+    deleted = delete_bookings(session, supabase_url, list(stale))
+    if pending is not None:
+        pending.discard(stale)
+    for row in deleted:
+        row['reason'] = stale.get(row.get('booking_id'), CANCELLED)
+        print(f"[DELETE] 削除: {row.get('booking_id')}（{row['reason']}）", flush=True)
+    log_cancellations([row for row in deleted if row['reason'] == CANCELLED])
+    return deleted
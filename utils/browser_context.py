@@ -0,0 +1,119 @@
+"""
+不要なリソースをブロックするPlaywrightコンテキストの作成
+テーブルの文字しか読まないので、画像・フォント・CSS・解析スクリプトは読み込まない。
+ブロック対象はスクレイパーごとに指定でき、環境変数 BLOCK_RESOURCES_<名前> で上書きできる
+（例: BLOCK_RESOURCES_EXECUTE_CHANGE=image,font / none で無効）。
+"""
+import os
+import threading
+from collections import Counter
+
+DEFAULT_BLOCK_TYPES = ('image', 'font', 'stylesheet', 'media')
+# 画面表示に関わるCSSは残す（カレンダーの表示判定などis_visible()を使うページ用）
+NO_CSS_BLOCK_TYPES = ('image', 'font', 'media')
+
+ANALYTICS_HOSTS = (
+    'google-analytics.com',
+    'googletagmanager.com',
+    'doubleclick.net',
+    'nr-data.net',
+    'js-agent.newrelic.com',
+)
+
+# ブロックしたリクエスト1件あたりの推定サイズ（バイト）。実際には取得しないので推定値で集計する
+ESTIMATED_BYTES = {
+    'image': 15000,
+    'font': 40000,
+    'stylesheet': 20000,
+    'media': 100000,
+    'script': 40000,
+}
+
+
+def resolve_block_types(name, default=DEFAULT_BLOCK_TYPES):
+    """環境変数 BLOCK_RESOURCES_<NAME> があればそちらを優先"""
+    value = os.environ.get(f'BLOCK_RESOURCES_{name.upper()}')
+    if value is None:
+        return tuple(default)
+    if value.strip().lower() == 'none':
+        return ()
+    return tuple(t.strip() for t in value.split(',') if t.strip())
+
+
+class BlockStats:
+    """ブロックしたリクエスト数と推定削減バイト数"""
+
+    def __init__(self, name):
+        self.name = name
+        self.blocked = Counter()
+        self.allowed = 0
+        self._lock = threading.Lock()
+
+    def record(self, resource_type, blocked):
+        with self._lock:
+            if blocked:
+                self.blocked[resource_type] += 1
+            else:
+                self.allowed += 1
+
+    def summary(self):
+        estimated = sum(ESTIMATED_BYTES.get(t, 10000) * n for t, n in self.blocked.items())
+        return {
+            'blocked': sum(self.blocked.values()),
+            'allowed': self.allowed,
+            'by_type': dict(self.blocked),
+            'estimated_bytes_saved': estimated
+        }
+
+    def report(self):
+        s = self.summary()
+        detail = ', '.join(f'{t} {n}' for t, n in sorted(s['by_type'].items()))
+        print(f"[BLOCK] {self.name}: {s['blocked']}件ブロック（{detail or 'なし'}）/ 通過{s['allowed']}件 / "
+              f"推定{s['estimated_bytes_saved'] // 1024}KB削減", flush=True)
+        return s
+
+
+def _should_block(request, block_types, block_analytics):
+    if request.resource_type in block_types:
+        return True
+    if block_analytics and any(host in request.url for host in ANALYTICS_HOSTS):
+        return True
+    return False
+
+
+def new_blocking_context(browser, name, block_types=DEFAULT_BLOCK_TYPES, block_analytics=True, **options):
+    """リソースブロック付きのコンテキストを作成（sync_api用）。戻り値: (context, BlockStats)"""
+    block_types = set(resolve_block_types(name, block_types))
+    stats = BlockStats(name)
+    context = browser.new_context(**options)
+
+    def handle(route):
+        blocked = _should_block(route.request, block_types, block_analytics)
+        stats.record(route.request.resource_type, blocked)
+        if blocked:
+            route.abort()
+        else:
+            route.continue_()
+
+    if block_types or block_analytics:
+        context.route('**/*', handle)
+    return context, stats
+
+
+async def new_async_blocking_context(browser, name, block_types=DEFAULT_BLOCK_TYPES, block_analytics=True, **options):
+    """new_blocking_contextのasync_api版"""
+    block_types = set(resolve_block_types(name, block_types))
+    stats = BlockStats(name)
+    context = await browser.new_context(**options)
+
+    async def handle(route):
+        blocked = _should_block(route.request, block_types, block_analytics)
+        stats.record(route.request.resource_type, blocked)
+        if blocked:
+            await route.abort()
+        else:
+            await route.continue_()
+
+    if block_types or block_analytics:
+        await context.route('**/*', handle)
+    return context, stats
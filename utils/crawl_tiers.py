@@ -0,0 +1,145 @@
+"""
+日付の近さに応じたクロール間隔（ティア）
+直近の日は毎分、先の日ほど間隔を空けて取得する。6週間先の予約が分単位で変わることはほとんどないため。
+日付ごとの最終取得時刻をローカルに保存し、間隔を過ぎた日だけをクロール対象にする。
+
+環境変数 CRAWL_TIERS: "名前:開始日-終了日:間隔(分)" をカンマ区切り（日は今日=0からの日数）
+既定: hot:0-3:1,warm:4-14:10,cold:15-55:60
+"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+FRESHNESS_FILE = 'crawl_freshness.json'
+DEFAULT_CRAWL_TIERS = 'hot:0-3:1,warm:4-14:10,cold:15-55:60'
+# スケジューラーの起動時刻のずれで1周期飛ばさないよう、間隔からこの秒数を引いて判定する
+DUE_SLACK_SECONDS = 15
+
+
+def parse_tiers(spec):
+    """'hot:0-3:1,...' → [{'name', 'first_day', 'last_day', 'interval_minutes'}]（開始日順）"""
+    tiers = []
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            name, days, minutes = part.split(':')
+            first_day, last_day = (int(d) for d in days.split('-'))
+            minutes = int(minutes)
+        except ValueError:
+            raise ValueError(f'CRAWL_TIERSの形式が不正です: {part}')
+        if first_day < 0 or last_day < first_day or minutes < 1:
+            raise ValueError(f'CRAWL_TIERSの範囲が不正です: {part}')
+        tiers.append({'name': name.strip(), 'first_day': first_day, 'last_day': last_day, 'interval_minutes': minutes})
+    return sorted(tiers, key=lambda t: t['first_day'])
+
+
+CRAWL_TIERS = parse_tiers(os.environ.get('CRAWL_TIERS', DEFAULT_CRAWL_TIERS))
+
+
+def tier_for_offset(offset, tiers=CRAWL_TIERS):
+    """今日からの日数に対応するティア（どのティアにも入らなければNone = クロールしない）"""
+    for tier in tiers:
+        if tier['first_day'] <= offset <= tier['last_day']:
+            return tier
+    return None
+
+
+class CrawlFreshnessStore:
+    """日付(YYYYMMDD) → 最終取得時刻 をJSONファイルで管理"""
+
+    def __init__(self, path=FRESHNESS_FILE, tiers=CRAWL_TIERS):
+        self.path = path
+        self.tiers = tiers
+        self._lock = threading.Lock()
+        self.days = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.days = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[TIER] 読み込み失敗、全日取得します: {e}", flush=True)
+
+    def age_seconds(self, date_str, now=None):
+        """最終取得からの経過秒数（未取得はNone）"""
+        refreshed_at = self.days.get(date_str)
+        if not refreshed_at:
+            return None
+        try:
+            return ((now or datetime.now()) - datetime.fromisoformat(refreshed_at)).total_seconds()
+        except ValueError:
+            return None
+
+    def is_due(self, date_str, tier, now=None):
+        age = self.age_seconds(date_str, now)
+        return age is None or age >= tier['interval_minutes'] * 60 - DUE_SLACK_SECONDS
+
+    def due_offsets(self, today, crawl_days, now=None):
+        """今日からcrawl_days日のうち、ティアの間隔を過ぎた日の日数（今日=0）"""
+        due = []
+        for offset in range(crawl_days):
+            tier = tier_for_offset(offset, self.tiers)
+            if tier and self.is_due((today + timedelta(days=offset)).strftime('%Y%m%d'), tier, now):
+                due.append(offset)
+        return due
+
+    def refreshed_since(self, today, crawl_days, since):
+        """今日からcrawl_days日のうちティアに入る全日が、since以降に取得済みならTrue"""
+        for offset in range(crawl_days):
+            if tier_for_offset(offset, self.tiers) is None:
+                continue
+            refreshed_at = self.days.get((today + timedelta(days=offset)).strftime('%Y%m%d'))
+            try:
+                if not refreshed_at or datetime.fromisoformat(refreshed_at) < since:
+                    return False
+            except ValueError:
+                return False
+        return True
+
+    def mark(self, date_strs, now=None):
+        refreshed_at = (now or datetime.now()).isoformat()
+        with self._lock:
+            for date_str in date_strs:
+                self.days[date_str] = refreshed_at
+
+    def prune(self, oldest_date_str):
+        """oldest_date_strより前の日付を削除"""
+        with self._lock:
+            for date_str in [d for d in self.days if d < oldest_date_str]:
+                del self.days[date_str]
+
+    def save(self):
+        with self._lock:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.days, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def report(self, today, now=None):
+        """ティアごとの鮮度: 日数・間隔内の日数・期限切れ/未取得の日数・最も古い取得からの経過秒数"""
+        now = now or datetime.now()
+        report = []
+        for tier in self.tiers:
+            ages = []
+            stale = 0
+            for offset in range(tier['first_day'], tier['last_day'] + 1):
+                date_str = (today + timedelta(days=offset)).strftime('%Y%m%d')
+                age = self.age_seconds(date_str, now)
+                if age is None or age > tier['interval_minutes'] * 60 * 2:
+                    # 間隔の2倍を過ぎたら遅れとみなす（1周期分の実行時間は許容）
+                    stale += 1
+                if age is not None:
+                    ages.append(age)
+            days = tier['last_day'] - tier['first_day'] + 1
+            report.append({
+                **tier,
+                'days': days,
+                'fresh_days': days - stale,
+                'stale_days': stale,
+                'oldest_age_seconds': int(max(ages)) if ages else None,
+                'newest_age_seconds': int(min(ages)) if ages else None
+            })
+        return report
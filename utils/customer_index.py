@@ -0,0 +1,87 @@
+"""
+顧客名 → 電話番号のメモリ内インデックス
+customersテーブルを1回だけ読み込み、予約ごとのilike検索をローカル検索に置き換える。
+検索順: 完全一致 → 正規化（空白・記号除去）一致 → 部分一致
+"""
+import re
+
+PAGE_SIZE = 1000
+
+
+def normalize_customer_name(name):
+    """空白（半角・全角）、★などの記号、敬称「様」を除去"""
+    if not name:
+        return ''
+    name = re.sub(r'[\s　★☆♪♡⭐️🦁]', '', name)
+    return re.sub(r'様$', '', name).lower()
+
+
+class CustomerPhoneIndex:
+    """電話番号を持つ顧客だけを索引化し、ヒット・ミス件数を記録する"""
+
+    def __init__(self, customers):
+        self.exact = {}
+        self.normalized = {}
+        for c in customers:
+            name = (c.get('name') or '').strip()
+            phone = c.get('phone') or ''
+            if not name or not phone:
+                continue
+            self.exact.setdefault(name, phone)
+            self.normalized.setdefault(normalize_customer_name(name), phone)
+        self.stats = {'exact': 0, 'normalized': 0, 'substring': 0, 'miss': 0}
+
+    @classmethod
+    def load(cls, session, supabase_url):
+        """customersテーブルからページングして読み込む（sessionは認証ヘッダー付き）"""
+        customers = []
+        offset = 0
+        while True:
+            res = session.get(
+                f'{supabase_url}/rest/v1/customers?select=name,phone&phone=not.is.null'
+                f'&order=id.asc&limit={PAGE_SIZE}&offset={offset}',
+                timeout=30
+            )
+            res.raise_for_status()
+            page = res.json()
+            customers.extend(page)
+            if len(page) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+        index = cls(customers)
+        print(f"[PHONE] 顧客インデックス作成: {len(index.exact)}件", flush=True)
+        return index
+
+    def lookup(self, customer_name):
+        """電話番号を返す（見つからなければ空文字）"""
+        name = (customer_name or '').strip()
+        if not name:
+            self.stats['miss'] += 1
+            return ''
+
+        phone = self.exact.get(name)
+        if phone:
+            self.stats['exact'] += 1
+            return phone
+
+        key = normalize_customer_name(name)
+        phone = self.normalized.get(key)
+        if phone:
+            self.stats['normalized'] += 1
+            return phone
+
+        # 従来のilike.*name*と同じく「顧客名が予約名を含む」ものを探す
+        if key:
+            for customer_key, phone in self.normalized.items():
+                if key in customer_key:
+                    self.stats['substring'] += 1
+                    return phone
+
+        self.stats['miss'] += 1
+        return ''
+
+    def report(self):
+        s = self.stats
+        print(f"[PHONE] 完全一致{s['exact']} / 正規化一致{s['normalized']} / "
+              f"部分一致{s['substring']} / 該当なし{s['miss']}", flush=True)
+        return dict(s)
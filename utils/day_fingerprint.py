@@ -0,0 +1,76 @@
+"""
+日ごとの予約一覧のフィンガープリント（ハッシュ）をローカルに保存する
+前回と同じ内容の日は、解析・メニュー取得・保存・削除判定をまとめてスキップできる。
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import datetime
+
+FINGERPRINT_FILE = 'day_fingerprints.json'
+# この時間を過ぎたフィンガープリントは無視して再処理（DB側の手動変更などへの保険）
+FINGERPRINT_TTL_MINUTES = int(os.environ.get('FINGERPRINT_TTL_MINUTES', '60'))
+
+
+def compute_fingerprint(raw_rows):
+    """予約一覧の行データ（extract_reserve_rowsの形）を正規化してハッシュ化"""
+    normalized = [
+        [re.sub(r'\s+', ' ', str(row.get(key, ''))).strip()
+         for key in ('time_text', 'status_text', 'href', 'name_text', 'staff_text', 'source')]
+        for row in raw_rows
+    ]
+    payload = json.dumps(normalized, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class DayFingerprintStore:
+    """日付(YYYYMMDD) → {fingerprint, booking_ids, updated_at} をJSONファイルで管理"""
+
+    def __init__(self, path=FINGERPRINT_FILE, ttl_minutes=FINGERPRINT_TTL_MINUTES):
+        self.path = path
+        self.ttl_minutes = ttl_minutes
+        self._lock = threading.Lock()
+        self.days = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.days = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[FINGERPRINT] 読み込み失敗、全日処理します: {e}", flush=True)
+
+    def is_unchanged(self, date_str, fingerprint):
+        entry = self.days.get(date_str)
+        if not entry or entry.get('fingerprint') != fingerprint:
+            return False
+        try:
+            age = datetime.now() - datetime.fromisoformat(entry['updated_at'])
+        except (KeyError, ValueError):
+            return False
+        return age.total_seconds() < self.ttl_minutes * 60
+
+    def booking_ids(self, date_str):
+        return list(self.days.get(date_str, {}).get('booking_ids', []))
+
+    def update(self, date_str, fingerprint, booking_ids):
+        with self._lock:
+            self.days[date_str] = {
+                'fingerprint': fingerprint,
+                'booking_ids': list(booking_ids),
+                'updated_at': datetime.now().isoformat()
+            }
+
+    def prune(self, oldest_date_str):
+        """oldest_date_strより前の日付を削除"""
+        with self._lock:
+            for date_str in [d for d in self.days if d < oldest_date_str]:
+                del self.days[date_str]
+
+    def save(self):
+        with self._lock:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.days, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
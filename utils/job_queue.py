@@ -0,0 +1,397 @@
+"""
+SQLiteに保存するジョブキュー
+ジョブの種類（kind）ごとに処理関数・優先度・リトライ回数を登録し、ワーカースレッドで順に実行する。
+状態はファイルに残るので、再起動後も /jobs/<token> で結果を確認できる（tokenは推測できないランダム文字列）。
+実行中のジョブはheartbeat_atを定期的に更新し、JOB_LEASE_SECONDS秒更新が止まったジョブは落ちたとみなして戻す
+（コンテナ再起動後はPIDが再利用されるので、PIDの生存確認には頼らない）。
+
+優先度は小さいほど先に実行する。LIFFからの操作（PRIORITY_INTERACTIVE）はクロール待ちの後ろに並ばない。
+一括処理（PRIORITY_BULK以上）が同時に使うワーカーは workers - 1 までにして、常に1つは空けておく。
+複数プロセスで同じDBを共有でき、start(exclude=...) で除いた種別はenableしたプロセスだけが実行する。
+実行履歴（summary）と重複スキップの回数（record_skip）もDBに残すので、どのプロセスから見ても同じ値になる。
+"""
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import traceback
+from datetime import datetime
+
+JOB_QUEUE_DB = os.environ.get('JOB_QUEUE_DB', os.path.join('data', 'jobs.db'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+# 完了したジョブを残す日数
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', '7'))
+# 実行中のジョブのheartbeat_atを更新する間隔と、更新が止まってから中断とみなすまでの秒数
+JOB_HEARTBEAT_SECONDS = int(os.environ.get('JOB_HEARTBEAT_SECONDS', '30'))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '120'))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 50
+PRIORITY_BULK = 100
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    worker_pid INTEGER,
+    result TEXT,
+    error TEXT,
+    heartbeat_at REAL,
+    token TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority, run_after, id);
+CREATE TABLE IF NOT EXISTS job_skips (
+    kind TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    last_trigger TEXT,
+    last_at TEXT
+);
+'''
+
+# 古いDBに後から追加した列
+_MIGRATIONS = {
+    'heartbeat_at': 'ALTER TABLE jobs ADD COLUMN heartbeat_at REAL',
+    'token': 'ALTER TABLE jobs ADD COLUMN token TEXT'
+}
+
+
+class JobQueue:
+    """kindごとに register してから start でワーカーを起動する"""
+
+    def __init__(self, path=JOB_QUEUE_DB, workers=JOB_WORKERS):
+        self.path = path
+        self.workers = max(1, workers)
+        self.kinds = {}
+        # このプロセスのワーカーが取り出す種別（Noneなら全種別）
+        self.active_kinds = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._threads = []
+        # このプロセスで実行中のジョブID（heartbeatを更新する対象）
+        self._running = set()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+        columns = {row['name'] for row in self._db.execute('PRAGMA table_info(jobs)')}
+        for column, statement in _MIGRATIONS.items():
+            if column not in columns:
+                try:
+                    self._db.execute(statement)
+                except sqlite3.OperationalError:
+                    # 他のプロセスが先に追加した
+                    pass
+        self._db.execute('CREATE UNIQUE INDEX IF NOT EXISTS jobs_token ON jobs (token)')
+
+    def register(self, kind, handler, priority=PRIORITY_DEFAULT, max_attempts=3, backoff_seconds=30):
+        """handler(payload) の戻り値（JSONにできる値）を結果として保存。例外ならbackoff_seconds×2^(n-1)秒後に再実行"""
+        self.kinds[kind] = {
+            'handler': handler,
+            'priority': priority,
+            'max_attempts': max_attempts,
+            'backoff_seconds': backoff_seconds
+        }
+
+    def enqueue(self, kind, payload=None, priority=None, unique=False):
+        """ジョブを追加してIDを返す。unique=Trueなら同じkindが待機中・実行中のときは追加せずNone
+
+        外部に見せるのはIDではなくget(id)['token']（連番のIDは推測できるため）
+        """
+        if kind not in self.kinds:
+            raise ValueError(f'未登録のジョブ種別です: {kind}')
+        spec = self.kinds[kind]
+        with self._lock:
+            # 他のプロセスと同時に追加しても重複しないよう、確認と追加を1つのトランザクションで行う
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                if unique and self._db.execute(
+                    'SELECT 1 FROM jobs WHERE kind = ? AND status IN (?, ?) LIMIT 1', (kind, QUEUED, RUNNING)
+                ).fetchone():
+                    self._db.execute('COMMIT')
+                    return None
+                cursor = self._db.execute(
+                    'INSERT INTO jobs (kind, payload, priority, status, max_attempts, run_after, created_at, token) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (kind, json.dumps(payload or {}, ensure_ascii=False),
+                     spec['priority'] if priority is None else priority, QUEUED, spec['max_attempts'],
+                     time.time(), datetime.now().isoformat(), secrets.token_urlsafe(16))
+                )
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+            self._wakeup.notify_all()
+            return cursor.lastrowid
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def get_by_token(self, token):
+        with self._lock:
+            row = self._db.execute('SELECT * FROM jobs WHERE token = ?', (token,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def recent(self, limit=50, kind=None):
+        with self._lock:
+            if kind:
+                rows = self._db.execute('SELECT * FROM jobs WHERE kind = ? ORDER BY id DESC LIMIT ?', (kind, limit))
+            else:
+                rows = self._db.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,))
+            return [self._to_dict(row) for row in rows.fetchall()]
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute('SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status').fetchall()
+        counts = {}
+        for kind, status, count in rows:
+            counts.setdefault(kind, {})[status] = count
+        return counts
+
+    def record_skip(self, kind, trigger):
+        """unique指定のenqueueが待機中・実行中のジョブと重なって追加されなかった回数を記録"""
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO job_skips (kind, count, last_trigger, last_at) VALUES (?, 1, ?, ?) '
+                'ON CONFLICT(kind) DO UPDATE SET count = count + 1, last_trigger = excluded.last_trigger, '
+                'last_at = excluded.last_at',
+                (kind, trigger, datetime.now().isoformat())
+            )
+            skipped = self._db.execute('SELECT count FROM job_skips WHERE kind = ?', (kind,)).fetchone()[0]
+        print(f"[JOBQ] {kind}: 実行中のためスキップ（{trigger}、累計{skipped}回）", flush=True)
+
+    def summary(self, kind, limit=50):
+        """種別ごとの実行状況・状態別件数・所要時間・直近の履歴（保持期間内のジョブから集計）"""
+        with self._lock:
+            counts = dict(self._db.execute(
+                'SELECT status, COUNT(*) FROM jobs WHERE kind = ? GROUP BY status', (kind,)
+            ).fetchall())
+            skip = self._db.execute('SELECT count, last_trigger, last_at FROM job_skips WHERE kind = ?', (kind,)).fetchone()
+            rows = self._db.execute('SELECT * FROM jobs WHERE kind = ? ORDER BY id DESC LIMIT ?', (kind, limit)).fetchall()
+        history = []
+        durations = []
+        current = None
+        for row in rows:
+            job = self._to_dict(row)
+            duration = None
+            if job['started_at'] and job['finished_at']:
+                duration = (datetime.fromisoformat(job['finished_at']) - datetime.fromisoformat(job['started_at'])).total_seconds()
+                durations.append(duration)
+            entry = {
+                'id': job['id'],
+                'status': job['status'],
+                'trigger': job['payload'].get('trigger'),
+                'created_at': job['created_at'],
+                'started_at': job['started_at'],
+                'finished_at': job['finished_at'],
+                'duration_seconds': round(duration, 1) if duration is not None else None,
+                'result': job['result'],
+                'error': job['error']
+            }
+            if job['status'] == RUNNING and current is None:
+                current = entry
+            history.append(entry)
+        return {
+            'name': kind,
+            'running': counts.get(RUNNING, 0) > 0,
+            'current': current,
+            'stats': {
+                QUEUED: counts.get(QUEUED, 0),
+                RUNNING: counts.get(RUNNING, 0),
+                SUCCEEDED: counts.get(SUCCEEDED, 0),
+                FAILED: counts.get(FAILED, 0),
+                'skipped_overlap': skip[0] if skip else 0,
+                'last_skipped': {'trigger': skip[1], 'at': skip[2]} if skip else None
+            },
+            'duration_seconds': {
+                'last': round(durations[0], 1) if durations else None,
+                'avg': round(sum(durations) / len(durations), 1) if durations else None,
+                'max': round(max(durations), 1) if durations else None
+            },
+            'history': history
+        }
+
+    def wait(self, job_id, timeout):
+        """ジョブが終わるまで最大timeout秒待つ（終わらなければ最新の状態を返す）"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] in (SUCCEEDED, FAILED):
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            with self._lock:
+                self._wakeup.wait(min(remaining, 1))
+
+    def start(self, exclude=()):
+        """実行中のまま止まったジョブを戻し、古いジョブを削除してからワーカーを起動
+
+        exclude: このプロセスでは実行しない種別（リーダーだけが実行する処理など。enableで追加）
+        """
+        if exclude:
+            self.active_kinds = set(self.kinds) - set(exclude)
+        self._recover()
+        self._prune()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        print(f"[JOBQ] ワーカー{self.workers}個で開始（{self.path}）", flush=True)
+
+    def enable(self, kinds):
+        """startでexcludeした種別をこのプロセスでも実行する"""
+        with self._lock:
+            if self.active_kinds is not None:
+                self.active_kinds.update(kinds)
+            self._wakeup.notify_all()
+
+    def _heartbeat(self):
+        """このプロセスで実行中のジョブのheartbeat_atを更新し、更新の止まったジョブを戻す"""
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                with self._lock:
+                    running = list(self._running)
+                    if running:
+                        self._db.execute(
+                            f'UPDATE jobs SET heartbeat_at = ? WHERE status = ? AND id IN ({",".join("?" * len(running))})',
+                            (time.time(), RUNNING, *running)
+                        )
+                self._recover()
+            except Exception as e:
+                print(f"[JOBQ] heartbeatエラー: {e}", flush=True)
+
+    def _recover(self):
+        """heartbeat_atがJOB_LEASE_SECONDS秒以上更新されていない実行中ジョブを戻す"""
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                stuck = self._db.execute(
+                    'SELECT id, attempts, max_attempts FROM jobs WHERE status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)',
+                    (RUNNING, time.time() - JOB_LEASE_SECONDS)
+                ).fetchall()
+                for job_id, attempts, max_attempts in stuck:
+                    if job_id in self._running:
+                        continue
+                    if attempts >= max_attempts:
+                        # リトライしない種別（予約変更など）は途中まで実行された可能性があるので失敗にする
+                        self._db.execute('UPDATE jobs SET status = ?, worker_pid = NULL, finished_at = ?, error = ? WHERE id = ?',
+                                         (FAILED, datetime.now().isoformat(), '実行中にプロセスが終了しました', job_id))
+                        print(f"[JOBQ] 中断されたジョブ#{job_id}を失敗にしました", flush=True)
+                        continue
+                    self._db.execute('UPDATE jobs SET status = ?, worker_pid = NULL, run_after = ? WHERE id = ?',
+                                     (QUEUED, time.time(), job_id))
+                    print(f"[JOBQ] 中断されたジョブ#{job_id}を再実行待ちに戻しました", flush=True)
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def _prune(self):
+        cutoff = datetime.fromtimestamp(time.time() - JOB_RETENTION_DAYS * 86400).isoformat()
+        with self._lock:
+            self._db.execute('DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?', (SUCCEEDED, FAILED, cutoff))
+
+    def _claim(self):
+        """優先度順に次のジョブを取り出して実行中にする（なければNone）"""
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                bulk_running = self._db.execute(
+                    'SELECT COUNT(*) FROM jobs WHERE status = ? AND priority >= ?', (RUNNING, PRIORITY_BULK)
+                ).fetchone()[0]
+                max_priority = PRIORITY_BULK - 1 if self.workers > 1 and bulk_running >= self.workers - 1 else None
+                kinds = [k for k in self.kinds if self.active_kinds is None or k in self.active_kinds]
+                query = (f'SELECT * FROM jobs WHERE status = ? AND run_after <= ? '
+                         f'AND kind IN ({",".join("?" * len(kinds))})')
+                params = [QUEUED, time.time(), *kinds]
+                if max_priority is not None:
+                    query += ' AND priority <= ?'
+                    params.append(max_priority)
+                row = self._db.execute(query + ' ORDER BY priority, id LIMIT 1', params).fetchone()
+                if row:
+                    self._db.execute(
+                        'UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ?, worker_pid = ?, heartbeat_at = ? '
+                        'WHERE id = ?',
+                        (RUNNING, datetime.now().isoformat(), os.getpid(), time.time(), row['id'])
+                    )
+                    self._running.add(row['id'])
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+            return self._to_dict(row) if row else None
+
+    def _finish(self, job_id, **fields):
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        with self._lock:
+            self._db.execute(f'UPDATE jobs SET {columns} WHERE id = ?', (*fields.values(), job_id))
+            self._wakeup.notify_all()
+
+    def _worker(self):
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"[JOBQ] 取り出しエラー: {e}", flush=True)
+                job = None
+            if job is None:
+                with self._lock:
+                    self._wakeup.wait(1)
+                continue
+            try:
+                self._execute(job)
+            finally:
+                with self._lock:
+                    self._running.discard(job['id'])
+
+    def _execute(self, job):
+        spec = self.kinds[job['kind']]
+        attempt = job['attempts'] + 1
+        started = time.monotonic()
+        print(f"[JOBQ] #{job['id']} {job['kind']} 開始（{attempt}/{job['max_attempts']}回目）", flush=True)
+        try:
+            result = spec['handler'](job['payload'])
+        except Exception as e:
+            traceback.print_exc()
+            if attempt < job['max_attempts']:
+                delay = spec['backoff_seconds'] * 2 ** (attempt - 1)
+                self._finish(job['id'], status=QUEUED, run_after=time.time() + delay, error=str(e), worker_pid=None)
+                print(f"[JOBQ] #{job['id']} {job['kind']} 失敗、{delay}秒後に再実行: {e}", flush=True)
+            else:
+                self._finish(job['id'], status=FAILED, finished_at=datetime.now().isoformat(), error=str(e), worker_pid=None)
+                print(f"[JOBQ] #{job['id']} {job['kind']} 失敗（リトライ上限）: {e}", flush=True)
+            return
+        self._finish(job['id'], status=SUCCEEDED, finished_at=datetime.now().isoformat(), worker_pid=None,
+                     result=json.dumps(result, ensure_ascii=False, default=str))
+        print(f"[JOBQ] #{job['id']} {job['kind']} 完了（{time.monotonic() - started:.1f}秒）", flush=True)
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'] or '{}')
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
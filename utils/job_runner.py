@@ -0,0 +1,55 @@
+"""
+プロセス内の二重実行防止
+同じ関数が同時に2つ実行されないようにし、実行中に来た要求はスキップする。
+実行履歴・所要時間・スキップ回数はジョブキュー（utils/job_queue.py）のDBに残すので、ここでは持たない。
+"""
+import threading
+import time
+import traceback
+from datetime import datetime
+
+
+class JobRunner:
+    """func(**kwargs) を1つずつ実行する。戻り値がNoneなら中断（aborted）として記録"""
+
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+        self._run_lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._run_lock.locked()
+
+    def run(self, trigger='manual', **kwargs):
+        """呼び出し元のスレッドで実行して今回の実行記録を返す。実行中ならNone"""
+        if not self._run_lock.acquire(blocking=False):
+            print(f"[JOB] {self.name}: 実行中のためスキップ（{trigger}）", flush=True)
+            return None
+        job = {
+            'trigger': trigger,
+            'params': {k: v for k, v in kwargs.items() if v is not None},
+            'status': 'running',
+            'started_at': datetime.now().isoformat(),
+            'finished_at': None,
+            'duration_seconds': None,
+            'result': None,
+            'error': None
+        }
+        started = time.monotonic()
+        print(f"[JOB] {self.name} 開始（{trigger}）", flush=True)
+        try:
+            result = self.func(**kwargs)
+            job['result'] = result
+            job['status'] = 'success' if result is not None else 'aborted'
+        except Exception as e:
+            job['status'] = 'error'
+            job['error'] = str(e)
+            traceback.print_exc()
+        finally:
+            duration = time.monotonic() - started
+            job['duration_seconds'] = round(duration, 1)
+            job['finished_at'] = datetime.now().isoformat()
+            self._run_lock.release()
+            print(f"[JOB] {self.name} {job['status']}（{duration:.1f}秒）", flush=True)
+        return job
@@ -0,0 +1,69 @@
+"""
+複数プロセス（gunicornのワーカー）のうち1つだけをリーダーにするファイルロック
+fcntl.flockの排他ロックを取れたプロセスがリーダー。プロセスが終了するとOSがロックを解放するので、
+待機中のプロセスが定期的に取り直してリーダーを引き継ぐ。
+"""
+import fcntl
+import os
+import threading
+
+SCHEDULER_LOCK_FILE = os.environ.get('SCHEDULER_LOCK_FILE', os.path.join('data', 'scheduler.lock'))
+# リーダーでないプロセスがロックを取り直す間隔（秒）
+LEADER_RETRY_SECONDS = int(os.environ.get('LEADER_RETRY_SECONDS', '30'))
+
+
+class LeaderLock:
+    """try_acquireでロックを取り、取れたらプロセス終了まで保持する"""
+
+    def __init__(self, path=SCHEDULER_LOCK_FILE, retry_seconds=LEADER_RETRY_SECONDS):
+        self.path = path
+        self.retry_seconds = retry_seconds
+        self.is_leader = False
+        self._fd = None
+        self._stop = threading.Event()
+
+    def try_acquire(self):
+        if self.is_leader:
+            return True
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # 調査用にリーダーのPIDを書いておく（ロック自体はflockで判定）
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        self.is_leader = True
+        return True
+
+    def holder_pid(self):
+        """ロックファイルに書かれたリーダーのPID（不明ならNone）"""
+        try:
+            with open(self.path, 'r') as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def run(self, on_elected, name='scheduler'):
+        """リーダーになったらon_elected()を1回呼ぶ。なれなければretry_seconds秒ごとに取り直す"""
+        if self.try_acquire():
+            print(f"[LEADER] {name}: このプロセス（PID {os.getpid()}）がリーダー", flush=True)
+            on_elected()
+            return
+
+        def retry():
+            while not self._stop.wait(self.retry_seconds):
+                if self.try_acquire():
+                    print(f"[LEADER] {name}: リーダーを引き継ぎ（PID {os.getpid()}）", flush=True)
+                    on_elected()
+                    return
+
+        print(f"[LEADER] {name}: 他のプロセス（PID {self.holder_pid()}）がリーダー、待機", flush=True)
+        threading.Thread(target=retry, name=f'leader-{name}', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,242 @@
+"""
+LINEのpushメッセージ送信
+接続プール付きのセッションとワーカースレッドで並列に送り、トークンバケットで送信レートを抑える。
+429はRetry-Afterの秒数だけ全ワーカーの送信を止め、5xx・タイムアウトは指数バックオフで再送する。
+再送してもLINE側で二重に届かないよう、1通ごとのX-Line-Retry-Key（uuid）を付けて同じキーで送り直す。
+待機はワーカースレッド内で行うので、呼び出し側（Flaskのリクエスト処理など）はFutureを受け取ってすぐ戻れる。
+同じ文面を複数人に送るときはbroadcastでmulticast（1回500人まで）にまとめる。
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+LINE_PUSH_URL = 'https://api.line.me/v2/bot/message/push'
+LINE_MULTICAST_URL = 'https://api.line.me/v2/bot/message/multicast'
+# LINEのpush上限は2,000リクエスト/秒（チャネル単位）。他の送信元の分を残して既定は半分
+LINE_PUSH_RATE = float(os.environ.get('LINE_PUSH_RATE', '1000'))
+# multicastの上限は200リクエスト/秒、1リクエストの宛先は500人まで
+LINE_MULTICAST_RATE = float(os.environ.get('LINE_MULTICAST_RATE', '100'))
+# 上のレートはチャネル全体の値。gunicornのワーカーはそれぞれバケットを持つので、ワーカー数で等分する
+LINE_SENDER_PROCESSES = max(1, int(os.environ.get('WEB_CONCURRENCY', '2')))
+MULTICAST_MAX_RECIPIENTS = 500
+LINE_SENDER_WORKERS = int(os.environ.get('LINE_SENDER_WORKERS', '8'))
+MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """rate個/秒で補充され、最大capacity個までためられるトークン（スレッドセーフ）"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取る（なければ補充されるまで待つ）"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def _text_messages(message):
+    return message if isinstance(message, list) else [{'type': 'text', 'text': message}]
+
+
+def _valid_recipient(user_id):
+    return isinstance(user_id, str) and bool(user_id.strip())
+
+
+def _label(user_id):
+    return f"{str(user_id)[:8]}..."
+
+
+def _retry_after(response, default):
+    try:
+        return max(0.0, float(response.headers.get('Retry-After', default)))
+    except (TypeError, ValueError):
+        return default
+
+
+class LineSender:
+    """submitでFuture（結果は送信成否のbool）を返す。send_batchは全件の結果を待って返す
+
+    broadcastは同じ文面の宛先をmulticastにまとめ、Future（結果は {'sent': [...], 'failed': [...]}）を返す
+    """
+
+    def __init__(self, token, workers=LINE_SENDER_WORKERS, rate=LINE_PUSH_RATE, max_retries=MAX_RETRIES, dry_run=False):
+        self.token = token
+        self.max_retries = max_retries
+        self.dry_run = dry_run
+        self.bucket = TokenBucket(rate / LINE_SENDER_PROCESSES)
+        self.multicast_bucket = TokenBucket(LINE_MULTICAST_RATE / LINE_SENDER_PROCESSES)
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+        self.session.headers.update({'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'})
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='line-sender')
+        self.stats = {'sent': 0, 'failed': 0, 'retried': 0, 'rate_limited': 0, 'multicast_calls': 0}
+        # 429を受けたときに全ワーカーの送信を止める期限（time.monotonic）
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def submit(self, user_id, message):
+        """テキスト1通（またはメッセージオブジェクトのリスト）の送信を予約してFutureを返す
+
+        宛先が不正（Noneや空文字）なら送らずに結果Falseのfutureを返す
+        """
+        if not _valid_recipient(user_id):
+            print(f"[LINE] 宛先が不正なため送信しません: {user_id!r}", flush=True)
+            self._count('failed')
+            future = Future()
+            future.set_result(False)
+            return future
+        return self.executor.submit(self._send, {'to': user_id, 'messages': _text_messages(message)})
+
+    def send_batch(self, items):
+        """[(user_id, message), ...] を並列に送り、同じ順で送信成否のリストを返す"""
+        futures = [self.submit(user_id, message) for user_id, message in items]
+        return [future.result() for future in futures]
+
+    def broadcast(self, items):
+        """[(user_id, message), ...] を文面ごとにまとめて送る（宛先1人ならpush、複数ならmulticast）
+
+        宛先が不正（Noneや空文字）なものは送らずにfailedに入れる
+        """
+        groups = {}
+        invalid = []
+        for user_id, message in items:
+            if not _valid_recipient(user_id):
+                invalid.append(user_id)
+                continue
+            key = repr(message)
+            if key not in groups:
+                groups[key] = (message, [])
+            if user_id not in groups[key][1]:
+                groups[key][1].append(user_id)
+        if invalid:
+            print(f"[LINE] 宛先が不正なため送信しません: {len(invalid)}件", flush=True)
+        return self.executor.submit(self._broadcast, list(groups.values()), invalid)
+
+    def _broadcast(self, groups, invalid=()):
+        result = {'sent': [], 'failed': list(invalid)}
+        for message, user_ids in groups:
+            messages = _text_messages(message)
+            if len(user_ids) == 1:
+                ok = self._send({'to': user_ids[0], 'messages': messages})
+                result['sent' if ok else 'failed'].append(user_ids[0])
+                continue
+            for i in range(0, len(user_ids), MULTICAST_MAX_RECIPIENTS):
+                chunk = user_ids[i:i + MULTICAST_MAX_RECIPIENTS]
+                self._count('multicast_calls')
+                ok, status = self._request({'to': chunk, 'messages': messages}, LINE_MULTICAST_URL, self.multicast_bucket)
+                if ok:
+                    result['sent'].extend(chunk)
+                    continue
+                if status is None or status == 429 or status >= 500:
+                    # 届いたかどうか分からない失敗は個別に送り直さない（二重送信を避ける）
+                    result['failed'].extend(chunk)
+                    continue
+                # multicastは1人でも宛先が不正だと全体が失敗するので、1人ずつ送り直して失敗した宛先を特定
+                print(f"[LINE] multicast失敗（{status}）、{len(chunk)}人に個別送信", flush=True)
+                for user_id in chunk:
+                    ok = self._send({'to': user_id, 'messages': messages})
+                    result['sent' if ok else 'failed'].append(user_id)
+        if result['failed']:
+            print(f"[LINE] 送信失敗: {len(result['failed'])}人（{', '.join(str(u)[:8] for u in result['failed'])}）", flush=True)
+        return result
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _wait_pause(self):
+        while True:
+            with self._lock:
+                wait = self._paused_until - time.monotonic()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def _pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _send(self, data, url=LINE_PUSH_URL, bucket=None):
+        return self._request(data, url, bucket)[0]
+
+    def _request(self, data, url=LINE_PUSH_URL, bucket=None):
+        """1リクエスト分（pushまたはmulticast）を送信し、(成否, 最後のステータスコード) を返す
+
+        再送には同じX-Line-Retry-Keyを付ける。409は同じキーで受付済み（前回の送信が届いている）
+        """
+        to = _label(data['to']) if isinstance(data['to'], str) else f"{_label(data['to'][0])}他{len(data['to']) - 1}人"
+        if self.dry_run:
+            print(f"[テストモード] {to} → {str(data['messages'][0].get('text', ''))[:30]}...")
+            return True, None
+        if not self.token:
+            print("[エラー] LINE_BOT_TOKENが設定されていません")
+            return False, None
+
+        status = None
+        headers = {'X-Line-Retry-Key': str(uuid.uuid4())}
+        for attempt in range(self.max_retries):
+            self._wait_pause()
+            (bucket or self.bucket).acquire()
+            try:
+                response = self.session.post(url, json=data, headers=headers, timeout=10)
+            except requests.exceptions.RequestException as e:
+                print(f"[エラー] リクエスト失敗 (試行 {attempt + 1}/{self.max_retries}): {str(e)}")
+                status = None
+                delay = 2 ** attempt
+            else:
+                status = response.status_code
+                if response.status_code == 200 or (response.status_code == 409 and attempt > 0):
+                    if attempt > 0:
+                        print(f"[成功] {attempt + 1}回目の試行で送信成功")
+                    self._count('sent')
+                    return True, status
+                print(f"[警告] LINE API エラー: {response.status_code} - {response.text}")
+                if response.status_code == 429:
+                    # レート超過: Retry-After（なければ指数バックオフ）の間は全ワーカーを止める
+                    self._count('rate_limited')
+                    delay = _retry_after(response, 2 ** attempt)
+                    self._pause(delay)
+                elif response.status_code >= 500:
+                    delay = _retry_after(response, 2 ** attempt)
+                else:
+                    # 400・403など（宛先不正・ブロック）は再送しても成功しない
+                    break
+            if attempt < self.max_retries - 1:
+                self._count('retried')
+                time.sleep(delay)
+
+        print(f"[失敗] {to} への送信失敗")
+        self._count('failed')
+        return False, status
+
+
+_senders = {}
+_senders_lock = threading.Lock()
+
+
+def get_line_sender(token):
+    """トークン（チャネル）ごとに1つのLineSenderを共有する"""
+    dry_run = os.getenv("TEST_MODE", "false").lower() == "true"
+    with _senders_lock:
+        key = (token, dry_run)
+        if key not in _senders:
+            _senders[key] = LineSender(token, dry_run=dry_run)
+        return _senders[key]
@@ -0,0 +1,112 @@
+"""
+ページ内スクリプト（page.evaluate）による一括抽出
+セル・要素ごとのquery_selector/text_content呼び出しはそれぞれブラウザとの往復になるため、
+テーブル全体を1回のevaluateでJSONにして受け取る。
+戻り値はutils/salonboard_parser.pyと同じ形なので、後段の処理はそのまま使える。
+"""
+
+# 予約一覧（th#comingDateのテーブル）→ 行ごとのテキスト。テーブルがなければnull
+RESERVE_ROWS_JS = """
+() => {
+    const header = document.querySelector('table th#comingDate');
+    if (!header) return null;
+    const table = header.closest('table');
+    const text = el => (el ? el.textContent : '').trim();
+    const rows = [];
+    for (const tr of table.querySelectorAll('tbody tr')) {
+        const cells = Array.from(tr.children).filter(el => el.tagName === 'TD');
+        if (cells.length < 4) continue;
+        const link = cells[2].querySelector("a[href*='reserveId=']");
+        rows.push({
+            time_text: text(cells[0]),
+            status_text: text(cells[1]),
+            href: link ? (link.getAttribute('href') || '') : '',
+            name_text: text(cells[2].querySelector('p.wordBreak')),
+            staff_text: text(cells[3]),
+            source: cells.length > 4 ? text(cells[4]) : ''
+        });
+    }
+    return rows;
+}
+"""
+
+# スタッフ選択肢（#stockNameList option の STAFF_<id>_<日付>）
+STAFF_OPTIONS_JS = """
+() => Array.from(document.querySelectorAll('#stockNameList option'))
+    .filter(opt => (opt.getAttribute('value') || '').startsWith('STAFF_'))
+    .map(opt => ({id: opt.getAttribute('value').split('_')[1], name: opt.innerText.trim()}))
+"""
+
+# スケジュールのタイムライン（スタッフ行ごとの受付開始時刻・予約時間帯・予約ブロック・休日）
+SCHEDULE_JS = """
+(lineSelector) => {
+    const lines = document.querySelectorAll(lineSelector);
+    if (!lines.length) return null;
+    const staffList = (%s)();
+    const rows = Array.from(lines).map(line => {
+        const timeElem = line.querySelector('.scheduleTime');
+        const timeZones = [];
+        for (const res of line.querySelectorAll('.scheduleReservation, .scheduleToDo')) {
+            const zone = res.querySelector('.scheduleTimeZoneSetting');
+            if (zone) timeZones.push(zone.textContent.trim());
+        }
+        const reservations = Array.from(line.querySelectorAll('.scheduleReservation')).map(res => {
+            const name = res.querySelector('.scheduleReserveName');
+            const zone = res.querySelector('.scheduleTimeZoneSetting');
+            return {
+                name: name ? (name.getAttribute('title') || name.textContent).trim() : '',
+                named: res.querySelector('.scheduleReserveIcon.named') !== null,
+                time_zone: zone ? zone.textContent.trim() : ''
+            };
+        });
+        return {
+            first_time: timeElem ? timeElem.innerText.trim() : '',
+            time_zones: timeZones,
+            reservations: reservations,
+            is_day_off: line.querySelector('.isDayOff') !== null
+        };
+    });
+    return {staff_list: staffList, rows: rows};
+}
+""" % STAFF_OPTIONS_JS.strip()
+
+# 任意の行セレクタ → 行ごとのセルテキストの配列（'table tbody tr' の全セルを読む旧スクレイパー用）
+TABLE_CELLS_JS = """
+(rowSelector) => Array.from(document.querySelectorAll(rowSelector)).map(
+    tr => Array.from(tr.querySelectorAll('td')).map(td => td.textContent.trim())
+)
+"""
+
+# スクレイパーが使うスタッフ行（LIFFの空き枠APIは従来の '.scheduleMainTableLine.jscScheduleMainTableLine'）
+SCHEDULE_LINE_SELECTOR = '.jscScheduleMainTableStaff .scheduleMainTableLine'
+
+
+def evaluate_reserve_rows(page):
+    """予約一覧の行を1回のevaluateで取得（sync_api用、テーブルがなければNone）"""
+    return page.evaluate(RESERVE_ROWS_JS)
+
+
+def evaluate_staff_options(page):
+    return page.evaluate(STAFF_OPTIONS_JS)
+
+
+def evaluate_schedule(page, line_selector=SCHEDULE_LINE_SELECTOR):
+    """スケジュールのスタッフ一覧と各行を1回のevaluateで取得（行がなければNone）"""
+    return page.evaluate(SCHEDULE_JS, line_selector)
+
+
+def evaluate_table_cells(page, row_selector='table tbody tr'):
+    """行ごとのセルテキスト（strip済み）を1回のevaluateで取得"""
+    return page.evaluate(TABLE_CELLS_JS, row_selector)
+
+
+async def async_evaluate_reserve_rows(page):
+    return await page.evaluate(RESERVE_ROWS_JS)
+
+
+async def async_evaluate_staff_options(page):
+    return await page.evaluate(STAFF_OPTIONS_JS)
+
+
+async def async_evaluate_schedule(page, line_selector=SCHEDULE_LINE_SELECTOR):
+    return await page.evaluate(SCHEDULE_JS, line_selector)
@@ -0,0 +1,70 @@
+"""
+ページ読み込み待機ヘルパー
+page.goto後の固定wait_for_timeoutの代わりに、ページごとに必要な要素の出現を待つ。
+従来の固定待機時間を上限（フォールバック）として使い、実際に待った時間を記録する。
+"""
+import time
+
+# ページ種別ごとの待機セレクタ（ログイン画面に飛ばされた場合もすぐ抜ける）
+LOGIN_READY = 'input[name="userId"]'
+RESERVE_LIST_READY = f'th#comingDate, {LOGIN_READY}'
+SCHEDULE_READY = f'.scheduleMainTableLine, {LOGIN_READY}'
+SCHEDULE_RESERVATIONS_READY = '.scheduleTimeZoneSetting'
+RESERVE_DETAIL_READY = f'th, {LOGIN_READY}'
+RESERVE_CHANGE_READY = f'input[name="rsvDate"], {LOGIN_READY}'
+
+
+class ReadyWaiter:
+    """セレクタ待機を実行し、実測時間と固定待機からの短縮時間を集計する"""
+
+    def __init__(self, name):
+        self.name = name
+        self.records = []
+
+    def _record(self, label, selector, started, budget_ms, ready):
+        waited_ms = int((time.monotonic() - started) * 1000)
+        self.records.append({
+            'label': label or selector,
+            'waited_ms': waited_ms,
+            'budget_ms': budget_ms,
+            'ready': ready
+        })
+        return ready
+
+    def wait(self, page, selector, budget_ms, label=None):
+        """selectorが現れるまで待つ（最大budget_ms、従来の固定待機時間を指定）"""
+        started = time.monotonic()
+        try:
+            page.wait_for_selector(selector, state='attached', timeout=budget_ms)
+            ready = True
+        except Exception:
+            ready = False
+        return self._record(label, selector, started, budget_ms, ready)
+
+    async def async_wait(self, page, selector, budget_ms, label=None):
+        """wait()のasync_api版"""
+        started = time.monotonic()
+        try:
+            await page.wait_for_selector(selector, state='attached', timeout=budget_ms)
+            ready = True
+        except Exception:
+            ready = False
+        return self._record(label, selector, started, budget_ms, ready)
+
+    def summary(self):
+        """待機回数・実測合計・固定待機合計・短縮時間・タイムアウト回数"""
+        waited = sum(r['waited_ms'] for r in self.records)
+        budget = sum(r['budget_ms'] for r in self.records)
+        return {
+            'waits': len(self.records),
+            'waited_ms': waited,
+            'fixed_ms': budget,
+            'saved_ms': max(budget - waited, 0),
+            'timeouts': sum(1 for r in self.records if not r['ready'])
+        }
+
+    def report(self):
+        s = self.summary()
+        print(f"[READY] {self.name}: 待機{s['waits']}回 実測{s['waited_ms']}ms / "
+              f"固定{s['fixed_ms']}ms（{s['saved_ms']}ms短縮、タイムアウト{s['timeouts']}回）", flush=True)
+        return s
@@ -0,0 +1,92 @@
+"""
+ブラウザを使わずにSalonBoardのページを取得するHTTPクライアント
+session_cookies.jsonのクッキーを使い、requests.Sessionでコネクションを使い回す。
+ログイン切れの場合はLoginRequiredを送出し、呼び出し側でPlaywrightにフォールバックする。
+"""
+import json
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BASE_URL = 'https://salonboard.com'
+COOKIE_FILE = 'session_cookies.json'
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
+
+
+class LoginRequired(Exception):
+    """セッション切れでログインページに飛ばされた"""
+
+
+class SalonBoardHttpClient:
+    """reserveList・予約詳細などをrequestsで取得する（スレッドセーフ）
+
+    salonScheduleはJSで描画されるのでHTTPでは取得できない（ブラウザで取得する）
+    """
+
+    def __init__(self, cookie_file=COOKIE_FILE, pool_size=4, timeout=30):
+        self.cookie_file = cookie_file
+        self.timeout = timeout
+        self.stats = {'requests': 0, 'bytes': 0, 'login_required': 0, 'errors': 0}
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504],
+                              allowed_methods=['GET'])
+        )
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'User-Agent': USER_AGENT,
+            'Accept-Language': 'ja-JP,ja;q=0.9',
+            'Connection': 'keep-alive'
+        })
+        self.cookie_count = self.load_cookies()
+
+    def load_cookies(self):
+        """クッキーファイルを読み込み直す（Playwrightで再ログインした後など）"""
+        try:
+            with open(self.cookie_file, 'r') as f:
+                cookies = json.load(f)
+        except Exception as e:
+            print(f"[HTTP] クッキー読み込み失敗: {e}", flush=True)
+            return 0
+        self.session.cookies.clear()
+        for c in cookies:
+            self.session.cookies.set(
+                c['name'], c['value'],
+                domain=c.get('domain', 'salonboard.com'),
+                path=c.get('path', '/')
+            )
+        return len(cookies)
+
+    def get_page(self, path):
+        """pathのHTMLを返す（ログイン切れはLoginRequired、通信エラーはrequestsの例外）"""
+        url = path if path.startswith('http') else f'{BASE_URL}{path}'
+        try:
+            res = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException:
+            self._count('errors')
+            raise
+        self._count('requests', bytes_=len(res.content))
+
+        if 'login' in res.url.lower() or 'name="userId"' in res.text:
+            self._count('login_required')
+            raise LoginRequired(url)
+        res.raise_for_status()
+        return res.text
+
+    def fetch_reserve_list(self, date_str):
+        """予約一覧（date_str: YYYYMMDD）"""
+        return self.get_page(f'/KLP/reserve/reserveList/searchDate?date={date_str}')
+
+    def _count(self, key, bytes_=0):
+        with self._lock:
+            self.stats[key] += 1
+            self.stats['bytes'] += bytes_
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,172 @@
+"""
+SalonBoardのHTMLをBeautifulSoupで解析する（ブラウザ不要）
+Playwright版と同じ形のデータを返すので、後段の処理はどちらの取得経路でも共通。
+対応ページ: 予約一覧・予約詳細（メニュー）・スケジュール（全体 / スタッフ1行）・予約変更
+lxmlがあればlxmlで解析する（環境変数 SALONBOARD_PARSER=html.parser で標準パーサーに固定）。
+"""
+import os
+import re
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml  # noqa: F401
+    _DEFAULT_BACKEND = 'lxml'
+except ImportError:
+    _DEFAULT_BACKEND = 'html.parser'
+
+PARSER_BACKEND = os.environ.get('SALONBOARD_PARSER', _DEFAULT_BACKEND)
+
+
+def _soup(html):
+    return BeautifulSoup(html, PARSER_BACKEND)
+
+
+def extract_reserve_rows(html):
+    """予約一覧テーブルの各行をテキストで返す（th#comingDateのテーブルがなければNone）"""
+    soup = _soup(html)
+    header = soup.select_one('table th#comingDate')
+    if not header:
+        return None
+    table = header.find_parent('table')
+
+    rows = []
+    for tr in table.select('tbody tr'):
+        cells = tr.find_all('td', recursive=False)
+        if len(cells) < 4:
+            continue
+        link = cells[2].select_one("a[href*='reserveId=']")
+        name_elem = cells[2].select_one('p.wordBreak')
+        rows.append({
+            'time_text': cells[0].get_text().strip(),
+            'status_text': cells[1].get_text().strip(),
+            'href': link.get('href', '') if link else '',
+            'name_text': name_elem.get_text().strip() if name_elem else '',
+            'staff_text': cells[3].get_text().strip(),
+            'source': cells[4].get_text().strip() if len(cells) > 4 else ''
+        })
+    return rows
+
+
+def extract_menu(html):
+    """予約詳細ページのメニュー欄（見つからなければ空文字）"""
+    soup = _soup(html)
+    for th in soup.find_all('th'):
+        if 'メニュー' in th.get_text():
+            td = th.find_next_sibling('td')
+            if td:
+                return td.get_text('\n', strip=True)[:100]
+    for td in soup.find_all('td'):
+        if '【' in td.get_text():
+            return td.get_text('\n', strip=True)[:100]
+    return ''
+
+
+def extract_staff_options(html):
+    """スタッフ選択肢（#stockNameList option の STAFF_<id>_<日付>）"""
+    return _staff_options(_soup(html))
+
+
+def _staff_options(soup):
+    staff_list = []
+    for opt in soup.select('#stockNameList option'):
+        value = opt.get('value') or ''
+        if value.startswith('STAFF_'):
+            staff_list.append({'id': value.split('_')[1], 'name': opt.get_text().strip()})
+    return staff_list
+
+
+def extract_schedule(html):
+    """スケジュールページのスタッフ一覧と各スタッフ行（.scheduleMainTableLineがなければNone）
+
+    JS描画前のページ（salonboard_schedule.html等）は行がないのでNone
+    """
+    soup = _soup(html)
+    lines = soup.select('.jscScheduleMainTableStaff .scheduleMainTableLine')
+    if not lines:
+        return None
+    return {'staff_list': _staff_options(soup), 'rows': [_schedule_line(line) for line in lines]}
+
+
+def extract_schedule_line(html):
+    """スタッフ1行分のHTML断片（nakabayashi_row.html等）→ extract_scheduleの行と同じ形"""
+    return _schedule_line(_soup(html))
+
+
+def _schedule_line(line):
+    time_elem = line.select_one('.scheduleTime')
+    booked = []
+    for res in line.select('.scheduleReservation, .scheduleToDo'):
+        zone = res.select_one('.scheduleTimeZoneSetting')
+        if zone:
+            booked.append(zone.get_text().strip())
+    return {
+        'first_time': time_elem.get_text().strip() if time_elem else '',
+        'time_zones': booked,
+        'reservations': [_schedule_reservation(res) for res in line.select('.scheduleReservation')],
+        'is_day_off': line.select_one('.isDayOff') is not None
+    }
+
+
+def _schedule_reservation(res):
+    """予約ブロック1つ分（お客様名・指名の有無・時間帯）。IDや予約経路はスケジュールには表示されない"""
+    name = res.select_one('.scheduleReserveName')
+    zone = res.select_one('.scheduleTimeZoneSetting')
+    return {
+        'name': ((name.get('title') or name.get_text()) if name else '').strip(),
+        'named': res.select_one('.scheduleReserveIcon.named') is not None,
+        'time_zone': zone.get_text().strip() if zone else ''
+    }
+
+
+def _selected(soup, name):
+    """select[name]の選択中の (value, 表示名)（選択がなければ先頭、selectがなければ ('', '')）"""
+    select = soup.select_one(f'select[name="{name}"]')
+    if not select:
+        return '', ''
+    opt = select.select_one('option[selected]') or select.select_one('option')
+    if not opt:
+        return '', ''
+    return opt.get('value') or '', opt.get_text().strip()
+
+
+def _th_value(soup, label):
+    for th in soup.find_all('th'):
+        if th.get_text(strip=True) == label:
+            td = th.find_next_sibling('td')
+            return td.get_text(' ', strip=True) if td else ''
+    return ''
+
+
+def extract_reserve_change(html):
+    """予約変更ページ（extReserveChange）の現在値。フォームがなければNone
+
+    execute-changeが読むrsvDate・rsvHour・rsvMinuteに加え、所要時間・予約経路・担当スタッフを返す
+    """
+    soup = _soup(html)
+    date_input = soup.select_one('input[name="rsvDate"]')
+    if not date_input:
+        return None
+    hour, _ = _selected(soup, 'rsvHour')
+    minute, _ = _selected(soup, 'rsvMinute')
+    term_hour, _ = _selected(soup, 'rsvTermHour')
+    term_minute, _ = _selected(soup, 'rsvTermMinute')
+    route_id, route_name = _selected(soup, 'rsvRouteId')
+    staff_id, staff_name = _selected(soup, 'staffIdList')
+    try:
+        # rsvTermHourの値は分（60 = 1時間）
+        duration = int(term_hour or 0) + int(term_minute or 0)
+    except ValueError:
+        duration = None
+    return {
+        'reserve_id': _th_value(soup, '予約番号'),
+        'status': _th_value(soup, 'ステータス'),
+        'rsv_date': date_input.get('value') or '',
+        'time': f'{hour}:{minute}' if hour and minute else '',
+        'duration_minutes': duration,
+        'route_id': route_id,
+        'route_name': route_name,
+        'staff_id': staff_id,
+        'staff_name': re.sub(r'\s+', ' ', staff_name),
+        'has_confirm_button': any('確定する' in el.get_text() for el in soup.select('button, a'))
+    }
@@ -0,0 +1,67 @@
+"""
+スケジュールページの予約ブロックと既存予約の照合
+スケジュールには予約ID・ステータス・予約経路が出ないため、予約一覧の代わりにはならない。
+ただし「その日の予約ブロックが既存の予約（お客様名・開始時刻・指名スタッフ）と過不足なく一致する」なら
+予約一覧に変更はないと判断でき、予約一覧ページの読み込みを省略できる。
+1件でも一致しなければNoneを返し、従来通り予約一覧で取得する。
+"""
+import re
+
+from utils.customer_index import normalize_customer_name
+
+_DATETIME_RE = re.compile(r'(\d{4})-(\d{2})-(\d{2})[ T](\d{1,2}):(\d{2})')
+_TIME_RE = re.compile(r'(\d{1,2}):(\d{2})')
+
+
+def _booking_key(name, minutes):
+    return normalize_customer_name(name), minutes
+
+
+def _visit_key(visit_datetime):
+    """'YYYY-MM-DD HH:MM:SS' → ('YYYYMMDD', 0:00からの分)"""
+    match = _DATETIME_RE.search(visit_datetime or '')
+    if not match:
+        return None, None
+    year, month, day, hour, minute = match.groups()
+    return f'{year}{month}{day}', int(hour) * 60 + int(minute)
+
+
+def schedule_blocks(schedule):
+    """スケジュールの予約ブロックを (お客様名, 開始分, 指名スタッフ名) で列挙"""
+    for staff_info, row in zip(schedule['staff_list'], schedule['rows']):
+        for res in row.get('reservations') or []:
+            match = _TIME_RE.search(res.get('time_zone') or '')
+            minutes = int(match.group(1)) * 60 + int(match.group(2)) if match else None
+            yield res.get('name') or '', minutes, staff_info['name'] if res.get('named') else ''
+
+
+def match_known_bookings(schedule, date_str, existing_rows):
+    """予約ブロックが既存予約と過不足なく一致すれば、その日の予約IDのリストを返す（不一致はNone）
+
+    existing_rows: booking_id → 既存行（customer_name, visit_datetime, staff）
+    """
+    if not schedule or any('reservations' not in row for row in schedule['rows']):
+        return None
+
+    known = {}
+    for booking_id, row in existing_rows.items():
+        day, minutes = _visit_key(row.get('visit_datetime'))
+        if day == date_str:
+            known.setdefault(_booking_key(row.get('customer_name'), minutes), []).append((booking_id, row))
+
+    matched = []
+    for name, minutes, staff in schedule_blocks(schedule):
+        if not name or minutes is None:
+            return None
+        candidates = known.get(_booking_key(name, minutes))
+        if not candidates:
+            return None
+        booking_id, row = candidates.pop()
+        if normalize_customer_name(row.get('staff')) != normalize_customer_name(staff):
+            return None
+        matched.append(booking_id)
+
+    # スケジュールから消えた既存予約がある（キャンセル・移動）
+    if any(known.values()):
+        return None
+    return matched
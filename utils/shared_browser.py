@@ -0,0 +1,143 @@
+"""
+常駐ブラウザサービス（browser_service.py）への接続
+サービスが動いていればCDPで既存のChromiumに接続し、動いていなければ従来通りその場で起動する。
+接続中は別スレッドで貸し出しの期限を延長する（プロセスが落ちれば延長が止まり、サービス側で期限切れになる）。
+BROWSER_SERVICE=0 で無効化（常にその場で起動）。
+
+常駐ブラウザにはbrowser.close()を呼ばない。接続元のcloseは切断だけの仕様だが、
+将来のPlaywrightで挙動が変わっても共有のChromiumを止めないよう、自分で作ったコンテキストだけを閉じて接続を離す。
+接続（CDPのWebSocket）は呼び出し側のPlaywrightドライバーが終了したときに切れる。Chromiumのプロセスは
+サービス側のドライバーが起動したものなので、こちらのドライバーが終了しても止まらない。
+"""
+import os
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+import requests
+
+BROWSER_SERVICE_URL = os.environ.get('BROWSER_SERVICE_URL', 'http://127.0.0.1:9300')
+BROWSER_SERVICE_ENABLED = os.environ.get('BROWSER_SERVICE', '1') != '0'
+LEASE_TIMEOUT = 2
+
+DEFAULT_LAUNCH_ARGS = ['--disable-blink-features=AutomationControlled']
+
+
+def lease_browser():
+    """サービスからCDP接続先を借りる（使えなければNone）"""
+    if not BROWSER_SERVICE_ENABLED:
+        return None
+    try:
+        res = requests.post(f'{BROWSER_SERVICE_URL}/lease', timeout=LEASE_TIMEOUT)
+        if res.status_code == 200:
+            return res.json()
+        print(f"[BROWSER] 常駐ブラウザ利用不可（{res.status_code}）、ローカル起動", flush=True)
+    except requests.RequestException:
+        pass
+    return None
+
+
+def release_browser(lease):
+    try:
+        requests.post(f'{BROWSER_SERVICE_URL}/release', json={'lease_id': lease.get('lease_id')}, timeout=LEASE_TIMEOUT)
+    except requests.RequestException as e:
+        print(f"[BROWSER] 返却エラー: {e}", flush=True)
+
+
+def keep_lease_alive(lease):
+    """返却するまで期限の1/3ごとに延長するスレッドを起動し、止めるためのEventを返す"""
+    stop = threading.Event()
+    interval = max(1, lease.get('ttl', 60) / 3)
+
+    def renew():
+        while not stop.wait(interval):
+            try:
+                res = requests.post(f'{BROWSER_SERVICE_URL}/renew', json={'lease_id': lease.get('lease_id')},
+                                    timeout=LEASE_TIMEOUT)
+                if res.status_code != 200:
+                    print(f"[BROWSER] 貸し出しの延長失敗（{res.status_code}）", flush=True)
+            except requests.RequestException as e:
+                print(f"[BROWSER] 貸し出しの延長エラー: {e}", flush=True)
+
+    threading.Thread(target=renew, name='browser-lease', daemon=True).start()
+    return stop
+
+
+def service_status():
+    """サービスの状態（管理画面用、停止中はNone）"""
+    try:
+        res = requests.get(f'{BROWSER_SERVICE_URL}/status', timeout=LEASE_TIMEOUT)
+        if res.status_code == 200:
+            return res.json()
+    except requests.RequestException:
+        pass
+    return None
+
+
+@contextmanager
+def shared_browser(p, name, headless=True, args=DEFAULT_LAUNCH_ARGS):
+    """常駐ブラウザに接続（sync_api用）。呼び出し側は自分でコンテキストを作って使う"""
+    lease = lease_browser()
+    browser = None
+    if lease:
+        try:
+            browser = p.chromium.connect_over_cdp(lease['cdp_endpoint'])
+            print(f"[BROWSER] {name}: 常駐ブラウザに接続（世代{lease['generation']}）", flush=True)
+        except Exception as e:
+            print(f"[BROWSER] {name}: 常駐ブラウザ接続失敗、ローカル起動: {e}", flush=True)
+            release_browser(lease)
+            lease = None
+    if browser is None:
+        browser = p.chromium.launch(headless=headless, args=list(args))
+    own_contexts = set(browser.contexts)
+    stop_renew = keep_lease_alive(lease) if lease else None
+
+    try:
+        yield browser
+    finally:
+        try:
+            if lease:
+                # 常駐ブラウザ: 自分で作ったコンテキストだけ閉じる（browser.close()は呼ばない）
+                for context in [c for c in browser.contexts if c not in own_contexts]:
+                    context.close()
+            else:
+                browser.close()
+        except Exception:
+            pass
+        if lease:
+            stop_renew.set()
+            release_browser(lease)
+
+
+@asynccontextmanager
+async def async_shared_browser(p, name, headless=True, args=DEFAULT_LAUNCH_ARGS):
+    """shared_browserのasync_api版"""
+    lease = lease_browser()
+    browser = None
+    if lease:
+        try:
+            browser = await p.chromium.connect_over_cdp(lease['cdp_endpoint'])
+            print(f"[BROWSER] {name}: 常駐ブラウザに接続（世代{lease['generation']}）", flush=True)
+        except Exception as e:
+            print(f"[BROWSER] {name}: 常駐ブラウザ接続失敗、ローカル起動: {e}", flush=True)
+            release_browser(lease)
+            lease = None
+    if browser is None:
+        browser = await p.chromium.launch(headless=headless, args=list(args))
+    own_contexts = set(browser.contexts)
+    stop_renew = keep_lease_alive(lease) if lease else None
+
+    try:
+        yield browser
+    finally:
+        try:
+            if lease:
+                # 常駐ブラウザ: 自分で作ったコンテキストだけ閉じる（browser.close()は呼ばない）
+                for context in [c for c in browser.contexts if c not in own_contexts]:
+                    await context.close()
+            else:
+                await browser.close()
+        except Exception:
+            pass
+        if lease:
+            stop_renew.set()
+            release_browser(lease)
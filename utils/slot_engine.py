@@ -0,0 +1,202 @@
+"""
+空き枠計算エンジン（LIFFの空き枠APIと8週間クロールで共通）
+スタッフの1日を1分1ビットの整数ビットマップ（ビットi = 0:00からi分後、1 = 空き）で表し、
+予約の除外・営業時間での切り取り・10分単位への丸めをビット演算でまとめて行う。
+丸めは従来と同じく「開始は切り上げ・終了は切り捨て」（= 丸ごと空いている10分枠だけを残す）。
+
+営業時間は環境変数で変更できる:
+  SLOT_OPEN_TIME（受付開始が取れないときの開始、既定 9:00）
+  SLOT_CLOSE_TIME（閉店、既定 19:00）
+  SLOT_ROUNDING_MINUTES（丸め単位、既定 10）
+"""
+import os
+import re
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_minutes(text):
+    """'H:MM' → 0:00からの分（解釈できなければNone）"""
+    try:
+        hour, minute = str(text).strip().split(':')[:2]
+        return int(hour) * 60 + int(minute)
+    except (ValueError, AttributeError):
+        return None
+
+
+_MINUTE_LABELS = [f"{m // 60}:{m % 60:02d}" for m in range(MINUTES_PER_DAY + 1)]
+_TIME_RE = re.compile(r'(\d{1,2}):(\d{2})')
+
+
+def format_minutes(minutes):
+    return _MINUTE_LABELS[minutes]
+
+
+DEFAULT_OPEN = parse_minutes(os.environ.get('SLOT_OPEN_TIME', '9:00'))
+DEFAULT_CLOSE = parse_minutes(os.environ.get('SLOT_CLOSE_TIME', '19:00'))
+DEFAULT_ROUNDING = int(os.environ.get('SLOT_ROUNDING_MINUTES', '10'))
+
+
+def span_mask(start, end):
+    """[start, end) 分のビットを立てたマスク"""
+    start = max(0, start)
+    end = min(MINUTES_PER_DAY, end)
+    if end <= start:
+        return 0
+    return ((1 << (end - start)) - 1) << start
+
+
+DAY_BYTES = MINUTES_PER_DAY // 8
+
+_heads_cache = {}
+
+
+def _day_heads(rounding):
+    """1日分の各枠の先頭ビット（0:00起点）をバイト列でキャッシュ"""
+    if MINUTES_PER_DAY % rounding:
+        raise ValueError(f'丸め単位{rounding}分は1日（{MINUTES_PER_DAY}分）を割り切れません')
+    if rounding not in _heads_cache:
+        heads = 0
+        for start in range(0, MINUTES_PER_DAY, rounding):
+            heads |= 1 << start
+        _heads_cache[rounding] = heads.to_bytes(DAY_BYTES, 'little')
+    return _heads_cache[rounding]
+
+
+def pack_days(bitmaps):
+    """1日分のビットマップのリストを1つの整数に連結（i番目は i*1440 ビット目から）"""
+    return int.from_bytes(b''.join(b.to_bytes(DAY_BYTES, 'little') for b in bitmaps), 'little')
+
+
+def unpack_days(packed, count):
+    data = packed.to_bytes(DAY_BYTES * count, 'little')
+    return [int.from_bytes(data[i * DAY_BYTES:(i + 1) * DAY_BYTES], 'little') for i in range(count)]
+
+
+def round_to_blocks(free, rounding=DEFAULT_ROUNDING, days=1):
+    """丸ごと空いているrounding分の枠だけを残す（daysはpack_daysで連結した日数）
+
+    1日の長さが丸め単位で割り切れるので、枠が日をまたぐことはなく、
+    連結した全スタッフ・全日分を同じシフト演算で一度に処理できる。
+    """
+    if rounding <= 1:
+        return free
+    # 先頭ビットから枠の最後まで全部空いているか（シフトしてAND）
+    whole = free
+    for i in range(1, rounding):
+        whole &= free >> i
+    heads = whole & int.from_bytes(_day_heads(rounding) * days, 'little')
+    # 先頭ビットを枠全体に戻す
+    rounded = heads
+    for i in range(1, rounding):
+        rounded |= heads << i
+    return rounded
+
+
+def iter_runs(bitmap):
+    """連続して立っているビットの (開始分, 終了分) を順に返す（区間数に比例した回数で済む）"""
+    while bitmap:
+        start = (bitmap & -bitmap).bit_length() - 1
+        # 開始位置から下を1で埋めて+1すると、連続部分の直後のビットまで繰り上がる
+        filled = bitmap | ((1 << start) - 1)
+        end = ((filled + 1) & -(filled + 1)).bit_length() - 1
+        yield start, end
+        bitmap &= -(1 << end)
+
+
+def block_heads(rounding):
+    """1日分の各枠の先頭ビット（rounding分刻みの開始時刻）"""
+    return int.from_bytes(_day_heads(rounding), 'little')
+
+
+def fitting_starts(free, duration, step=DEFAULT_ROUNDING):
+    """空きビットマップのうち、duration分が丸ごと入る開始分（step分刻み）のリスト
+
+    シフト幅を倍々にしてANDするので、duration分でもlog2(duration)回程度の演算で済む。
+    """
+    if duration <= 0 or not free:
+        return []
+    fits = free
+    covered = 1
+    while covered < duration:
+        shift = min(covered, duration - covered)
+        fits &= fits >> shift
+        covered += shift
+    fits &= block_heads(step)
+    starts = []
+    while fits:
+        low = fits & -fits
+        starts.append(low.bit_length() - 1)
+        fits ^= low
+    return starts
+
+
+def intervals_bitmap(slots):
+    """空き枠 [{'start': 'H:MM', 'end': 'H:MM'}] → 空きビットマップ"""
+    free = 0
+    for slot in slots or []:
+        start = parse_minutes(slot.get('start'))
+        end = parse_minutes(slot.get('end'))
+        if start is not None and end is not None:
+            free |= span_mask(start, end)
+    return free
+
+
+def busy_bitmap(time_zones):
+    """scheduleTimeZoneSettingの文字列（'["9:00","10:20"]'）のリスト → 予約済みビットマップ
+
+    json.loadsせず、先頭2つの時刻を正規表現で読む（1日数百件あるので解析コストを抑える）
+    """
+    busy = 0
+    for time_text in time_zones:
+        times = _TIME_RE.findall(time_text or '')
+        if len(times) < 2:
+            continue
+        start = int(times[0][0]) * 60 + int(times[0][1])
+        end = int(times[1][0]) * 60 + int(times[1][1])
+        busy |= span_mask(start, end)
+    return busy
+
+
+def open_bitmap(row, open_minute=None, close_minute=DEFAULT_CLOSE):
+    """スタッフ1行分の丸め前の空きビットマップ（営業時間 − 予約、休日は0）"""
+    if row.get('is_day_off'):
+        return 0
+    if open_minute is None:
+        open_minute = parse_minutes(row.get('first_time') or '')
+        if open_minute is None:
+            open_minute = DEFAULT_OPEN
+    return span_mask(open_minute, close_minute) & ~busy_bitmap(row.get('time_zones') or [])
+
+
+def free_intervals(bitmap):
+    """丸め済みビットマップ → 空き枠 [{'start': 'H:MM', 'end': 'H:MM'}]"""
+    return [{'start': format_minutes(s), 'end': format_minutes(e)} for s, e in iter_runs(bitmap)]
+
+
+def build_all_slots(schedules, open_minute=None, close_minute=DEFAULT_CLOSE, rounding=DEFAULT_ROUNDING):
+    """日付 → スケジュール の空き枠をまとめて計算（取得できなかった日はNoneのまま）
+
+    全日・全スタッフのビットマップを連結して丸めを1回で行う。
+    戻り値: 日付 → [{'staff_info', 'is_day_off', 'slots'}]（行とスタッフ一覧は先頭から対応）
+    """
+    entries = []
+    bitmaps = []
+    for date_str, schedule in schedules.items():
+        if schedule is None:
+            continue
+        for staff_info, row in zip(schedule['staff_list'], schedule['rows']):
+            entries.append((date_str, staff_info, bool(row.get('is_day_off'))))
+            bitmaps.append(open_bitmap(row, open_minute, close_minute))
+
+    rounded = unpack_days(round_to_blocks(pack_days(bitmaps), rounding, len(bitmaps)), len(bitmaps))
+
+    results = {date_str: (None if schedule is None else []) for date_str, schedule in schedules.items()}
+    for (date_str, staff_info, is_day_off), bitmap in zip(entries, rounded):
+        results[date_str].append({'staff_info': staff_info, 'is_day_off': is_day_off, 'slots': free_intervals(bitmap)})
+    return results
+
+
+def build_available_slots(schedule, **hours):
+    """1日分のスケジュール（スタッフ一覧と各行）→ スタッフごとの空き枠"""
+    return build_all_slots({None: schedule}, **hours)[None]
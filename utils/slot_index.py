@@ -0,0 +1,134 @@
+"""
+空き枠検索用のインデックス
+available_slotsテーブルを読み込み、日付・スタッフごとの空きビットマップを保持する。
+available_slotsの更新（updated_atの最大値 = ウォーターマークの変化）を検知したときだけ作り直すので、
+検索はメモリ上のビット演算だけで返せる。
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from utils.slot_engine import intervals_bitmap, fitting_starts, format_minutes
+
+# ウォーターマークを確認する間隔（秒）。この間は同じインデックスを使う
+WATERMARK_CHECK_SECONDS = int(os.environ.get('SLOT_INDEX_CHECK_SECONDS', '30'))
+
+JST = timezone(timedelta(hours=9))
+
+
+def fetch_slots_watermark(supabase_url, headers, timeout=10):
+    """available_slotsの最終更新時刻（updated_atの最大値、行がなければ空文字）"""
+    res = requests.get(
+        f'{supabase_url}/rest/v1/available_slots?select=updated_at&order=updated_at.desc&limit=1',
+        headers=headers,
+        timeout=timeout
+    )
+    res.raise_for_status()
+    rows = res.json()
+    return rows[0]['updated_at'] if rows else ''
+
+
+class SlotIndex:
+    """日付・スタッフごとの空きビットマップ"""
+
+    def __init__(self, rows, watermark=''):
+        self.watermark = watermark
+        self.built_at = time.time()
+        # 日付 → [(staff_id, staff_name, 空きビットマップ)]
+        self.days = {}
+        for row in sorted(rows, key=lambda r: (r.get('date') or '', str(r.get('staff_id') or ''))):
+            free = 0 if row.get('is_day_off') else intervals_bitmap(row.get('slots'))
+            self.days.setdefault(row.get('date'), []).append((row.get('staff_id'), row.get('staff_name'), free))
+        self._cache = {}
+
+    @classmethod
+    def load(cls, supabase_url, headers, watermark='', timeout=30):
+        """今日以降の行だけを読み込む（過去日の行はテーブルに残り続けるため）"""
+        today = datetime.now(JST).strftime('%Y%m%d')
+        res = requests.get(
+            f'{supabase_url}/rest/v1/available_slots?select=date,staff_id,staff_name,is_day_off,slots&date=gte.{today}',
+            headers=headers,
+            timeout=timeout
+        )
+        res.raise_for_status()
+        return cls(res.json(), watermark)
+
+    def _staff_starts(self, date_str, duration, step):
+        """日付ごとの各スタッフの開始可能時刻（所要時間・刻みごとにキャッシュ）"""
+        key = (date_str, duration, step)
+        if key not in self._cache:
+            self._cache[key] = [
+                (staff_id, staff_name, [format_minutes(m) for m in fitting_starts(free, duration, step)])
+                for staff_id, staff_name, free in self.days.get(date_str, [])
+            ]
+        return self._cache[key]
+
+    def search(self, duration, date_from=None, date_to=None, staff_id=None, step=10):
+        """duration分の施術が入る開始時刻を日付ごとに返す（空きのない日は含めない）
+
+        戻り値: {日付: {'starts': [全スタッフ合算], 'staff': [{'staff_id', 'staff_name', 'starts'}]}}
+        """
+        results = {}
+        for date_str in sorted(self.days):
+            if date_from and date_str < date_from:
+                continue
+            if date_to and date_str > date_to:
+                continue
+            staff = [
+                {'staff_id': sid, 'staff_name': name, 'starts': starts}
+                for sid, name, starts in self._staff_starts(date_str, duration, step)
+                if starts and (not staff_id or str(sid) == str(staff_id))
+            ]
+            if not staff:
+                continue
+            union = sorted({t for s in staff for t in s['starts']}, key=lambda t: (len(t), t))
+            results[date_str] = {'starts': union, 'staff': staff}
+        return results
+
+
+class WatermarkTracker:
+    """available_slotsのウォーターマークを最大check_seconds秒に1回だけ確認する（スレッドセーフ）"""
+
+    def __init__(self, check_seconds=WATERMARK_CHECK_SECONDS):
+        self.check_seconds = check_seconds
+        self.watermark = None
+        self.checked_at = 0
+        self._lock = threading.Lock()
+
+    def current(self, supabase_url, headers):
+        with self._lock:
+            now = time.time()
+            if self.watermark is None or now - self.checked_at >= self.check_seconds:
+                self.watermark = fetch_slots_watermark(supabase_url, headers)
+                self.checked_at = now
+            return self.watermark
+
+    def invalidate(self):
+        """次回のcurrentで必ず確認させる"""
+        with self._lock:
+            self.checked_at = 0
+
+
+class SlotIndexCache:
+    """ウォーターマークが変わったときだけSlotIndexを作り直す（スレッドセーフ）"""
+
+    def __init__(self, tracker=None):
+        self.tracker = tracker or WatermarkTracker()
+        self.index = None
+        self.rebuilds = 0
+        self._lock = threading.Lock()
+
+    def get(self, supabase_url, headers):
+        watermark = self.tracker.current(supabase_url, headers)
+        with self._lock:
+            if self.index is None or self.index.watermark != watermark:
+                self.index = SlotIndex.load(supabase_url, headers, watermark)
+                self.rebuilds += 1
+                print(f"[SLOT_INDEX] 再構築: {len(self.index.days)}日分（更新 {watermark or 'なし'}）", flush=True)
+            return self.index
+
+    def invalidate(self):
+        self.tracker.invalidate()
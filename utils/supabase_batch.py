@@ -0,0 +1,90 @@
+"""
+Supabase(PostgREST)へのまとめ書き込み
+行をためてJSON配列で一括POSTする。失敗したバッチは半分に分割して再送し、
+最終的に1行単位まで絞り込んで失敗行を特定する。
+"""
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_BATCH_SIZE = int(os.environ.get('SUPABASE_BATCH_SIZE', '100'))
+
+
+def supabase_session(supabase_key, pool_size=4):
+    """Supabase用の接続プール付きセッション"""
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+    session.headers.update({
+        'apikey': supabase_key,
+        'Authorization': f'Bearer {supabase_key}',
+        'Content-Type': 'application/json'
+    })
+    return session
+
+
+class SupabaseBatchWriter:
+    """テーブルへの行をためて一括upsert（on_conflict指定時）またはinsertする"""
+
+    def __init__(self, supabase_url, supabase_key, table, on_conflict=None,
+                 batch_size=DEFAULT_BATCH_SIZE, session=None, timeout=30):
+        self.url = f'{supabase_url}/rest/v1/{table}'
+        if on_conflict:
+            self.url += f'?on_conflict={on_conflict}'
+        self.table = table
+        self.batch_size = max(1, int(batch_size))
+        self.timeout = timeout
+        self.session = session or supabase_session(supabase_key)
+        self.prefer = 'resolution=merge-duplicates,return=minimal' if on_conflict else 'return=minimal'
+
+        self.pending = []
+        self.saved = 0
+        self.failed_rows = []
+        self.batches = []
+
+    def add(self, row):
+        self.pending.append(row)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """たまっている行を送信し、このflushで保存できた件数を返す"""
+        saved = 0
+        while self.pending:
+            batch = self.pending[:self.batch_size]
+            self.pending = self.pending[self.batch_size:]
+            batch_saved = self._send(batch)
+            self.batches.append({'size': len(batch), 'saved': batch_saved})
+            print(f"[BATCH] {self.table} #{len(self.batches)}: {len(batch)}件中{batch_saved}件保存", flush=True)
+            saved += batch_saved
+        return saved
+
+    def _send(self, rows):
+        """rowsを送信（失敗したら分割して再送）し、保存できた件数を返す"""
+        try:
+            res = self.session.post(self.url, headers={'Prefer': self.prefer}, json=rows, timeout=self.timeout)
+            ok = res.status_code in (200, 201, 204)
+            error = f'{res.status_code} {res.text[:200]}' if not ok else ''
+        except requests.RequestException as e:
+            ok = False
+            error = str(e)
+
+        if ok:
+            self.saved += len(rows)
+            return len(rows)
+
+        if len(rows) == 1:
+            print(f"[BATCH] {self.table} 保存失敗: {error}", flush=True)
+            self.failed_rows.append(rows[0])
+            return 0
+
+        middle = len(rows) // 2
+        return self._send(rows[:middle]) + self._send(rows[middle:])
+
+    def summary(self):
+        return {
+            'table': self.table,
+            'saved': self.saved,
+            'failed': len(self.failed_rows),
+            'batches': len(self.batches)
+        }
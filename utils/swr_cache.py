@@ -0,0 +1,234 @@
+"""
+stale-while-revalidate キャッシュ
+新しい結果はそのまま返し、古くなった結果も（max_stale以内なら）すぐ返しつつ裏で1回だけ再取得する。
+同じキーへの同時リクエストは1回の取得を共有する（single-flight）。
+保持するキーはmax_entries件まで（超えたら取得が古いものから捨てる）。
+sharedを渡すと、invalidateを同じファイルを見る他のプロセス（gunicornの他のワーカー）にも伝える。
+resultsを渡すと、取得はキーごとのファイルロックで1プロセスだけが行い、結果を他のプロセスと共有する。
+"""
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+import threading
+import time
+
+# 共有invalidateの記録を残す秒数（これより古い記録はどのキャッシュ結果よりも古い）
+SHARED_STAMP_TTL_SECONDS = 86400
+
+
+class _Flight:
+    """実行中の取得1回分（同じキーの待ち合わせ用）"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SharedInvalidations:
+    """invalidateした時刻をキーごとにJSONファイルで共有する（'*' は全件）
+
+    読む側はファイルの更新時刻が変わったときだけ読み直す
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stamps = {}
+        self.mtime = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self.mtime:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.stamps = json.load(f)
+            self.mtime = mtime
+        except (OSError, ValueError):
+            pass
+
+    def mark(self, key=None):
+        now = time.time()
+        with self._lock:
+            self.mtime = None
+            self._load()
+            self.stamps = {k: t for k, t in self.stamps.items() if now - t < SHARED_STAMP_TTL_SECONDS}
+            self.stamps['*' if key is None else key] = now
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.stamps, f)
+            os.replace(tmp_path, self.path)
+
+    def stamp(self, key):
+        """キー（または全件）が最後にinvalidateされた時刻（なければ0）"""
+        with self._lock:
+            self._load()
+            return max(self.stamps.get(key, 0), self.stamps.get('*', 0))
+
+
+class SharedResults:
+    """キーごとの取得結果（JSON）とロックファイルをディレクトリに置いてプロセス間で共有する
+
+    キーはファイル名に使える文字列であること（日付など）
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def lock(self, key):
+        fd = os.open(os.path.join(self.directory, f'{key}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def load(self, key):
+        """(value, 取得時刻) を返す（なければNone）"""
+        try:
+            with open(os.path.join(self.directory, f'{key}.json'), 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            return stored['value'], stored['fetched_at']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, key, value, fetched_at):
+        path = os.path.join(self.directory, f'{key}.json')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'value': value, 'fetched_at': fetched_at}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+class StaleWhileRevalidateCache:
+    """loader(key) → (value, cacheable) を呼んで結果をキーごとに保持する"""
+
+    def __init__(self, name, loader, fresh_seconds, max_stale_seconds, wait_timeout=120, max_entries=64, shared=None,
+                 results=None):
+        self.name = name
+        self.loader = loader
+        self.fresh_seconds = fresh_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self.wait_timeout = wait_timeout
+        self.max_entries = max_entries
+        self.shared = shared
+        self.results = results
+        self.entries = {}
+        # invalidateのたびに増やす。取得中にinvalidateされた結果は保存しない
+        self.generation = 0
+        self.flights = {}
+        self.stats = {'fresh': 0, 'stale': 0, 'miss': 0, 'shared': 0, 'refresh': 0, 'error': 0, 'from_results': 0}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """(value, state) を返す。stateは 'fresh' / 'stale' / 'miss' / 'shared'"""
+        now = time.time()
+        shared_stamp = self.shared.stamp(key) if self.shared else 0
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and entry[1] <= shared_stamp:
+                # 他のプロセスでinvalidateされた
+                del self.entries[key]
+                entry = None
+            age = now - entry[1] if entry else None
+            if entry and age < self.fresh_seconds:
+                self.stats['fresh'] += 1
+                return entry[0], 'fresh'
+            if entry and age < self.max_stale_seconds:
+                self.stats['stale'] += 1
+                if key not in self.flights:
+                    flight = self.flights[key] = _Flight()
+                    threading.Thread(target=self._run, args=(key, flight), daemon=True).start()
+                return entry[0], 'stale'
+
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+            self.stats['miss' if leader else 'shared'] += 1
+
+        if leader:
+            self._run(key, flight)
+        elif not flight.done.wait(self.wait_timeout):
+            raise TimeoutError(f'{self.name}: {key} の取得待ちがタイムアウト')
+        if flight.error is not None:
+            raise flight.error
+        return flight.value, 'miss' if leader else 'shared'
+
+    def _run(self, key, flight):
+        with self._lock:
+            generation = self.generation
+        started = time.time()
+        try:
+            value, cacheable, fetched_at = self._load(key)
+            flight.value = value
+            shared_stamp = self.shared.stamp(key) if self.shared else 0
+            with self._lock:
+                self.stats['refresh'] += 1
+                if cacheable and generation == self.generation and shared_stamp < min(started, fetched_at):
+                    self.entries[key] = (value, fetched_at)
+                    self._evict()
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self.stats['error'] += 1
+            print(f"[CACHE] {self.name} {key} 取得エラー: {e}", flush=True)
+        finally:
+            with self._lock:
+                self.flights.pop(key, None)
+            flight.done.set()
+
+    def _load(self, key):
+        """(value, cacheable, 取得時刻) を返す。resultsがあれば他のプロセスの新しい結果を使う"""
+        if self.results is None:
+            value, cacheable = self.loader(key)
+            return value, cacheable, time.time()
+        with self.results.lock(key):
+            stored = self.results.load(key)
+            shared_stamp = self.shared.stamp(key) if self.shared else 0
+            if stored and time.time() - stored[1] < self.fresh_seconds and stored[1] > shared_stamp:
+                with self._lock:
+                    self.stats['from_results'] += 1
+                return stored[0], True, stored[1]
+            value, cacheable = self.loader(key)
+            fetched_at = time.time()
+            if cacheable:
+                try:
+                    self.results.save(key, value, fetched_at)
+                except (OSError, TypeError, ValueError) as e:
+                    print(f"[CACHE] {self.name} {key} 共有結果の書き込みエラー: {e}", flush=True)
+            return value, cacheable, fetched_at
+
+    def _evict(self):
+        """max_entriesを超えた分を取得が古い順に捨てる（ロック内で呼ぶ）"""
+        while len(self.entries) > self.max_entries:
+            oldest = min(self.entries, key=lambda k: self.entries[k][1])
+            del self.entries[oldest]
+
+    def invalidate(self, key=None):
+        """キーの結果を破棄（Noneなら全件）。次回は取得し直す"""
+        with self._lock:
+            self.generation += 1
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+        if self.shared:
+            try:
+                self.shared.mark(key)
+            except OSError as e:
+                print(f"[CACHE] {self.name} 共有invalidateの書き込みエラー: {e}", flush=True)
+
+    def age(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+        return time.time() - entry[1] if entry else None